@@ -1,24 +1,82 @@
-import datetime
 import json
 import time
+from typing import TYPE_CHECKING
 
 import common
+import metrics
+from rate_limiter import RateLimiter
+
+if TYPE_CHECKING:
+    from openai import RateLimitError
 
 MODEL = "gpt-4o-mini"
 MODEL_CPM = 500
-TIME_BETWEEN_CALLS = 60 / MODEL_CPM
+MODEL_TPM = 200_000
+# Attempts of a rating after the API answers with 429.
+MAX_RATE_LIMIT_RETRIES = 5
+# Retries of a rating after a connection error or a 5xx, like the retries of the openai client that are turned off.
+MAX_SERVER_ERROR_RETRIES = 2
+# Seconds before the first retry after a server error, doubled on every retry.
+SERVER_ERROR_BACKOFF_SECONDS = 0.5
+
+RATING_TOKEN_LIMIT = 550
+RATING_TEMPERATURE = 0.5
+RATING_SYSTEM_PROMPT = [
+    {
+        "role": "system",
+        "content": """
+        You are an expert job matching assistant specialized in evaluating candidates with minimal professional experience.
+        
+        Task: Rate how well the resume matches the job description, from 0 to 10. Explain the rating in up to 200 words.
+
+        Instructions:
+        1. DO NOT imagine, invent, or fabricate any information.
+        2. Consider alternative qualifications (e.g., academic achievements, internships, projects, transferable skills, overall potential) for candidates with limited experience.
+        3. Prioritize "MUST have" requirements. Be flexible with "NICE to have" requirements.
+        4. Provide constructive feedback where experience is lacking, and highlight compensating strengths.
+        5. Fill in the following values if available (DO NOT make them up):
+           - Interval: {"interval": "[yearly, monthly, hourly, etc.] period that applies to min/max_amount"}
+           - Compensation: {"min_amount": 0, "max_amount": 0, "currency": "USD or other cur code"}
+           - Work Type: {"is_remote": false/true}
+        6. Include relevant additional data for the candidate using the following format:
+           - {"display_data": [{"label": "display text"}]}
+           - Examples: relevant coursework, skill matches, project experience.
 
-# Initialize Logger, Supabase and OpenAI
+        JSON Output Template:
+        {
+            "rating": 0,
+            "justification": "justification",
+            "display_data": [{"label": "", "content": ""}],
+            "interval": "[yearly, monthly, hourly, etc.] period that applies to min/max_amount",
+            "min_amount": 0,
+            "max_amount": 0,
+            "currency": "USD or other cur code",
+            "is_remote": false/true
+        }
+        """,
+    }
+]
+
+# Grouped ratings send the resume once together with several jobs, sized to fit these budgets.
+GROUP_INPUT_TOKEN_BUDGET = 12_000
+GROUP_OUTPUT_TOKEN_BUDGET = 8_000
+GROUP_MAX_SIZE = 10
+RATING_GROUP_SYSTEM_PROMPT = [
+    {
+        "role": "system",
+        "content": RATING_SYSTEM_PROMPT[0]["content"]
+        + """
+    You will receive one resume and several numbered jobs. Rate the resume against every job separately.
+    Reply with a JSON object {"ratings": [...]} whose array has one object following the JSON Output Template per
+    job, in the same order as the jobs, each with an additional "job" field holding the number of the job.
+    """,
+    }
+]
+
+# Initialize Logger
 logger = common.get_logger()
-openai = common.get_openai_client()
-time_last_call = datetime.datetime.now()
-print(
-    openai.chat.completions.create(
-        model=MODEL,
-        messages=[{"role": "system", "content": "Hello there"}],
-        max_tokens=200,
-    )
-)
+# Shared by every thread doing calls to the model.
+rate_limiter = RateLimiter(MODEL_CPM, MODEL_TPM)
 
 
 def _generate_response(
@@ -63,85 +121,235 @@ def _generate_response(
     return job_data, rating_data
 
 
+def estimate_tokens(text: str) -> int:
+    """
+    Rough amount of tokens of the text, good enough to budget requests before sending them.
+    """
+    return len(text) // 4 + 1
+
+
+def _retry_after(error: "RateLimitError") -> float | None:
+    try:
+        return float(error.response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _create_completion(estimated_tokens: int, **kwargs):
+    """
+    Calls the chat completions API once the rate limiter allows it, retrying with backoff when rate limited and after
+    connection errors or 5xx answers. Safe to call from multiple threads.
+    """
+    from openai import APIConnectionError, APIStatusError, RateLimitError
+
+    openai = common.get_openai_client()
+    attempt = 0
+    server_errors = 0
+    while True:
+        rate_limiter.acquire(estimated_tokens)
+        start = time.perf_counter()
+        try:
+            # Retries are handled here so that every 429 reaches the shared rate limiter.
+            response = openai.with_options(max_retries=0).chat.completions.create(
+                **kwargs
+            )
+        except RateLimitError as e:
+            metrics.LLM_SECONDS.observe(
+                time.perf_counter() - start, result="rate_limited"
+            )
+            metrics.LLM_REQUESTS.inc(result="rate_limited")
+            rate_limiter.on_rate_limited(_retry_after(e))
+            attempt += 1
+            if attempt == MAX_RATE_LIMIT_RETRIES:
+                raise
+            continue
+        except (APIConnectionError, APIStatusError) as e:
+            metrics.LLM_SECONDS.observe(time.perf_counter() - start, result="error")
+            metrics.LLM_REQUESTS.inc(result="error")
+            if (
+                isinstance(e, APIStatusError) and e.status_code < 500
+            ) or server_errors == MAX_SERVER_ERROR_RETRIES:
+                raise
+            time.sleep(SERVER_ERROR_BACKOFF_SECONDS * 2**server_errors)
+            server_errors += 1
+            continue
+        except Exception:
+            metrics.LLM_SECONDS.observe(time.perf_counter() - start, result="error")
+            metrics.LLM_REQUESTS.inc(result="error")
+            raise
+        metrics.LLM_SECONDS.observe(time.perf_counter() - start, result="ok")
+        metrics.LLM_REQUESTS.inc(result="ok")
+        rate_limiter.on_success()
+        if response.usage:
+            metrics.LLM_TOKENS.inc(response.usage.prompt_tokens, kind="prompt")
+            metrics.LLM_TOKENS.inc(response.usage.completion_tokens, kind="completion")
+            rate_limiter.record_usage(estimated_tokens, response.usage.total_tokens)
+        return response
+
+
+def build_rating_request(candidate_data: str) -> dict:
+    """
+    Arguments of the chat completion that rates the candidate data, also used as the body of batch requests.
+    """
+    return {
+        "model": MODEL,
+        "messages": RATING_SYSTEM_PROMPT
+        + [{"role": "user", "content": candidate_data}],
+        "max_tokens": RATING_TOKEN_LIMIT,
+        "n": 1,
+        "stop": None,
+        "temperature": RATING_TEMPERATURE,
+    }
+
+
+def parse_rating_response(content: str, request: dict) -> tuple[dict, dict]:
+    """
+    Parses the content answered by the model to the rating request.
+    :return: Tuple of (job_data, rating_data).
+    """
+    response_object = json.loads(content)
+    system_prompt = request["messages"][:-1]
+    user_prompt = request["messages"][-1:]
+    return _generate_response(
+        response_object=response_object,
+        model=request["model"],
+        token_limit=request["max_tokens"],
+        system_prompt=system_prompt,
+        user_prompt=user_prompt,
+        temperature=request["temperature"],
+    )
+
+
 def generate_rating(candidate_data: str) -> tuple[dict, dict] | None:
-    global time_last_call
-    time_now = datetime.datetime.now()
-    time_diff = (time_now - time_last_call).total_seconds()
-    if time_diff < TIME_BETWEEN_CALLS:
-        logger.info(f"Waiting for next request: {TIME_BETWEEN_CALLS - time_diff}")
-        time.sleep(TIME_BETWEEN_CALLS - time_diff)
-    time_last_call = datetime.datetime.now()
-
-    model = MODEL
-    token_limit = 550
-    system_prompt = [
-        {
-            "role": "system",
-            "content": """
-        You are an expert job matching assistant specialized in evaluating candidates with minimal professional experience.
-        
-        Task: Rate how well the resume matches the job description, from 0 to 10. Explain the rating in up to 200 words.
+    request = build_rating_request(candidate_data)
+    estimated_tokens = (
+        estimate_tokens(RATING_SYSTEM_PROMPT[0]["content"])
+        + estimate_tokens(candidate_data)
+        + request["max_tokens"]
+    )
 
-        Instructions:
-        1. DO NOT imagine, invent, or fabricate any information.
-        2. Consider alternative qualifications (e.g., academic achievements, internships, projects, transferable skills, overall potential) for candidates with limited experience.
-        3. Prioritize "MUST have" requirements. Be flexible with "NICE to have" requirements.
-        4. Provide constructive feedback where experience is lacking, and highlight compensating strengths.
-        5. Fill in the following values if available (DO NOT make them up):
-           - Interval: {"interval": "[yearly, monthly, hourly, etc.] period that applies to min/max_amount"}
-           - Compensation: {"min_amount": 0, "max_amount": 0, "currency": "USD or other cur code"}
-           - Work Type: {"is_remote": false/true}
-        6. Include relevant additional data for the candidate using the following format:
-           - {"display_data": [{"label": "display text"}]}
-           - Examples: relevant coursework, skill matches, project experience.
+    try:
+        response = _create_completion(estimated_tokens, **request)
+        return parse_rating_response(response.choices[0].message.content, request)
 
-        JSON Output Template:
-        {
-            "rating": 0,
-            "justification": "justification",
-            "display_data": [{"label": "", "content": ""}],
-            "interval": "[yearly, monthly, hourly, etc.] period that applies to min/max_amount",
-            "min_amount": 0,
-            "max_amount": 0,
-            "currency": "USD or other cur code",
-            "is_remote": false/true
-        }
-        """,
-        }
-    ]
+    except Exception as e:
+        logger.error(f"OpenAI API error: {str(e)}")
+        return None
+
+
+def plan_rating_groups(job_tokens: list[int], resume_tokens: int) -> list[list[int]]:
+    """
+    Splits the jobs of a resume into groups that fit the input and output token budgets of a grouped rating.
+    :param job_tokens: amount of tokens of each job.
+    :param resume_tokens: amount of tokens of the resume.
+    :return: List of groups with the indexes of their jobs.
+    """
+    base_tokens = (
+        estimate_tokens(RATING_GROUP_SYSTEM_PROMPT[0]["content"]) + resume_tokens
+    )
+    max_size = max(
+        1, min(GROUP_MAX_SIZE, GROUP_OUTPUT_TOKEN_BUDGET // RATING_TOKEN_LIMIT)
+    )
+    groups: list[list[int]] = []
+    group: list[int] = []
+    group_tokens = base_tokens
+    for i, tokens in enumerate(job_tokens):
+        if group and (
+            len(group) >= max_size or group_tokens + tokens > GROUP_INPUT_TOKEN_BUDGET
+        ):
+            groups.append(group)
+            group, group_tokens = [], base_tokens
+        group.append(i)
+        group_tokens += tokens
+    if group:
+        groups.append(group)
+    return groups
 
+
+def build_group_candidate_data(resume_content: str, jobs: list[tuple[str, str]]) -> str:
+    jobs_data = "".join(
+        f"""
+            \n\nJob {i + 1}
+            \n\nJob Title: {title}
+            \n\nJob Description: {description}
+            """
+        for i, (title, description) in enumerate(jobs)
+    )
+    return f"""{jobs_data}
+            \n\nResume: {resume_content}
+            """
+
+
+def generate_group_rating(
+    resume_content: str, jobs: list[tuple[str, str]]
+) -> list[tuple[dict, dict]] | None:
+    """
+    Rates the resume against several jobs with a single completion, so the resume and the system prompt are only sent
+    once.
+    :param jobs: list of (title, description) of the jobs.
+    :return: One (job_data, rating_data) per job in the same order, None if the answer could not be matched to the
+    jobs, in which case they should be rated one by one.
+    """
+    candidate_data = build_group_candidate_data(resume_content, jobs)
+    token_limit = RATING_TOKEN_LIMIT * len(jobs)
+    system_prompt = RATING_GROUP_SYSTEM_PROMPT
     user_prompt = [{"role": "user", "content": candidate_data}]
-    temperature = 0.5
+    estimated_tokens = (
+        estimate_tokens(system_prompt[0]["content"])
+        + estimate_tokens(candidate_data)
+        + token_limit
+    )
 
     try:
-        response = openai.chat.completions.create(
-            model=model,
+        response = _create_completion(
+            estimated_tokens,
+            model=MODEL,
             messages=system_prompt + user_prompt,
             max_tokens=token_limit,
             n=1,
             stop=None,
-            temperature=temperature,
+            temperature=RATING_TEMPERATURE,
         )
-
         response_object = json.loads(response.choices[0].message.content)
+    except Exception as e:
+        logger.error(f"OpenAI API error: {str(e)}")
+        return None
+
+    ratings = (
+        response_object.get("ratings")
+        if isinstance(response_object, dict)
+        else response_object
+    )
+    if not isinstance(ratings, list) or len(ratings) != len(jobs):
+        logger.error(f"Grouped rating returned a malformed array for {len(jobs)} jobs.")
+        return None
+    # Answers with job numbers are put back in order, the ones without are trusted to be in order already.
+    if all(isinstance(r, dict) and isinstance(r.get("job"), int) for r in ratings):
+        ratings = sorted(ratings, key=lambda r: r["job"])
+        if [r["job"] for r in ratings] != list(range(1, len(jobs) + 1)):
+            logger.error("Grouped rating returned unexpected job numbers.")
+            return None
+    if not all(isinstance(r, dict) and "rating" in r for r in ratings):
+        logger.error("Grouped rating returned entries without a rating.")
+        return None
 
-        return _generate_response(
-            response_object=response_object,
-            model=model,
+    return [
+        _generate_response(
+            response_object=rating,
+            model=MODEL,
             token_limit=token_limit,
             system_prompt=system_prompt,
             user_prompt=user_prompt,
-            temperature=temperature,
+            temperature=RATING_TEMPERATURE,
         )
-
-    except Exception as e:
-        logger.error(f"OpenAI API error: {str(e)}")
-        return None
+        for rating in ratings
+    ]
 
 
 def clean_resume(content: str) -> dict[str] | None:
     try:
-        response = openai.chat.completions.create(
+        response = _create_completion(
+            estimate_tokens(content) + 1024,
             model=MODEL,
             messages=[
                 {
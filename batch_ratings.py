@@ -0,0 +1,307 @@
+import json
+import os
+import time
+import uuid
+from types import SimpleNamespace
+from typing import TYPE_CHECKING
+
+import common
+import my_types
+import processor
+import rating_queue
+from ai_calls import build_rating_request, parse_rating_response
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+logger = common.get_logger()
+
+BATCH_DIRECTORY = os.path.join(".cache", "batches")
+# Keeps the batch in flight, so an interrupted run resumes it instead of submitting a new one.
+BATCH_STATE_PATH = os.path.join(BATCH_DIRECTORY, "state.json")
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_POLL_INTERVAL = 60
+BATCH_FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+# Max requests of a single batch allowed by the API.
+BATCH_MAX_REQUESTS = 50_000
+# Queued pairs stay leased for longer than the completion window, so no other worker rates them meanwhile.
+BATCH_LEASE_SECONDS = 25 * 60 * 60
+
+
+class LocalBatchClient:
+    """
+    Stand-in for the batch endpoint of the OpenAI client, runs every request of a batch with the regular chat
+    completions API as soon as it is created. Meant for testing the batch mode without waiting for a real batch.
+    """
+
+    def __init__(self, client: "OpenAI"):
+        self._client = client
+        self._files: dict[str, str] = {}
+        self._batches: dict[str, SimpleNamespace] = {}
+        self.files = SimpleNamespace(create=self._create_file, content=self._content)
+        self.batches = SimpleNamespace(
+            create=self._create_batch, retrieve=self._batches.__getitem__
+        )
+
+    def _create_file(self, file, purpose: str) -> SimpleNamespace:
+        file_id = f"file-{uuid.uuid4().hex}"
+        self._files[file_id] = file.read().decode()
+        return SimpleNamespace(id=file_id)
+
+    def _content(self, file_id: str) -> SimpleNamespace:
+        return SimpleNamespace(text=self._files[file_id])
+
+    def _create_batch(
+        self, input_file_id: str, endpoint: str, completion_window: str
+    ) -> SimpleNamespace:
+        outputs, errors = [], []
+        for line in self._files[input_file_id].splitlines():
+            request = json.loads(line)
+            try:
+                response = self._client.chat.completions.create(**request["body"])
+                outputs.append(
+                    {
+                        "custom_id": request["custom_id"],
+                        "response": {"status_code": 200, "body": response.to_dict()},
+                        "error": None,
+                    }
+                )
+            except Exception as e:
+                errors.append(
+                    {
+                        "custom_id": request["custom_id"],
+                        "response": None,
+                        "error": {"message": str(e)},
+                    }
+                )
+        output_file_id = f"file-{uuid.uuid4().hex}"
+        self._files[output_file_id] = "\n".join(json.dumps(o) for o in outputs)
+        error_file_id = f"file-{uuid.uuid4().hex}"
+        self._files[error_file_id] = "\n".join(json.dumps(e) for e in errors)
+        batch = SimpleNamespace(
+            id=f"batch-{uuid.uuid4().hex}",
+            status="completed",
+            output_file_id=output_file_id,
+            error_file_id=error_file_id,
+        )
+        self._batches[batch.id] = batch
+        return batch
+
+
+def _load_state() -> dict | None:
+    if not os.path.exists(BATCH_STATE_PATH):
+        return None
+    with open(BATCH_STATE_PATH, "r") as file:
+        return json.load(file)
+
+
+def _save_state(state: dict | None) -> None:
+    if state is None:
+        if os.path.exists(BATCH_STATE_PATH):
+            os.remove(BATCH_STATE_PATH)
+        return
+    os.makedirs(BATCH_DIRECTORY, exist_ok=True)
+    tmp_path = f"{BATCH_STATE_PATH}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(state, file)
+    os.replace(tmp_path, BATCH_STATE_PATH)
+
+
+def _write_batch_file(requests: dict[str, dict], path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        for custom_id, body in requests.items():
+            file.write(
+                json.dumps(
+                    {
+                        "custom_id": custom_id,
+                        "method": "POST",
+                        "url": BATCH_ENDPOINT,
+                        "body": body,
+                    }
+                )
+                + "\n"
+            )
+
+
+def _submit_batch(
+    missing_ratings: my_types.MissingRatingEntryList, client
+) -> tuple[dict, int]:
+    """
+    Writes one rating request per near duplicate cluster to a JSONL file and submits it as a batch.
+    Clusters already rated or found in the rating cache are stored right away instead.
+    :return: Tuple of the state of the submitted batch, with everything needed to store its results after an
+    interruption, and the amount of ratings stored right away.
+    """
+    prepared = processor._prepare(missing_ratings)
+    if prepared is None:
+        return {}, 0
+    jobs, resume_cache, clusters, cluster_ratings, _ = prepared
+
+    known_results = []
+    requests: dict[str, dict] = {}
+    entries: dict[str, dict] = {}
+    for (cluster_id, resume_id), cluster in clusters.items():
+        job = jobs[cluster[0]["job_id"]]
+        resume = resume_cache[resume_id]
+        result, rated_job_id = cluster_ratings.get((cluster_id, resume_id)), None
+        if result is None:
+            result = processor.rating_cache.get(
+                processor._rating_cache_key(job, resume)
+            )
+            rated_job_id = job["id"]
+        if result is not None:
+            known_results += processor._cluster_results(
+                cluster, resume, *result, rated_job_id
+            )
+            continue
+        custom_id = f"{job['id']}:{resume_id}"
+        requests[custom_id] = build_rating_request(
+            processor._candidate_data(job, resume)
+        )
+        entries[custom_id] = {"job": job, "resume": resume, "cluster": cluster}
+
+    stored = processor._store_ratings(known_results) if known_results else 0
+    if not requests:
+        return {}, stored
+
+    input_path = os.path.join(BATCH_DIRECTORY, f"{uuid.uuid4().hex}.jsonl")
+    _write_batch_file(requests, input_path)
+    with open(input_path, "rb") as file:
+        input_file = client.files.create(file=file, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window=BATCH_COMPLETION_WINDOW,
+    )
+    state = {
+        "batch_id": batch.id,
+        "input_path": input_path,
+        "requests": requests,
+        "entries": entries,
+    }
+    _save_state(state)
+    logger.info(f"Submitted batch {batch.id} with {len(requests)} rating requests.")
+    return state, stored
+
+
+def _wait_for_batch(batch_id: str, client, poll_interval: float):
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status in BATCH_FINAL_STATUSES:
+            return batch
+        logger.info(f"Batch {batch_id} is {batch.status}, waiting {poll_interval}s.")
+        time.sleep(poll_interval)
+
+
+def _store_batch_results(batch, state: dict, client) -> int:
+    """
+    Parses the output of the batch and bulk stores the ratings. Requests that failed are left missing, so the next
+    run picks them up again.
+    :return: Amount of ratings stored.
+    """
+    results = []
+    failed = 0
+    output = ""
+    if getattr(batch, "output_file_id", None):
+        output = client.files.content(batch.output_file_id).text
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        line = json.loads(line)
+        entry = state["entries"].get(line["custom_id"])
+        response = line.get("response") or {}
+        if entry is None or response.get("status_code") != 200:
+            failed += 1
+            continue
+        request = state["requests"][line["custom_id"]]
+        try:
+            job_data, rating_data = parse_rating_response(
+                response["body"]["choices"][0]["message"]["content"], request
+            )
+        except Exception as e:
+            logger.error(f"Error parsing batch result {line['custom_id']}: {str(e)}")
+            failed += 1
+            continue
+        processor.rating_cache.put(
+            processor._rating_cache_key(entry["job"], entry["resume"]),
+            job_data,
+            rating_data,
+        )
+        results += processor._cluster_results(
+            entry["cluster"], entry["resume"], job_data, rating_data, entry["job"]["id"]
+        )
+
+    if getattr(batch, "error_file_id", None):
+        errors = client.files.content(batch.error_file_id).text
+        failed += sum(1 for line in errors.splitlines() if line.strip())
+    if failed:
+        logger.error(
+            f"{failed} requests of batch {batch.id} failed, they will be retried."
+        )
+    return processor._store_ratings(results) if results else 0
+
+
+def process_missing_ratings_batch(
+    missing_ratings: my_types.MissingRatingEntryList,
+    client=None,
+    poll_interval: float = BATCH_POLL_INTERVAL,
+) -> int:
+    """
+    Offline alternative to processor.process_missing_ratings: rates the missing ratings with a single batch job,
+    waits for it to finish and bulk stores the results. A batch left in flight by an interrupted run is resumed first.
+    :param client: OpenAI client or a LocalBatchClient, defaults to the shared OpenAI client.
+    :return: Amount of ratings stored.
+    """
+    if client is None:
+        client = common.get_openai_client()
+
+    stored = 0
+    state = _load_state()
+    if state:
+        # The missing ratings of this run that are not part of the resumed batch are picked up by the next one.
+        logger.info(f"Resuming batch {state['batch_id']}.")
+    else:
+        state, stored = _submit_batch(missing_ratings, client)
+        if not state:
+            return stored
+
+    batch = _wait_for_batch(state["batch_id"], client, poll_interval)
+    if batch.status != "completed":
+        # Expired or cancelled batches still keep the output of the requests that finished.
+        logger.error(f"Batch {batch.id} ended as {batch.status}.")
+    stored += _store_batch_results(batch, state, client)
+    _save_state(None)
+    if os.path.exists(state["input_path"]):
+        os.remove(state["input_path"])
+    logger.info(f"Stored {stored} ratings from batch {batch.id}.")
+    return stored
+
+
+def process_rating_queue_batch(
+    client=None,
+    poll_interval: float = BATCH_POLL_INTERVAL,
+    max_ratings: int | None = None,
+) -> int:
+    """
+    Batch mode over rating_queue: claims up to BATCH_MAX_REQUESTS queued pairs, rates them with a single batch job and
+    acknowledges them. A batch left in flight by an interrupted run is finished first, its pairs are still leased by
+    that run and are removed from the queue once the lease expires, since they are rated by then.
+    :param max_ratings: max amount of queued pairs to claim, BATCH_MAX_REQUESTS at most.
+    :return: Amount of ratings stored.
+    """
+    stored = 0
+    if _load_state():
+        stored += process_missing_ratings_batch([], client, poll_interval)
+
+    owner = rating_queue.new_worker_id()
+    batch_size = min(BATCH_MAX_REQUESTS, max_ratings or BATCH_MAX_REQUESTS)
+    missing_ratings = rating_queue.claim(owner, batch_size, BATCH_LEASE_SECONDS)
+    if not missing_ratings:
+        return stored
+    try:
+        stored += process_missing_ratings_batch(missing_ratings, client, poll_interval)
+    finally:
+        rating_queue.ack(owner)
+    return stored
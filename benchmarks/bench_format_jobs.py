@@ -0,0 +1,124 @@
+"""
+Benchmark of scraper._format_jobs against the previous row by row implementation, on a JobSpy like dataframe.
+Run from the repository root: python -m benchmarks.bench_format_jobs [rows]
+"""
+
+import sys
+import time
+from datetime import date, datetime
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from scraper import _format_jobs
+
+DEFAULT_ROWS = 10_000
+DESCRIPTION_WORDS = 600
+REPEATS = 5
+
+
+def _format_jobs_rows(jobs_df: pd.DataFrame) -> list[dict]:
+    """
+    Row by row implementation _format_jobs replaced, datetimes are formatted like it does.
+    """
+    expected_keys = {
+        "site": Optional[str],
+        "job_url": Optional[str],
+        "job_url_direct": Optional[str],
+        "title": Optional[str],
+        "company": Optional[str],
+        "location": Optional[str],
+        "job_type": Optional[str],
+        "date_posted": Optional[datetime],
+        "interval": Optional[str],
+        "min_amount": Optional[str],
+        "max_amount": Optional[str],
+        "currency": Optional[str],
+        "is_remote": Optional[bool],
+        "job_function": Optional[str],
+        "emails": Optional[str],
+        "description": Optional[str],
+        "company_url": Optional[str],
+        "logo_photo_url": Optional[str],
+        "site_id": Optional[str],
+        "matched_words": Optional[str],
+        "job_level": Optional[str],
+    }
+    filtered_jobs = []
+    for job_raw in jobs_df.to_dict("records"):
+        job_raw["site_id"] = job_raw["id"]
+        filtered_job = {}
+        for key, expected_type in expected_keys.items():
+            value = job_raw.pop(key, None)
+            if isinstance(value, datetime):
+                try:
+                    filtered_job[key] = value.strftime("%Y-%m-%d")
+                except ValueError:
+                    filtered_job[key] = None
+            elif value is None or isinstance(value, expected_type):
+                filtered_job[key] = value
+            else:
+                filtered_job[key] = None
+        filtered_jobs.append(filtered_job)
+    return filtered_jobs
+
+
+def make_jobs_df(rows: int) -> pd.DataFrame:
+    random = np.random.RandomState(0)
+    words = np.array(["python", "sql", "team", "remote", "data", "cloud", "senior"])
+    description = " ".join(random.choice(words, DESCRIPTION_WORDS))
+    posted = pd.Series(pd.date_range("2024-01-01", periods=rows, freq="min"))
+    posted[random.rand(rows) < 0.1] = pd.NaT
+    return pd.DataFrame(
+        {
+            "id": [f"in-{i}" for i in range(rows)],
+            "site": "indeed",
+            "job_url": [f"https://www.indeed.com/viewjob?jk={i}" for i in range(rows)],
+            "job_url_direct": None,
+            "title": "Data Engineer",
+            "company": "Company",
+            "location": "Madrid, Spain",
+            "job_type": random.choice(["fulltime", None], rows),
+            "date_posted": posted,
+            "interval": random.choice(["yearly", np.nan], rows),
+            "min_amount": random.choice([50_000.0, np.nan], rows),
+            "max_amount": random.choice([70_000.0, np.nan], rows),
+            "currency": random.choice(["EUR", np.nan], rows),
+            "is_remote": random.choice([True, False, None], rows),
+            "job_level": None,
+            "job_function": None,
+            "company_industry": "Software",
+            "emails": None,
+            "description": [f"{description} {i}" for i in range(rows)],
+            "company_url": "https://www.indeed.com/cmp/company",
+            "logo_photo_url": None,
+            "banner_photo_url": None,
+            "ceo_name": None,
+            "company_addresses": date(2024, 1, 1),
+        }
+    )
+
+
+def _best_time(function, jobs_df: pd.DataFrame) -> float:
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function(jobs_df)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(rows: int = DEFAULT_ROWS):
+    jobs_df = make_jobs_df(rows)
+    assert _format_jobs(jobs_df) == _format_jobs_rows(jobs_df)
+    rows_time = _best_time(_format_jobs_rows, jobs_df)
+    columns_time = _best_time(_format_jobs, jobs_df)
+    print(f"_format_jobs on {rows} rows, best of {REPEATS}:")
+    print(f"  row by row:       {rows_time * 1000:8.1f} ms")
+    print(f"  column by column: {columns_time * 1000:8.1f} ms")
+    print(f"  speedup:          {rows_time / columns_time:8.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROWS)
@@ -0,0 +1,211 @@
+"""
+End-to-end benchmark of main.scrape_it and main.process_it against the local stand-ins of benchmarks.fakes, at
+several scales. Reports jobs scraped per second, ratings stored per second, database round trips per job and rating,
+model calls and peak memory of every stage.
+Run from the repository root: python -m benchmarks.bench_pipeline [--scales small,medium] [--llm-latency 0.2]
+"""
+
+import argparse
+import datetime
+import logging
+import os
+import random
+import resource
+import tempfile
+import time
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "benchmark.benchmark.benchmark")
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from benchmarks import fakes
+
+# Users, searches per user and results_wanted of every scale.
+SCALES = {
+    "small": {"users": 5, "searches_per_user": 2, "results_wanted": 20},
+    "medium": {"users": 20, "searches_per_user": 2, "results_wanted": 50},
+    "large": {"users": 50, "searches_per_user": 3, "results_wanted": 100},
+}
+# Searches are drawn from these, so users share some of them like they do in production.
+SEARCH_TERMS = [
+    "python developer",
+    "data engineer",
+    "backend engineer",
+    "data analyst",
+    "devops engineer",
+]
+LOCATIONS = ["Madrid, Spain", "Barcelona, Spain", "Remote"]
+JOB_SOURCES = ["indeed", "linkedin", "indeed,linkedin"]
+
+
+def seed(
+    store: fakes.FakeStore, users: int, searches_per_user: int, results_wanted: int
+) -> None:
+    generator = random.Random(0)
+    now = datetime.datetime.now(datetime.UTC)
+    for user in range(users):
+        user_id = f"user-{user}"
+        store.insert(
+            "resume",
+            {
+                "user_id": user_id,
+                "content": " ".join(
+                    generator.choices(fakes.FakeJobBoard.VOCABULARY, k=400)
+                ),
+                "is_active": True,
+                "date_uploaded": now,
+                "updated_at": now,
+            },
+        )
+        for _ in range(searches_per_user):
+            store.insert(
+                "search",
+                {
+                    "user_id": user_id,
+                    "job_source": generator.choice(JOB_SOURCES),
+                    "search_term": generator.choice(SEARCH_TERMS),
+                    "location": generator.choice(LOCATIONS),
+                    "results_wanted": results_wanted,
+                    "country": "spain",
+                    "last_search": None,
+                    "refresh_interval": None,
+                    "last_processed": None,
+                },
+            )
+
+
+def _measure(function) -> tuple[float, float]:
+    """
+    :return: Tuple of (seconds, peak resident MiB of the process so far) of running function. tracemalloc would slow
+    the stages down several times, so the peak is the one of the process and only grows from one stage to the next.
+    """
+    start = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - start
+    return seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def run_scale(name: str, args: argparse.Namespace) -> None:
+    store = fakes.FakeStore()
+    seed(store, **SCALES[name])
+    openai = fakes.FakeOpenAI(
+        latency=args.llm_latency,
+        rpm=args.llm_rpm,
+        rate_limit_probability=args.rate_limited,
+    )
+    job_board = fakes.FakeJobBoard(latency=args.scrape_latency)
+    fakes.install(store, openai, job_board)
+
+    import ai_calls
+    import compaction
+    import main
+    import processor
+    from disk_cache import DiskCache
+    from rate_limiter import RateLimiter
+    from rating_cache import RatingCache
+
+    # Every scale starts with empty local caches and a limiter matching the fake server.
+    ai_calls.rate_limiter = RateLimiter(args.llm_rpm, args.llm_tpm)
+    processor.rating_cache = RatingCache()
+    compaction._cache = DiskCache("compaction", compaction.COMPACTION_CACHE_MAX_ENTRIES)
+
+    if args.pipelined:
+        cycle_seconds, cycle_memory = _measure(
+            lambda: main.run_cycle(grouped=args.grouped)
+        )
+        jobs = len(store.tables["job"])
+        ratings = len(store.tables["rating"])
+        print(
+            f"{name}: {len(store.tables['search'])} searches, {len(store.tables['resume'])} resumes"
+        )
+        print(
+            f"  cycle:   {jobs:6d} jobs and {ratings:6d} ratings in {cycle_seconds:7.2f} s, "
+            f"{sum(store.round_trips.values()) / max(jobs + ratings, 1):5.2f} round trips/job or rating, "
+            f"{job_board.calls} board calls, {openai.calls} model calls, peak {cycle_memory:6.1f} MiB"
+        )
+        return
+
+    scrape_seconds, scrape_memory = _measure(main.scrape_it)
+    jobs = len(store.tables["job"])
+    scrape_round_trips = sum(store.round_trips.values())
+    process_seconds, process_memory = _measure(
+        lambda: main.process_it(grouped=args.grouped)
+    )
+    ratings = len(store.tables["rating"])
+    process_round_trips = sum(store.round_trips.values()) - scrape_round_trips
+
+    print(
+        f"{name}: {len(store.tables['search'])} searches, {len(store.tables['resume'])} resumes"
+    )
+    print(
+        f"  scrape:  {jobs:6d} jobs    in {scrape_seconds:7.2f} s = {jobs / scrape_seconds:8.1f} jobs/s, "
+        f"{scrape_round_trips / max(jobs, 1):5.2f} round trips/job, {job_board.calls} board calls, "
+        f"peak {scrape_memory:6.1f} MiB"
+    )
+    print(
+        f"  process: {ratings:6d} ratings in {process_seconds:7.2f} s = {ratings / process_seconds:8.1f} ratings/s, "
+        f"{process_round_trips / max(ratings, 1):5.2f} round trips/rating, {openai.calls} model calls "
+        f"({openai.rate_limited} rate limited, {openai.prompt_tokens + openai.completion_tokens} tokens), "
+        f"peak {process_memory:6.1f} MiB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--scales",
+        default="small,medium",
+        help=f"comma separated, of {', '.join(SCALES)}",
+    )
+    parser.add_argument(
+        "--llm-latency", type=float, default=0.05, help="seconds per completion"
+    )
+    parser.add_argument(
+        "--llm-rpm",
+        type=int,
+        default=5000,
+        help="completions per minute the fake server allows",
+    )
+    parser.add_argument(
+        "--llm-tpm",
+        type=int,
+        default=10_000_000,
+        help="tokens per minute the rate limiter allows",
+    )
+    parser.add_argument(
+        "--rate-limited",
+        type=float,
+        default=0.0,
+        help="fraction of completions answered with 429",
+    )
+    parser.add_argument(
+        "--scrape-latency",
+        type=float,
+        default=0.05,
+        help="seconds per call to the job board",
+    )
+    parser.add_argument(
+        "--grouped", action="store_true", help="rate several jobs per completion"
+    )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="run main.run_cycle, rating while scraping, instead of both stages in turn",
+    )
+    args = parser.parse_args()
+
+    # Logging every request would dominate the timings.
+    logging.disable(logging.INFO)
+    for name in args.scales.split(","):
+        # Each scale runs in its own directory, so the proxy pool and caches of .cache start empty.
+        with tempfile.TemporaryDirectory() as directory:
+            cwd = os.getcwd()
+            os.chdir(directory)
+            try:
+                run_scale(name, args)
+            finally:
+                os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,690 @@
+"""
+Local stand-ins for the services the pipeline talks to, so it can be benchmarked without network access:
+- FakeStore, an in memory database served through FakePostgrest (the subset of PostgREST used by supabase-py) and
+  FakeDb (the queries of db_queries run by my_db).
+- FakeOpenAI, a chat completions endpoint with configurable latency and rate limits.
+- FakeJobBoard, a scrape_jobs replacement returning synthetic JobSpy dataframes.
+install() wires them into the shared clients.
+"""
+
+import csv
+import datetime
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from urllib.parse import unquote
+
+import httpx
+import pandas as pd
+
+# Primary key, other unique keys and whether the id is generated, of every table.
+SCHEMA = {
+    "job": {"primary_key": ("id",), "unique": [("job_url",)], "auto_id": True},
+    "search": {"primary_key": ("id",), "unique": [], "auto_id": True},
+    "search_job": {"primary_key": ("search_id", "job_id"), "unique": []},
+    "resume": {"primary_key": ("id",), "unique": [], "auto_id": True},
+    "rating": {"primary_key": ("id",), "unique": [], "auto_id": True},
+    "rating_cache": {"primary_key": ("key",), "unique": []},
+    "job_lsh_bucket": {"primary_key": ("bucket", "job_id"), "unique": []},
+    "rating_queue": {"primary_key": ("job_id", "resume_id"), "unique": []},
+}
+# Query parameters of PostgREST that are not filters.
+NON_FILTER_PARAMS = {"select", "on_conflict", "columns", "order", "limit", "offset"}
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.UTC)
+
+
+class ConflictError(Exception):
+    pass
+
+
+class FakeStore:
+    """
+    In memory tables with their primary and unique keys, shared by FakePostgrest and FakeDb. Counts every round trip
+    made to it.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.tables: dict[str, list[dict]] = {name: [] for name in SCHEMA}
+        self._indexes = {
+            name: {key: {} for key in (table["primary_key"], *table["unique"])}
+            for name, table in SCHEMA.items()
+        }
+        self._next_id = Counter()
+        self.round_trips = Counter()
+
+    def find(self, table: str, key: tuple, row: dict) -> dict | None:
+        return self._indexes[table][key].get(tuple(row.get(column) for column in key))
+
+    def insert(
+        self,
+        table: str,
+        row: dict,
+        on_conflict: tuple | None = None,
+        ignore: bool = False,
+    ) -> dict | None:
+        """
+        Inserts the row, or merges it into the row it conflicts with on on_conflict.
+        :return: The stored row, None if it was ignored.
+        """
+        schema = SCHEMA[table]
+        if on_conflict is not None:
+            existing = self.find(table, on_conflict, row)
+            if existing is not None:
+                if ignore:
+                    return None
+                existing.update(row)
+                return existing
+        row = dict(row)
+        if schema.get("auto_id") and row.get("id") is None:
+            self._next_id[table] += 1
+            row["id"] = self._next_id[table]
+        elif "id" in row and isinstance(row["id"], int):
+            self._next_id[table] = max(self._next_id[table], row["id"])
+        for key in self._indexes[table]:
+            if self.find(table, key, row) is not None:
+                if ignore:
+                    return None
+                raise ConflictError(
+                    f"duplicate key value violates unique constraint on {table} {key}"
+                )
+        row.setdefault("created_at", _now())
+        self.tables[table].append(row)
+        for key, index in self._indexes[table].items():
+            index[tuple(row.get(column) for column in key)] = row
+        return row
+
+    def delete(self, table: str, rows: list[dict]) -> None:
+        ids = {id(row) for row in rows}
+        self.tables[table] = [row for row in self.tables[table] if id(row) not in ids]
+        for key, index in self._indexes[table].items():
+            for row in rows:
+                index.pop(tuple(row.get(column) for column in key), None)
+
+
+def _parse_list(value: str) -> list[str]:
+    return next(csv.reader([value[1:-1]], quotechar='"', escapechar="\\"))
+
+
+def _as_text(value) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _predicate(operator: str, argument: str):
+    """
+    :return: Function telling whether a value passes the PostgREST filter operator.argument.
+    """
+    if operator in ("eq", "is"):
+        return lambda value: _as_text(value) == argument
+    if operator == "neq":
+        return lambda value: _as_text(value) != argument
+    if operator == "in":
+        values = set(_parse_list(argument))
+        return lambda value: _as_text(value) in values
+    compare = {
+        "lt": lambda value, other: value < other,
+        "lte": lambda value, other: value <= other,
+        "gt": lambda value, other: value > other,
+        "gte": lambda value, other: value >= other,
+    }[operator]
+
+    def predicate(value) -> bool:
+        if value is None:
+            return False
+        if isinstance(value, datetime.datetime):
+            return compare(value, datetime.datetime.fromisoformat(argument))
+        if isinstance(value, (int, float)):
+            return compare(value, float(argument))
+        return compare(value, argument)
+
+    return predicate
+
+
+class FakePostgrest:
+    """
+    httpx transport handler answering the requests supabase-py makes for select, insert, upsert and update.
+    """
+
+    def __init__(self, store: FakeStore):
+        self.store = store
+
+    def _filter(self, table: str, params) -> list[dict]:
+        rows = self.store.tables[table]
+        for column, value in params:
+            if column in NON_FILTER_PARAMS:
+                continue
+            predicate = _predicate(*value.split(".", 1))
+            rows = [row for row in rows if predicate(row.get(column))]
+        return rows
+
+    @staticmethod
+    def _response(status_code: int, content) -> httpx.Response:
+        return httpx.Response(
+            status_code,
+            content=json.dumps(content, default=str),
+            headers={"content-type": "application/json"},
+        )
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        table = request.url.path.rsplit("/", 1)[-1]
+        params = [
+            (key, unquote(value)) for key, value in request.url.params.multi_items()
+        ]
+        prefer = request.headers.get("prefer", "")
+        with self.store.lock:
+            self.store.round_trips[(request.method, table)] += 1
+            try:
+                if request.method == "GET":
+                    rows = self._filter(table, params)
+                    select = dict(params).get("select", "*")
+                    if select != "*":
+                        columns = select.split(",")
+                        rows = [
+                            {column: row.get(column) for column in columns}
+                            for row in rows
+                        ]
+                    return self._response(200, rows)
+
+                body = json.loads(request.content or b"null")
+                if request.method == "PATCH":
+                    rows = self._filter(table, params)
+                    for row in rows:
+                        row.update(body)
+                    return self._response(200, rows)
+
+                if request.method == "POST":
+                    on_conflict = None
+                    if "resolution=" in prefer:
+                        on_conflict = tuple(
+                            dict(params)
+                            .get("on_conflict", ",".join(SCHEMA[table]["primary_key"]))
+                            .split(",")
+                        )
+                    ignore = "resolution=ignore-duplicates" in prefer
+                    stored = [
+                        self.store.insert(table, row, on_conflict, ignore)
+                        for row in (body if isinstance(body, list) else [body])
+                    ]
+                    return self._response(
+                        201, [row for row in stored if row is not None]
+                    )
+            except ConflictError as e:
+                return self._response(409, {"code": "23505", "message": str(e)})
+        return self._response(405, {"message": f"{request.method} is not supported"})
+
+
+class FakeDb:
+    """
+    Stand-in for the functions of my_db, answers the queries of db_queries against the FakeStore the way Postgres
+    would.
+    """
+
+    def __init__(self, store: FakeStore):
+        self.store = store
+
+    def run_query(self, query: str, params=None) -> list | None:
+        import db_queries
+
+        handlers = {
+            db_queries.due_searches: self._due_searches,
+            db_queries.claim_rating_queue: self._claim_rating_queue,
+            db_queries.missing_ratings: lambda p: self._missing_ratings(
+                p["full_rescan"]
+            ),
+            db_queries.lease_missing_ratings_for_jobs: self._lease_missing_ratings_for_jobs,
+            db_queries.count_exhausted_rating_queue: self._count_exhausted_rating_queue,
+        }
+        with self.store.lock:
+            self.store.round_trips[("SQL", "query")] += 1
+            return handlers[query](params or {})
+
+    def execute(self, query: str, params=None) -> int | None:
+        import db_queries
+
+        handlers = {
+            db_queries.mark_searches_updated: self._mark_searches_updated,
+            db_queries.enqueue_missing_ratings: self._enqueue_missing_ratings,
+            db_queries.ack_rating_queue: self._ack_rating_queue,
+            db_queries.release_rating_queue: self._release_rating_queue,
+        }
+        with self.store.lock:
+            self.store.round_trips[("SQL", "execute")] += 1
+            return handlers[query](params or {})
+
+    def stream_query(self, query: str, params=None, itersize: int = 0):
+        yield from self.run_query(query, params)
+
+    def close_pool(self) -> None:
+        pass
+
+    def _due_searches(self, params) -> list[tuple]:
+        import searches
+
+        now = _now()
+        default = datetime.timedelta(seconds=params["default_refresh_interval"])
+        horizon = datetime.timedelta(seconds=params["horizon"])
+        due = []
+        for search in self.store.tables["search"]:
+            interval = search.get("refresh_interval") or default
+            last_search = search.get("last_search")
+            if last_search is None or last_search + interval <= now + horizon:
+                due.append(
+                    (
+                        {**search, "refresh_interval": interval},
+                        last_search and last_search + interval,
+                    )
+                )
+        due.sort(key=lambda entry: (entry[1] is not None, entry[1] or now))
+        rows = [
+            tuple(search.get(column) for column in searches.DUE_SEARCH_COLUMNS)
+            for search, _ in due
+        ]
+        return rows[: params["limit"]] if params.get("limit") is not None else rows
+
+    def _mark_searches_updated(self, params) -> int:
+        ids = set(params["search_ids"])
+        updated = [
+            search for search in self.store.tables["search"] if search["id"] in ids
+        ]
+        for search in updated:
+            search["last_search"] = _now()
+        return len(updated)
+
+    def _missing_ratings(self, full_rescan: bool) -> list[tuple[int, int]]:
+        searches = {search["id"]: search for search in self.store.tables["search"]}
+        resumes_by_user: dict[str, list[dict]] = {}
+        for resume in self.store.tables["resume"]:
+            if resume.get("is_active"):
+                resumes_by_user.setdefault(resume["user_id"], []).append(resume)
+        rated = {
+            (rating["job_id"], rating["resume_id"])
+            for rating in self.store.tables["rating"]
+        }
+        pairs = {}
+        for search_job in self.store.tables["search_job"]:
+            search = searches[search_job["search_id"]]
+            last_processed = search.get("last_processed")
+            for resume in resumes_by_user.get(search["user_id"], []):
+                pair = (search_job["job_id"], resume["id"])
+                changed = resume.get("updated_at") or resume.get("date_uploaded")
+                if pair not in rated and (
+                    full_rescan
+                    or last_processed is None
+                    or search_job["created_at"] > last_processed
+                    or (changed is not None and changed > last_processed)
+                ):
+                    pairs[pair] = None
+        return list(pairs)
+
+    def _lease_missing_ratings_for_jobs(self, params) -> list[tuple[int, int]]:
+        now = _now()
+        job_ids = set(params["job_ids"])
+        queued = {
+            (row["job_id"], row["resume_id"]): row
+            for row in self.store.tables["rating_queue"]
+        }
+        leased = []
+        for pair in self._missing_ratings(full_rescan=True):
+            if pair[0] not in job_ids:
+                continue
+            row = queued.get(pair)
+            if row is None:
+                row = self.store.insert(
+                    "rating_queue",
+                    {
+                        "job_id": pair[0],
+                        "resume_id": pair[1],
+                        "lease_owner": None,
+                        "leased_until": None,
+                        "attempts": 0,
+                    },
+                    ("job_id", "resume_id"),
+                )
+            elif (
+                row["leased_until"] is not None and row["leased_until"] >= now
+            ) or row["attempts"] >= params["max_attempts"]:
+                continue
+            row["lease_owner"] = params["owner"]
+            row["leased_until"] = now + datetime.timedelta(
+                seconds=params["lease_seconds"]
+            )
+            leased.append(pair)
+        return leased
+
+    def _enqueue_missing_ratings(self, params) -> int:
+        queued = 0
+        for job_id, resume_id in self._missing_ratings(params["full_rescan"]):
+            row = {
+                "job_id": job_id,
+                "resume_id": resume_id,
+                "lease_owner": None,
+                "leased_until": None,
+                "attempts": 0,
+            }
+            if self.store.insert(
+                "rating_queue", row, ("job_id", "resume_id"), ignore=True
+            ):
+                queued += 1
+            elif params["full_rescan"]:
+                for queued_row in self.store.tables["rating_queue"]:
+                    if (queued_row["job_id"], queued_row["resume_id"]) == (
+                        job_id,
+                        resume_id,
+                    ) and queued_row["attempts"] >= params["max_attempts"]:
+                        queued_row["attempts"] = 0
+                        queued_row["leased_until"] = None
+                        queued += 1
+        watermark = _now() - datetime.timedelta(minutes=10)
+        for search in self.store.tables["search"]:
+            if (
+                search.get("last_processed") is None
+                or search["last_processed"] < watermark
+            ):
+                search["last_processed"] = watermark
+        return queued
+
+    def _count_exhausted_rating_queue(self, params) -> list[tuple[int]]:
+        return [
+            (
+                sum(
+                    row["attempts"] >= params["max_attempts"]
+                    for row in self.store.tables["rating_queue"]
+                ),
+            )
+        ]
+
+    def _claim_rating_queue(self, params) -> list[tuple[int, int]]:
+        now = _now()
+        rated = {
+            (rating["job_id"], rating["resume_id"])
+            for rating in self.store.tables["rating"]
+        }
+        expired = [
+            row
+            for row in self.store.tables["rating_queue"]
+            if row["leased_until"] is None or row["leased_until"] < now
+        ]
+        self.store.delete(
+            "rating_queue",
+            [row for row in expired if (row["job_id"], row["resume_id"]) in rated][
+                : params["batch_size"]
+            ],
+        )
+        available = [
+            row
+            for row in expired
+            if row["attempts"] < params["max_attempts"]
+            and (row["job_id"], row["resume_id"]) not in rated
+        ]
+        available.sort(key=lambda row: row["created_at"])
+        claimed = available[: params["batch_size"]]
+        for row in claimed:
+            row["lease_owner"] = params["owner"]
+            row["leased_until"] = now + datetime.timedelta(
+                seconds=params["lease_seconds"]
+            )
+        return [(row["job_id"], row["resume_id"]) for row in claimed]
+
+    def _release_rating_queue(self, params) -> int:
+        rated = {
+            (rating["job_id"], rating["resume_id"])
+            for rating in self.store.tables["rating"]
+        }
+        leased = [
+            row
+            for row in self.store.tables["rating_queue"]
+            if row["lease_owner"] == params["owner"]
+        ]
+        self.store.delete(
+            "rating_queue",
+            [row for row in leased if (row["job_id"], row["resume_id"]) in rated],
+        )
+        for row in leased:
+            row["lease_owner"] = None
+            row["leased_until"] = None
+        return len(leased)
+
+    def _ack_rating_queue(self, params) -> int:
+        rated = {
+            (rating["job_id"], rating["resume_id"])
+            for rating in self.store.tables["rating"]
+        }
+        leased = [
+            row
+            for row in self.store.tables["rating_queue"]
+            if row["lease_owner"] == params["owner"]
+        ]
+        done = [row for row in leased if (row["job_id"], row["resume_id"]) in rated]
+        self.store.delete("rating_queue", done)
+        for row in leased:
+            if (row["job_id"], row["resume_id"]) not in rated:
+                row["lease_owner"] = None
+                row["leased_until"] = _now() + datetime.timedelta(
+                    seconds=params["retry_seconds"]
+                )
+                row["attempts"] += 1
+        return len(leased)
+
+
+class FakeOpenAI:
+    """
+    httpx transport handler answering chat completions with a valid rating after latency seconds. Past rpm requests
+    in the last minute, or at random with rate_limit_probability, it answers 429 like the API does.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        rpm: int | None = None,
+        rate_limit_probability: float = 0.0,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.rpm = rpm
+        self.rate_limit_probability = rate_limit_probability
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent: list[float] = []
+        self.calls = 0
+        self.rate_limited = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def _limited(self) -> float | None:
+        """
+        :return: Seconds to wait if the request is rate limited, None otherwise.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._recent = [t for t in self._recent if now - t < 60]
+            if self.rpm is not None and len(self._recent) >= self.rpm:
+                self.rate_limited += 1
+                return 60 - (now - self._recent[0])
+            if self._random.random() < self.rate_limit_probability:
+                self.rate_limited += 1
+                return 1.0
+            self._recent.append(now)
+            self.calls += 1
+        return None
+
+    @staticmethod
+    def _rating(seed: str) -> dict:
+        value = zlib.crc32(seed.encode())
+        return {
+            "rating": value % 11,
+            "justification": "The resume covers most of the requirements of the job description.",
+            "display_data": [{"label": "Skills", "content": "python, sql"}],
+            "interval": "yearly",
+            "min_amount": 40_000 + value % 20_000,
+            "max_amount": 60_000 + value % 20_000,
+            "currency": "EUR",
+            "is_remote": bool(value % 2),
+        }
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        retry_after = self._limited()
+        if retry_after is not None:
+            return httpx.Response(
+                429,
+                json={
+                    "error": {
+                        "message": "Rate limit reached",
+                        "type": "requests",
+                        "code": "rate_limit_exceeded",
+                    }
+                },
+                headers={"retry-after": f"{retry_after:.3f}"},
+            )
+        if self.latency:
+            time.sleep(self.latency)
+
+        body = json.loads(request.content)
+        prompt = "".join(message["content"] for message in body["messages"])
+        user = body["messages"][-1]["content"]
+        jobs = [int(number) for number in re.findall(r"\n\s*Job (\d+)\s*\n", user)]
+        if '{"ratings": [...]}' in body["messages"][0]["content"] and jobs:
+            content = {
+                "ratings": [
+                    {**self._rating(f"{user}{job}"), "job": job}
+                    for job in range(1, max(jobs) + 1)
+                ]
+            }
+        else:
+            content = self._rating(user)
+        content = json.dumps(content)
+        usage = {
+            "prompt_tokens": len(prompt) // 4 + 1,
+            "completion_tokens": len(content) // 4 + 1,
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        with self._lock:
+            self.prompt_tokens += usage["prompt_tokens"]
+            self.completion_tokens += usage["completion_tokens"]
+        return httpx.Response(
+            200,
+            json={
+                "id": f"chatcmpl-{self.calls}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": content},
+                    }
+                ],
+                "usage": usage,
+            },
+        )
+
+
+class FakeJobBoard:
+    """
+    Replacement of jobspy.scrape_jobs returning results_wanted synthetic jobs. The same scrape always returns the same
+    job urls, so scraping again finds the jobs already stored, like a real board would.
+    """
+
+    VOCABULARY = [f"skill{i}" for i in range(300)] + [
+        "python",
+        "sql",
+        "cloud",
+        "data",
+        "team",
+        "remote",
+    ]
+
+    def __init__(self, latency: float = 0.0, description_words: int = 300):
+        self.latency = latency
+        self.description_words = description_words
+        self.calls = 0
+
+    def __call__(
+        self, site_name, search_term, location, results_wanted, **kwargs
+    ) -> pd.DataFrame:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        slug = re.sub(r"\W+", "-", f"{site_name} {search_term} {location}".lower())
+        rows = []
+        for i in range(results_wanted or 0):
+            generator = random.Random(zlib.crc32(f"{slug}-{i}".encode()))
+            words = generator.choices(self.VOCABULARY, k=self.description_words)
+            rows.append(
+                {
+                    "id": f"{site_name[:2]}-{zlib.crc32(f'{slug}-{i}'.encode())}",
+                    "site": site_name,
+                    "job_url": f"https://{site_name}.example.com/jobs/{slug}-{i}",
+                    "job_url_direct": None,
+                    "title": f"{search_term.title()} {generator.choice(['Engineer', 'Developer', 'Analyst'])}",
+                    "company": f"Company {generator.randrange(1000)}",
+                    "location": location,
+                    "job_type": "fulltime",
+                    "date_posted": datetime.date(2024, 1, 1 + i % 28),
+                    "interval": "yearly",
+                    "min_amount": float(generator.randrange(30, 60) * 1000),
+                    "max_amount": float(generator.randrange(60, 90) * 1000),
+                    "currency": "EUR",
+                    "is_remote": generator.random() < 0.3,
+                    "job_level": None,
+                    "job_function": None,
+                    "emails": None,
+                    "description": f"## Requirements\n{search_term} " + " ".join(words),
+                    "company_url": None,
+                    "logo_photo_url": None,
+                }
+            )
+        return pd.DataFrame(rows)
+
+
+def install(
+    store: FakeStore, openai: FakeOpenAI, job_board: FakeJobBoard, proxies: int = 100
+) -> None:
+    """
+    Points the shared Supabase and OpenAI clients, my_db, scrape_jobs and the proxy verification to the fakes.
+    Can be called again with new fakes, e.g. for every scale of a benchmark.
+    """
+    import common
+    import my_db
+    import my_proxies
+    import scraper
+    from postgrest.utils import SyncClient
+
+    postgrest = common.get_supabase_client().postgrest
+    postgrest.session = SyncClient(
+        base_url=postgrest.session.base_url,
+        headers=postgrest.session.headers,
+        event_hooks=postgrest.session.event_hooks,
+        transport=httpx.MockTransport(FakePostgrest(store)),
+    )
+    common.get_openai_client()._client = httpx.Client(
+        transport=httpx.MockTransport(openai)
+    )
+
+    fake_db = FakeDb(store)
+    my_db.run_query = fake_db.run_query
+    my_db.execute = fake_db.execute
+    my_db.stream_query = fake_db.stream_query
+    my_db.close_pool = fake_db.close_pool
+
+    scraper.scrape_jobs = job_board
+    fake_proxies = [f"10.0.{i // 256}.{i % 256}:8080" for i in range(proxies)]
+    my_proxies.get_proxies = lambda: list(fake_proxies)
+    my_proxies.verify_proxies_concurrent = (
+        lambda candidates, max_proxies=100, **kwargs: [
+            (proxy, 0.05) for proxy in candidates[:max_proxies]
+        ]
+    )
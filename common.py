@@ -1,10 +1,14 @@
 import logging
-from supabase import create_client, Client
+import threading
+from typing import TYPE_CHECKING
 from dotenv import load_dotenv
-from openai import OpenAI
 import os
 
-from supabase._sync.client import SyncClient
+import metrics
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+    from supabase._sync.client import SyncClient
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -22,20 +26,69 @@ SUPABASE_PASSWORD = os.getenv("SUPABASE_PASSWORD")
 SUPABASE_HOST = os.getenv("SUPABASE_HOST")
 SUPABASE_PORT = os.getenv("SUPABASE_PORT")
 
-# Initialize Supabase and OpenAI
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-openai = OpenAI(
-    api_key=OPENAI_API_KEY,
-)
+# Whether the rating cache is also kept on the rating_cache table, shared by every worker.
+RATING_CACHE_SHARED = os.getenv("RATING_CACHE_SHARED", "false").lower() == "true"
+
+# File the metrics of a run are written to when it ends, as JSON if it ends in .json and in the Prometheus text
+# format otherwise. None to not write them.
+METRICS_PATH = os.getenv("METRICS_PATH")
+# Port the daemon serves the metrics on, None to not serve them.
+METRICS_PORT = int(os.getenv("METRICS_PORT")) if os.getenv("METRICS_PORT") else None
+
+# Max amount of values sent in a single in_() filter, keeps the request URL under the server limits even for URLs.
+IN_CHUNK_SIZE = 100
+
+# Supabase and OpenAI clients, built on first use so that importing a module never pays for both libraries and
+# their connections.
+_supabase: "SyncClient | None" = None
+_openai: "OpenAI | None" = None
+_clients_lock = threading.Lock()
 
 
 def get_logger() -> logging.Logger:
     return logger
 
 
-def get_supabase_client() -> SyncClient:
-    return supabase
+def get_supabase_client() -> "SyncClient":
+    global _supabase
+    if _supabase is None:
+        with _clients_lock:
+            if _supabase is None:
+                from supabase import create_client
+
+                supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+                metrics.instrument_postgrest(supabase.postgrest.session)
+                _supabase = supabase
+    return _supabase
+
+
+def get_openai_client() -> "OpenAI":
+    global _openai
+    if _openai is None:
+        with _clients_lock:
+            if _openai is None:
+                from openai import OpenAI
+
+                _openai = OpenAI(
+                    api_key=OPENAI_API_KEY,
+                )
+    return _openai
 
 
-def get_openai_client() -> OpenAI:
-    return openai
+def select_in(table: str, columns: tuple[str, ...], column: str, values) -> list[dict]:
+    """
+    Selects the rows of the table whose column is in values, with as few in_() queries as the URL length allows.
+    :return: The rows found, in no particular order.
+    """
+    values = list(dict.fromkeys(values))
+    rows = []
+    for i in range(0, len(values), IN_CHUNK_SIZE):
+        response = (
+            get_supabase_client()
+            .table(table)
+            .select(*columns)
+            .in_(column, values[i : i + IN_CHUNK_SIZE])
+            .execute()
+        )
+        rows += response.data or []
+    return rows
@@ -0,0 +1,182 @@
+import hashlib
+import re
+import threading
+
+import common
+from disk_cache import DiskCache
+
+logger = common.get_logger()
+
+# Max amount of tokens of a job description sent to the model.
+DESCRIPTION_TOKEN_BUDGET = 1200
+COMPACTION_CACHE_MAX_ENTRIES = 200_000
+# Bump when the compaction rules change so that cached descriptions are compacted again.
+COMPACTION_VERSION = 1
+TOKENIZER_MODEL = "gpt-4o-mini"
+CHARS_PER_TOKEN = 4
+
+# Sections that never help rating a candidate.
+BOILERPLATE_HEADINGS = re.compile(
+    r"equal (employment )?opportunit|\beeo\b|diversity|inclusion|benefits|perks|what we offer|why (join|work)|"
+    r"about (us|the company|our company)|who we are|our (mission|story|culture)|life at|privacy|disclaimer|"
+    r"accommodation|e-?verify|how to apply|legal|notice",
+    re.IGNORECASE,
+)
+# Sections kept before anything else when the description is over the budget.
+PRIORITY_HEADINGS = re.compile(
+    r"requirement|qualification|responsibilit|what you('ll| will) do|what you bring|you have|skills|experience|"
+    r"must have|nice to have|role|duties|compensation|salary|pay",
+    re.IGNORECASE,
+)
+# Sentences removed wherever they are. Sentences are split first and searched one by one, a single pattern spanning
+# the sentence around the phrase is quadratic on long lines without periods.
+BOILERPLATE_SENTENCES = re.compile(
+    r"equal opportunity employer|without regard to (race|age|sex)|reasonable accommodation|e-?verify|"
+    r"protected veteran",
+    re.IGNORECASE,
+)
+SENTENCE = re.compile(r"[^.\n]+\.?")
+# Lines kept even from boilerplate sections, the model extracts the salary from them.
+SALARY_LINE = re.compile(
+    r"[$€£]\s?\d|\b(salary|compensation|pay range|per hour|an hour|a year)\b",
+    re.IGNORECASE,
+)
+HEADING = re.compile(r"^\s*(#{1,6}\s*.+|\*\*[^*]{2,80}\*\*:?|[A-Z][^.!?\n]{1,60}:)\s*$")
+
+_cache = DiskCache("compaction", COMPACTION_CACHE_MAX_ENTRIES)
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """
+    Tokenizer of the model, None if tiktoken is missing or its encoding can't be loaded, e.g. without network access
+    on the first run, in which case tokens are estimated from the amount of characters.
+    """
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            _encoding_loaded = True
+            try:
+                import tiktoken
+
+                _encoding = tiktoken.encoding_for_model(TOKENIZER_MODEL)
+            except Exception as e:
+                logger.error(f"Tokenizer unavailable, estimating tokens instead: {e}")
+    return _encoding
+
+
+def count_tokens(text: str | None) -> int:
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _truncate(text: str, budget: int) -> str:
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[: budget * CHARS_PER_TOKEN]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= budget else encoding.decode(tokens[:budget])
+
+
+def _strip_markdown(text: str) -> str:
+    text = re.sub(r"!?\[([^\]]*)\]\([^)]*\)", r"\1", text)
+    text = re.sub(r"https?://\S+", "", text)
+    text = re.sub(r"\\([\\`*_{}\[\]()#+\-.!])", r"\1", text)
+    text = re.sub(r"(\*\*|__|\*|`)", "", text)
+    text = re.sub(r"^\s*#{1,6}\s*", "", text, flags=re.MULTILINE)
+    text = re.sub(r"^\s*[-*•·]\s+", "- ", text, flags=re.MULTILINE)
+    text = re.sub(r"[ \t]+", " ", text)
+    return re.sub(r"\n\s*\n+", "\n", text).strip()
+
+
+def _strip_boilerplate_sentences(text: str) -> str:
+    return SENTENCE.sub(
+        lambda match: (
+            "" if BOILERPLATE_SENTENCES.search(match.group()) else match.group()
+        ),
+        text,
+    )
+
+
+def _sections(text: str) -> list[tuple[str, str]]:
+    """
+    Splits the description by its headings.
+    :return: List of (heading, body), the text before the first heading has an empty heading.
+    """
+    sections = [("", [])]
+    for line in text.splitlines():
+        if HEADING.match(line):
+            sections.append((line.strip(), []))
+        else:
+            sections[-1][1].append(line)
+    return [(heading, "\n".join(body)) for heading, body in sections]
+
+
+def compact_description(
+    description: str | None, budget: int = DESCRIPTION_TOKEN_BUDGET
+) -> str | None:
+    """
+    Removes the boilerplate sections and markdown noise of a job description and truncates it to the token budget,
+    keeping the requirements and responsibilities first. Results are cached by the hash of the description.
+    """
+    if not description:
+        return description
+    key = hashlib.sha256(
+        f"{COMPACTION_VERSION}:{budget}:{description}".encode()
+    ).hexdigest()
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+
+    sections = []
+    for heading, body in _sections(description):
+        if heading and BOILERPLATE_HEADINGS.search(heading):
+            body = "\n".join(
+                line for line in body.splitlines() if SALARY_LINE.search(line)
+            )
+            heading = ""
+        sections.append((heading, _strip_boilerplate_sentences(body)))
+    sections = [
+        (heading, _strip_markdown(f"{heading}\n{body}")) for heading, body in sections
+    ]
+    sections = [(heading, text) for heading, text in sections if text]
+
+    # Over the budget, the priority sections are kept whole and the others fill what is left, in their original order.
+    section_tokens = [count_tokens(text) for _, text in sections]
+    if sum(section_tokens) > budget:
+        keep = [
+            bool(heading and PRIORITY_HEADINGS.search(heading))
+            for heading, _ in sections
+        ]
+        remaining = budget - sum(t for t, k in zip(section_tokens, keep) if k)
+        for i, tokens in enumerate(section_tokens):
+            if not keep[i] and tokens <= remaining:
+                keep[i] = True
+                remaining -= tokens
+        sections = [section for section, kept in zip(sections, keep) if kept]
+
+    compacted = _truncate("\n".join(text for _, text in sections), budget)
+    _cache.put(key, compacted)
+    return compacted
+
+
+def compact_jobs(jobs: dict[int, dict]) -> int:
+    """
+    Compacts the description of every job in place.
+    :return: Amount of description tokens saved.
+    """
+    saved = 0
+    for job in jobs.values():
+        description = job.get("description")
+        if not description:
+            continue
+        compacted = compact_description(description)
+        saved += count_tokens(description) - count_tokens(compacted)
+        job["description"] = compacted
+    return saved
@@ -2,12 +2,224 @@
 
 
 # This is the call that checks for the ratings that are missing, gets pairs that don't have a job_id under rating.
+# Only the search_job rows created, or resumes changed, after the last_processed watermark of their search are
+# considered, unless full_rescan is true.
+# Parameters: full_rescan.
 missing_ratings = """
-SELECT j.id, r.id FROM public.job as j
+SELECT DISTINCT j.id, r.id FROM public.job as j
 JOIN public.search_job as sj on sj.job_id = j.id
 JOIN public.search as s on s.id = sj.search_id
 JOIN public.resume as r on r.user_id = s.user_id
 LEFT JOIN public.rating as rt on rt.job_id = j.id AND rt.resume_id = r.id
 WHERE r.is_active = true
 AND rt.job_id is Null
+AND (
+    %(full_rescan)s
+    OR s.last_processed is Null
+    OR sj.created_at > s.last_processed
+    OR COALESCE(r.updated_at, r.date_uploaded) > s.last_processed
+)
+"""
+
+
+# Queues the missing ratings of the given jobs, whatever the watermark, and leases them to a worker, used to rate jobs
+# right after they are scraped. Pairs already queued are leased too unless another worker holds them, waits for a
+# retry or failed max_attempts times, so concurrent callers always get different pairs.
+# Parameters: job_ids, owner, lease_seconds, max_attempts.
+lease_missing_ratings_for_jobs = """
+WITH missing as (
+    SELECT DISTINCT j.id as job_id, r.id as resume_id FROM public.job as j
+    JOIN public.search_job as sj on sj.job_id = j.id
+    JOIN public.search as s on s.id = sj.search_id
+    JOIN public.resume as r on r.user_id = s.user_id
+    LEFT JOIN public.rating as rt on rt.job_id = j.id AND rt.resume_id = r.id
+    WHERE j.id = ANY(%(job_ids)s::bigint[])
+    AND r.is_active = true
+    AND rt.job_id is Null
+), queued as (
+    INSERT INTO public.rating_queue (job_id, resume_id, lease_owner, leased_until)
+    SELECT job_id, resume_id, %(owner)s, now() + %(lease_seconds)s * interval '1 second' FROM missing
+    ON CONFLICT (job_id, resume_id) DO NOTHING
+    RETURNING job_id, resume_id
+), leased as (
+    UPDATE public.rating_queue as q
+    SET lease_owner = %(owner)s, leased_until = now() + %(lease_seconds)s * interval '1 second'
+    FROM missing as m
+    WHERE q.job_id = m.job_id AND q.resume_id = m.resume_id
+    AND (q.leased_until is Null OR q.leased_until < now())
+    AND q.attempts < %(max_attempts)s
+    RETURNING q.job_id, q.resume_id
+)
+SELECT job_id, resume_id FROM queued
+UNION ALL
+SELECT job_id, resume_id FROM leased
+"""
+
+
+# Adds the missing ratings to rating_queue and advances the last_processed watermark of every search in the same
+# transaction, once queued the pairs are never lost even if the run dies right after.
+# The watermark is set a bit in the past, rows inserted by transactions that were still open may be older than now().
+# Pairs seen again because of it are already rated or queued, and filtered out by the anti join or the conflict.
+# A full rescan also gives the pairs that failed max_attempts times a new set of attempts.
+# Parameters: full_rescan, max_attempts.
+enqueue_missing_ratings = (
+    """
+INSERT INTO public.rating_queue (job_id, resume_id)
+"""
+    + missing_ratings
+    + """
+ON CONFLICT (job_id, resume_id) DO UPDATE SET attempts = 0, leased_until = Null
+WHERE %(full_rescan)s AND rating_queue.attempts >= %(max_attempts)s;
+UPDATE public.search SET last_processed = now() - interval '10 minutes'
+WHERE last_processed is Null OR last_processed < now() - interval '10 minutes';
+"""
+)
+
+
+# Leases up to batch_size queued pairs to a worker. SKIP LOCKED lets every worker claim a different batch at the same
+# time, pairs whose lease expired, e.g. because their worker crashed, are claimed again.
+# Pairs rated after all, e.g. by a worker that died before its ack, are removed from the queue instead of claimed.
+# Parameters: owner, lease_seconds, batch_size, max_attempts.
+claim_rating_queue = """
+WITH rated as (
+    DELETE FROM public.rating_queue as q
+    WHERE (q.job_id, q.resume_id) IN (
+        SELECT job_id, resume_id FROM public.rating_queue as rq
+        WHERE (rq.leased_until is Null OR rq.leased_until < now())
+        AND EXISTS (SELECT 1 FROM public.rating as rt WHERE rt.job_id = rq.job_id AND rt.resume_id = rq.resume_id)
+        LIMIT %(batch_size)s
+        FOR UPDATE SKIP LOCKED
+    )
+)
+UPDATE public.rating_queue as q
+SET lease_owner = %(owner)s, leased_until = now() + %(lease_seconds)s * interval '1 second'
+WHERE (q.job_id, q.resume_id) IN (
+    SELECT job_id, resume_id FROM public.rating_queue as rq
+    WHERE (rq.leased_until is Null OR rq.leased_until < now())
+    AND rq.attempts < %(max_attempts)s
+    AND NOT EXISTS (SELECT 1 FROM public.rating as rt WHERE rt.job_id = rq.job_id AND rt.resume_id = rq.resume_id)
+    ORDER BY rq.created_at
+    LIMIT %(batch_size)s
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING q.job_id, q.resume_id
+"""
+
+
+# Acknowledges the leased pairs that got a rating and releases the rest, counting the failed attempt, to be claimed
+# again after retry_seconds. A worker whose lease expired and was claimed again by another one no longer owns the
+# pairs and changes nothing.
+# Parameters: owner, retry_seconds.
+ack_rating_queue = """
+DELETE FROM public.rating_queue as q
+WHERE q.lease_owner = %(owner)s
+AND EXISTS (SELECT 1 FROM public.rating as rt WHERE rt.job_id = q.job_id AND rt.resume_id = q.resume_id);
+UPDATE public.rating_queue
+SET lease_owner = Null, leased_until = now() + %(retry_seconds)s * interval '1 second', attempts = attempts + 1
+WHERE lease_owner = %(owner)s;
+"""
+
+
+# Like ack_rating_queue, but hands the pairs without a rating back to the queue right away and without counting an
+# attempt, for a worker that leaves some of its pairs to the others.
+# Parameters: owner.
+release_rating_queue = """
+DELETE FROM public.rating_queue as q
+WHERE q.lease_owner = %(owner)s
+AND EXISTS (SELECT 1 FROM public.rating as rt WHERE rt.job_id = q.job_id AND rt.resume_id = q.resume_id);
+UPDATE public.rating_queue SET lease_owner = Null, leased_until = Null
+WHERE lease_owner = %(owner)s;
+"""
+
+
+# Queued pairs that failed max_attempts times and are no longer claimed.
+# Parameters: max_attempts.
+count_exhausted_rating_queue = """
+SELECT count(*) FROM public.rating_queue WHERE attempts >= %(max_attempts)s
+"""
+
+
+# Table backing the rating work queue, see rating_queue.
+create_rating_queue = """
+CREATE TABLE IF NOT EXISTS public.rating_queue (
+    job_id BIGINT NOT NULL REFERENCES public.job (id) ON DELETE CASCADE,
+    resume_id BIGINT NOT NULL REFERENCES public.resume (id) ON DELETE CASCADE,
+    lease_owner TEXT,
+    leased_until TIMESTAMPTZ,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (job_id, resume_id)
+);
+CREATE INDEX IF NOT EXISTS rating_queue_created_at ON public.rating_queue (created_at);
+CREATE INDEX IF NOT EXISTS rating_queue_lease_owner ON public.rating_queue (lease_owner);
+"""
+
+
+# Column, trigger and index backing the incremental missing_ratings query, updated_at tracks resumes being activated
+# or edited.
+create_incremental_missing_ratings = """
+ALTER TABLE public.resume ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT now();
+CREATE OR REPLACE FUNCTION public.set_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at = now();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS resume_set_updated_at ON public.resume;
+CREATE TRIGGER resume_set_updated_at BEFORE UPDATE ON public.resume
+FOR EACH ROW EXECUTE FUNCTION public.set_updated_at();
+CREATE INDEX IF NOT EXISTS search_job_search_id_created_at ON public.search_job (search_id, created_at);
+"""
+
+
+# Searches due to be scraped, the ones never scraped first and then the most overdue. refresh_interval of the search
+# defaults to default_refresh_interval seconds, searches becoming due in the next horizon seconds are included too.
+# Parameters: default_refresh_interval, horizon, limit (Null for no limit).
+due_searches = """
+SELECT id, job_source, search_term, location, results_wanted, country, last_search,
+    COALESCE(refresh_interval, %(default_refresh_interval)s * interval '1 second') as refresh_interval
+FROM public.search
+WHERE last_search is Null
+OR last_search + COALESCE(refresh_interval, %(default_refresh_interval)s * interval '1 second')
+    <= now() + %(horizon)s * interval '1 second'
+ORDER BY last_search + COALESCE(refresh_interval, %(default_refresh_interval)s * interval '1 second') ASC NULLS FIRST
+LIMIT %(limit)s
+"""
+
+
+# Marks every given search as just scraped in one statement.
+# Parameters: search_ids.
+mark_searches_updated = """
+UPDATE public.search SET last_search = now()
+WHERE id = ANY(%(search_ids)s::bigint[])
+"""
+
+
+# Per search refresh interval, Null keeps the default one.
+create_search_refresh_interval = """
+ALTER TABLE public.search ADD COLUMN IF NOT EXISTS refresh_interval INTERVAL;
+CREATE INDEX IF NOT EXISTS search_last_search ON public.search (last_search);
+"""
+
+
+# Table backing the shared rating cache, see rating_cache.RatingCache.
+create_rating_cache = """
+CREATE TABLE IF NOT EXISTS public.rating_cache (
+    key TEXT PRIMARY KEY,
+    job_data JSONB NOT NULL,
+    rating_data JSONB NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+)
+"""
+
+
+# Columns and table backing the near duplicate clusters, see near_duplicates.assign_clusters.
+create_near_duplicates = """
+ALTER TABLE public.job ADD COLUMN IF NOT EXISTS canonical_job_id BIGINT REFERENCES public.job (id);
+ALTER TABLE public.job ADD COLUMN IF NOT EXISTS minhash JSONB;
+CREATE TABLE IF NOT EXISTS public.job_lsh_bucket (
+    bucket TEXT NOT NULL,
+    job_id BIGINT NOT NULL REFERENCES public.job (id) ON DELETE CASCADE,
+    PRIMARY KEY (bucket, job_id)
+);
 """
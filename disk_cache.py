@@ -0,0 +1,93 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import common
+
+logger = common.get_logger()
+
+CACHE_DIRECTORY = ".cache"
+
+
+class DiskCache:
+    """
+    Key-value store on a local SQLite file, bounded to max_entries by evicting the least recently used keys.
+    Values are stored as JSON. Safe to use from multiple threads, the file is only opened on first use.
+    """
+
+    def __init__(self, name: str, max_entries: int, directory: str = CACHE_DIRECTORY):
+        self.path = os.path.join(directory, f"{name}.sqlite3")
+        self.max_entries = max_entries
+        self._connection: sqlite3.Connection | None = None
+        # Upper bound of the amount of entries, replaced keys are counted twice until the next eviction.
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, last_used REAL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS cache_last_used ON cache (last_used)"
+            )
+            self._size = self._connection.execute(
+                "SELECT COUNT(*) FROM cache"
+            ).fetchone()[0]
+        return self._connection
+
+    def get(self, key: str):
+        """
+        :return: The value stored under key, None if missing.
+        """
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT value FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            with connection:
+                connection.execute(
+                    "UPDATE cache SET last_used = ? WHERE key = ?", (time.time(), key)
+                )
+        return json.loads(row[0])
+
+    def put(self, key: str, value) -> None:
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, last_used) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), time.time()),
+                )
+                self._size += 1
+                if self._size > self.max_entries:
+                    # Evict a tenth more than needed so the next puts don't have to evict again.
+                    connection.execute(
+                        """
+                        DELETE FROM cache WHERE key IN (
+                            SELECT key FROM cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                        )
+                        """,
+                        (self.max_entries - self.max_entries // 10,),
+                    )
+                    self._size = connection.execute(
+                        "SELECT COUNT(*) FROM cache"
+                    ).fetchone()[0]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
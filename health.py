@@ -0,0 +1,53 @@
+import time
+
+import ai_calls
+import common
+import my_db
+
+logger = common.get_logger()
+
+
+def check_openai() -> None:
+    # Retrieving the model is free, unlike a completion.
+    common.get_openai_client().models.retrieve(ai_calls.MODEL)
+
+
+def check_supabase() -> None:
+    common.get_supabase_client().table("search").select("id").limit(1).execute()
+
+
+def check_postgres() -> None:
+    if my_db.run_query("SELECT 1") is None:
+        raise RuntimeError("the query failed, see the error above")
+
+
+# Checks run by check_health, by name.
+CHECKS = {
+    "openai": check_openai,
+    "supabase": check_supabase,
+    "postgres": check_postgres,
+}
+
+
+def check_health(names=None) -> dict[str, str | None]:
+    """
+    Runs the checks, which builds the clients and opens the connections on the way, so it also works as a warm-up
+    before a run.
+    :param names: checks to run, all of them if None.
+    :return: Error of each check by name, None for the ones that passed.
+    """
+    results = {}
+    for name in names or CHECKS:
+        start = time.perf_counter()
+        try:
+            CHECKS[name]()
+            results[name] = None
+            logger.info(f"{name} is reachable ({time.perf_counter() - start:.2f}s).")
+        except Exception as e:
+            results[name] = str(e)
+            logger.error(f"{name} is not reachable: {e}")
+    return results
+
+
+if __name__ == "__main__":
+    exit(1 if any(check_health().values()) else 0)
@@ -1,6 +1,5 @@
 import datetime
 from typing import List
-import PyPDF2
 from my_constants import DEFAULT_DELIMITER
 
 
@@ -41,6 +40,8 @@ def now_formatted_date() -> str:
 
 
 def pdf_to_text(file_path):
+    import PyPDF2
+
     text = ""
     with open(file_path, "rb") as file:
         reader = PyPDF2.PdfReader(file)
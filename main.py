@@ -1,121 +1,299 @@
-import datetime
-from supabase import Client
+import argparse
+import functools
+import threading
+import time
 
 import common
-import db_queries
-import helper
-import my_db
-import my_proxies
+import metrics
 import my_types
-from processor import process_missing_ratings
+import pipeline
+import proxy_pool
+import rating_queue
+import scheduler
 import scraper
+import searches
+import scrape_executor
 
 # https://github.com/Bunsly/JobSpy
 # https://github.com/openai/openai-python
 # https://supabase.com/docs/reference/python
 
-# Initialize Logger, Supabase and OpenAI
+# Initialize Logger
 logger = common.get_logger()
-supabase: Client = common.get_supabase_client()
-client = common.get_openai_client()
 
 
-def get_outdated_searches() -> my_types.SearchEntryList | None:
-    try:
-        # Get the current time in UTC
-        now = datetime.datetime.now(datetime.UTC)
-
-        # Define the time threshold (3 hours ago)
-        three_hours_ago = now - datetime.timedelta(hours=3)
-
-        # Query Supabase for rows where "last_search" is NULL or "last_search" + 3 hours is less than now
-        no_searches = (
-            supabase.table("search")
-            .select("*")
-            .filter("last_search", "is", "null")
-            .execute()
+def scrape_searches(
+    due_searches: my_types.SearchEntryList,
+    pool: proxy_pool.ProxyPool,
+    deadline: float | None = None,
+    rating_pipeline: pipeline.RatingPipeline | None = None,
+):
+    """
+    Scrapes the searches concurrently and marks the ones that finished as updated, in bulk once the run ends.
+    :param deadline: time.monotonic() after which no more scrapes are started, the searches left are still due.
+    :param rating_pipeline: rates the stored jobs while the scrape goes on, None to leave them to process_it.
+    """
+    units = []
+    remaining_units = {}
+    # Searches with no units left, marked as updated together once the run ends.
+    done_search_ids = []
+    for search in due_searches:
+        search_units = scraper.build_scrape_units(search, proxy_pool=pool)
+        if not search_units:
+            done_search_ids.append(search["id"])
+            continue
+        units += search_units
+    # Searches sharing the same scrape are scraped once, their jobs are linked to all of them.
+    units = scraper.coalesce_scrape_units(units)
+    for unit in units:
+        for search in unit["searches"]:
+            remaining_units[search["id"]] = remaining_units.get(search["id"], 0) + 1
+
+    def on_unit_done(unit: my_types.ScrapeUnit, error: str | None):
+        # A search is marked as updated once all of its units finished, like the sequential loop did.
+        for search in unit["searches"]:
+            remaining_units[search["id"]] -= 1
+            if remaining_units[search["id"]] == 0:
+                done_search_ids.append(search["id"])
+
+    scrape_unit = scraper.scrape_and_store_unit
+    if rating_pipeline is not None:
+        scrape_unit = functools.partial(
+            scraper.scrape_and_store_unit, on_jobs_stored=rating_pipeline.put
         )
-        outdated_searches = (
-            supabase.table("search")
-            .select("*")
-            .filter("last_search", "lte", three_hours_ago.isoformat())
-            .execute()
+
+    try:
+        scrape_executor.run_scrape_units(
+            units,
+            scrape_unit,
+            on_unit_done=on_unit_done,
+            deadline=deadline,
         )
+    finally:
+        searches.mark_searches_updated(done_search_ids)
+        # Keep the health of the proxies seen during this run for the next one.
+        pool.save()
 
-        response = no_searches.data + outdated_searches.data
 
-        return response
+def scrape_it(
+    max_searches: int | None = None,
+    time_budget: float | None = None,
+    rating_pipeline: pipeline.RatingPipeline | None = None,
+):
+    """
+    Scrapes the due searches, the most overdue first.
+    :param max_searches: max amount of searches to scrape, None for all the due ones.
+    :param time_budget: seconds after which no more scrapes are started, None for no limit.
+    :param rating_pipeline: rates the stored jobs while the scrape goes on, None to leave them to process_it.
+    """
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+    with metrics.STAGE_SECONDS.time(stage="scrape"):
+        pool = proxy_pool.ProxyPool()
+        pool.refresh()
+        if len(pool) == 0:
+            logger.error("No valid proxies found, skipping scrape.")
+            return
+        due_searches = searches.get_due_searches(limit=max_searches)
+        if due_searches is None:
+            return
+        logger.info(f"{len(due_searches)} searches to scrape.")
+        scrape_searches(due_searches, pool, deadline, rating_pipeline)
 
-    except Exception as e:
-        logger.error(f"An error occurred while retrieving outdated searches: {e}")
-        return None
 
+def process_it(
+    batch: bool = False,
+    grouped: bool = False,
+    full_rescan: bool = False,
+    enqueue: bool = True,
+    max_ratings: int | None = None,
+    time_budget: float | None = None,
+    stop: threading.Event | None = None,
+):
+    """
+    Queues the missing ratings found since the last run and rates the queue, other processes running this at the same
+    time share the queue without rating the same pair twice.
+    With batch the queue is sent as a single offline batch job instead.
+    With grouped several jobs of the same resume are rated per completion.
+    :param full_rescan: look for missing ratings in the whole history instead of since the last_processed watermark.
+    :param enqueue: whether to queue the missing ratings first, workers that only rate the queue can skip it.
+    :param max_ratings: max amount of queued pairs to rate, None for all of them.
+    :param time_budget: seconds after which no more pairs are claimed, None for no limit. Not used in batch mode.
+    :param stop: no more pairs are claimed once it is set, e.g. when the daemon shuts down. Not used in batch mode.
+    """
+    # Imported here, so that scraping never loads the rating dependencies.
+    import batch_ratings
+    from processor import process_rating_queue
 
-def set_search_last_updated(search: my_types.SearchEntry):
-    try:
-        # Get the current time in UTC
-        now = helper.now_formatted_datetime()
+    with metrics.STAGE_SECONDS.time(stage="process"):
+        if enqueue:
+            rating_queue.enqueue_missing_ratings(full_rescan)
+        if batch:
+            batch_ratings.process_rating_queue_batch(max_ratings=max_ratings)
+        else:
+            process_rating_queue(
+                grouped=grouped,
+                max_ratings=max_ratings,
+                time_budget=time_budget,
+                stop=stop,
+            )
 
-        update_data = {"last_search": now}
 
-        response = (
-            supabase.table("search")
-            .update(update_data)
-            .eq("id", search["id"])
-            .execute()
-        )
-        if not response.data or len(response.data) <= 0:
-            logger.error(f"Error storing search: {response.error.message}")
-        else:
-            logger.info(f"Stored search with ID: {response.data[0]['id']}")
+def run_cycle(grouped: bool = False):
+    """
+    Scrapes the due searches and rates their jobs as they are stored, so the rating overlaps the scrape instead of
+    waiting for it. process_it then rates what the pipeline missed, like pairs whose rating failed or resumes that
+    changed, and the pairs below the pre-filter similarity, which the pipeline leaves to it to pick the most similar
+    ones among all the queued jobs of their resume instead of only the few jobs of a pipeline batch.
+    """
+    # Imported here, see process_it.
+    from processor import process_missing_ratings
 
-    except Exception as e:
-        logger.error(f"Error during search scraping or storing: {str(e)}")
+    with metrics.STAGE_SECONDS.time(stage="cycle"):
+        with pipeline.RatingPipeline(
+            functools.partial(
+                process_missing_ratings, grouped=grouped, defer_dissimilar=True
+            )
+        ) as rating_pipeline:
+            scrape_it(rating_pipeline=rating_pipeline)
+        process_it(grouped=grouped)
 
 
-def get_missing_ratings():
+def verify_proxies(min_proxies: int = 100):
     """
-    The missing ratings will be the ones that: There is a search_job, but the user that triggered it has no resume
-    together with it on ratings table.
-    :return:
+    Verifies the stale proxies of the pool and tops it up to min_proxies, so the next scrapes start right away.
     """
-    try:
-        rows = my_db.run_query(db_queries.missing_ratings)
+    pool = proxy_pool.ProxyPool()
+    pool.refresh(min_proxies)
+    logger.info(f"{len(pool)} verified proxies in the pool.")
+
+
+def run_daemon(process: bool = True):
+    """
+    Runs until SIGINT or SIGTERM, scraping every search as it becomes due and processing the ratings periodically.
+    The clients and the proxy pool are built once, the pool is refreshed along with the schedule when it is short of
+    proxies or has stale ones. On shutdown the processing stops claiming pairs and finishes the batch it is rating.
+    The metrics are served on METRICS_PORT while it runs.
+    :param process: whether to also process the ratings, False for a scrape only daemon.
+    """
+    if common.METRICS_PORT:
+        metrics.serve(common.METRICS_PORT)
+        logger.info(f"Serving metrics on port {common.METRICS_PORT}.")
+    pool = proxy_pool.ProxyPool()
+
+    def scrape(due_searches: my_types.SearchEntryList):
+        if len(pool) == 0:
+            logger.error(
+                f"No valid proxies found, skipping {len(due_searches)} searches."
+            )
+            return
+        scrape_searches(due_searches, pool)
 
-        if not rows:
-            logger.info(f"No missing ratings.")
-            return None
+    scheduler.Scheduler(
+        scrape,
+        process=(lambda stop: process_it(stop=stop)) if process else None,
+        on_refresh=pool.refresh,
+    ).run()
 
-        rows = [{"job_id": row[0], "resume_id": row[1]} for row in rows]
-        logger.info(f"Retrieved {len(rows)} missing ratings.")
-        return rows
 
-    except Exception as e:
-        logger.error(f"An error occurred while retrieving missing ratings: {e}")
-        return None
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Scrapes the due searches and rates the new jobs against the resumes. Without a command, runs "
+        "cycle."
+    )
+    commands = parser.add_subparsers(dest="command")
 
+    scrape = commands.add_parser("scrape", help="scrape the due searches")
+    scrape.add_argument("--max-searches", type=int, help="max searches to scrape")
+    scrape.add_argument(
+        "--time-budget", type=float, help="seconds after which no scrape is started"
+    )
 
-def scrape_it():
-    proxies = my_proxies.get_verified_proxies()
-    outdated_searches = get_outdated_searches()
-    logger.info(f"{len(outdated_searches)} searches to scrape.")
+    process = commands.add_parser("process", help="queue and rate missing ratings")
+    process.add_argument("--max-ratings", type=int, help="max queued pairs to rate")
+    process.add_argument(
+        "--time-budget", type=float, help="seconds after which no pair is claimed"
+    )
+    process.add_argument(
+        "--batch", action="store_true", help="rate with an offline batch job"
+    )
+    process.add_argument(
+        "--grouped", action="store_true", help="rate several jobs per completion"
+    )
+    process.add_argument(
+        "--full-rescan", action="store_true", help="queue missing ratings of all time"
+    )
+    process.add_argument(
+        "--no-enqueue",
+        dest="enqueue",
+        action="store_false",
+        help="only rate what is already queued",
+    )
 
-    for search in outdated_searches:
-        scraper.scrape_and_store_jobs(search, proxies=proxies)
-        set_search_last_updated(search)
+    cycle = commands.add_parser(
+        "cycle", help="scrape and rate the new jobs while the scrape goes on"
+    )
+    cycle.add_argument(
+        "--grouped", action="store_true", help="rate several jobs per completion"
+    )
+    cycle.add_argument(
+        "--sequential",
+        action="store_true",
+        help="rate once the whole scrape is done instead",
+    )
 
+    proxies = commands.add_parser("verify-proxies", help="refresh the proxy pool")
+    proxies.add_argument("--min-proxies", type=int, default=100)
 
-def process_it():
-    missing_ratings = get_missing_ratings()
-    if missing_ratings is None:
-        return
-    process_missing_ratings(missing_ratings)
+    commands.add_parser("health", help="check that every service is reachable")
 
+    daemon = commands.add_parser("daemon", help="scrape searches as they become due")
+    daemon.add_argument(
+        "--no-process",
+        dest="process",
+        action="store_false",
+        help="only scrape, leave the ratings to other workers",
+    )
+    return parser.parse_args(argv)
 
-def main():
-    scrape_it()
-    process_it()
+
+def main(argv=None) -> int:
+    """
+    Runs the command given in argv, only the clients used by that command are built.
+    :return: Exit code.
+    """
+    args = parse_args(argv)
+    if args.command == "health":
+        import health
+
+        return 1 if any(health.check_health().values()) else 0
+    if args.command == "daemon":
+        run_daemon(process=args.process)
+        return 0
+
+    try:
+        if args.command == "scrape":
+            scrape_it(max_searches=args.max_searches, time_budget=args.time_budget)
+        elif args.command == "process":
+            process_it(
+                batch=args.batch,
+                grouped=args.grouped,
+                full_rescan=args.full_rescan,
+                enqueue=args.enqueue,
+                max_ratings=args.max_ratings,
+                time_budget=args.time_budget,
+            )
+        elif args.command == "verify-proxies":
+            verify_proxies(args.min_proxies)
+        elif args.command == "cycle" and args.sequential:
+            scrape_it()
+            process_it(grouped=args.grouped)
+        else:
+            run_cycle(grouped=args.command == "cycle" and args.grouped)
+    finally:
+        if common.METRICS_PATH:
+            metrics.export(common.METRICS_PATH)
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    exit(main())
@@ -0,0 +1,300 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+# Prefix of every metric name.
+METRIC_PREFIX = "matchmyjob_"
+# Upper bounds in seconds of the latency histogram buckets, from a local DB call to a slow scrape.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_registry: list["Counter | Histogram"] = []
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """
+    Monotonic count per combination of labels, safe to increment from multiple threads.
+    """
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = METRIC_PREFIX + name
+        self.documentation = documentation
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values = {}
+
+    def samples(self) -> list[tuple[str, tuple, float]]:
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+    def snapshot(self) -> list[dict]:
+        with self._lock:
+            return [
+                {"labels": dict(key), "value": value}
+                for key, value in self._values.items()
+            ]
+
+
+class Histogram:
+    """
+    Distribution of observed values per combination of labels, in cumulative buckets like Prometheus expects.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = METRIC_PREFIX + name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        # Per labels: [count per bucket, sum, count], the count of a bucket excludes the lower buckets.
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            entry = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the seconds spent in the with block, also when it raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(_label_key(labels))
+        return entry[2] if entry else 0
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values = {}
+
+    def samples(self) -> list[tuple[str, tuple, float]]:
+        samples = []
+        with self._lock:
+            for key, (buckets, total, count) in self._values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, buckets):
+                    cumulative += bucket_count
+                    samples.append(
+                        (
+                            f"{self.name}_bucket",
+                            key + (("le", f"{bound:g}"),),
+                            cumulative,
+                        )
+                    )
+                samples.append((f"{self.name}_bucket", key + (("le", "+Inf"),), count))
+                samples.append((f"{self.name}_sum", key, total))
+                samples.append((f"{self.name}_count", key, count))
+        return samples
+
+    def snapshot(self) -> list[dict]:
+        with self._lock:
+            return [
+                {
+                    "labels": dict(key),
+                    "count": count,
+                    "sum": total,
+                    "buckets": dict(
+                        zip(
+                            [f"{bound:g}" for bound in self.buckets],
+                            [sum(buckets[: i + 1]) for i in range(len(buckets))],
+                        )
+                    ),
+                }
+                for key, (buckets, total, count) in self._values.items()
+            ]
+
+
+# Stages of a run: proxy_verification, scrape and process.
+STAGE_SECONDS = Histogram("stage_duration_seconds", "Duration of each stage of a run.")
+PROXY_CHECKS = Counter("proxy_checks_total", "Proxies checked, by result.")
+PROXY_CHECK_SECONDS = Histogram(
+    "proxy_check_duration_seconds", "Duration of each proxy check, by result."
+)
+SCRAPE_CALLS = Counter(
+    "scrape_calls_total", "Calls to scrape_jobs, by site and result."
+)
+SCRAPE_SECONDS = Histogram(
+    "scrape_duration_seconds", "Duration of each call to scrape_jobs, by site."
+)
+SCRAPED_JOBS = Counter("scraped_jobs_total", "Jobs returned by scrape_jobs, by site.")
+DB_REQUESTS = Counter(
+    "db_requests_total", "Database round trips, by table, operation and status."
+)
+DB_SECONDS = Histogram(
+    "db_request_duration_seconds",
+    "Duration of each database round trip, by table and operation.",
+)
+LLM_REQUESTS = Counter("llm_requests_total", "Chat completion requests, by result.")
+LLM_SECONDS = Histogram(
+    "llm_request_duration_seconds",
+    "Duration of each chat completion request, by result.",
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total", "Tokens reported by the API, by prompt or completion."
+)
+RATINGS_STORED = Counter(
+    "ratings_stored_total",
+    "Ratings inserted, by how they were stored: single, bulk or prefilter.",
+)
+
+
+def reset() -> None:
+    for metric in _registry:
+        metric.reset()
+
+
+def to_prometheus() -> str:
+    """
+    :return: Every metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def to_json() -> str:
+    return json.dumps(
+        {
+            metric.name: {"type": metric.type, "values": metric.snapshot()}
+            for metric in _registry
+        },
+        indent=2,
+    )
+
+
+def export(path: str) -> None:
+    """
+    Writes every metric to the path, as JSON if it ends in .json and in the Prometheus text format otherwise, e.g. for
+    the textfile collector of node_exporter.
+    """
+    content = to_json() if path.endswith(".json") else to_prometheus()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Write to a temporary file first so a collector never reads a half written file.
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        file.write(content)
+    os.replace(tmp_path, path)
+
+
+def serve(port: int, host: str = "") -> "ThreadingHTTPServer":
+    """
+    Serves the metrics on /metrics, and as JSON on /metrics.json, from a background thread.
+    :return: The server, shutdown() stops it.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                content, content_type = to_prometheus(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                content, content_type = to_json(), "application/json"
+            else:
+                self.send_error(404)
+                return
+            body = content.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+def _db_operation(request) -> str:
+    if request.method == "POST":
+        prefer = request.headers.get("prefer", "")
+        return "upsert" if "resolution=" in prefer else "insert"
+    return {"GET": "select", "PATCH": "update", "DELETE": "delete"}.get(
+        request.method, request.method.lower()
+    )
+
+
+def _on_db_request(request) -> None:
+    request.extensions["metrics_start"] = time.perf_counter()
+
+
+def _on_db_response(response) -> None:
+    request = response.request
+    labels = {
+        "table": request.url.path.rsplit("/", 1)[-1],
+        "operation": _db_operation(request),
+    }
+    start = request.extensions.get("metrics_start")
+    if start is not None:
+        DB_SECONDS.observe(time.perf_counter() - start, **labels)
+    DB_REQUESTS.inc(status=str(response.status_code), **labels)
+
+
+def instrument_postgrest(session) -> None:
+    """
+    Records every request of the httpx session of a PostgREST client in DB_REQUESTS and DB_SECONDS.
+    """
+    hooks = session.event_hooks
+    if _on_db_request not in hooks["request"]:
+        hooks["request"].append(_on_db_request)
+        hooks["response"].append(_on_db_response)
+    session.event_hooks = hooks
@@ -1,40 +1,127 @@
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Iterator
+
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
 
 import common
+import metrics
+
+logger = common.get_logger()
+
+# Connections kept open by the pool, every thread running a query holds one until it is done.
+MIN_CONNECTIONS = 1
+MAX_CONNECTIONS = 10
+# Rows fetched per round trip by the server side cursor of stream_query.
+STREAM_ITERSIZE = 5000
+
+_pool: psycopg2.pool.ThreadedConnectionPool | None = None
+_pool_lock = threading.Lock()
+# The pool raises instead of waiting once MAX_CONNECTIONS are borrowed, threads wait for a free one here instead.
+_connection_slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+
+
+def _get_pool() -> psycopg2.pool.ThreadedConnectionPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = psycopg2.pool.ThreadedConnectionPool(
+                MIN_CONNECTIONS,
+                MAX_CONNECTIONS,
+                dbname=common.SUPABASE_NAME,
+                user=common.SUPABASE_USER,
+                password=common.SUPABASE_PASSWORD,
+                host=common.SUPABASE_HOST,
+                port=common.SUPABASE_PORT,
+            )
+        return _pool
 
 
-def run_query(query: str) -> list | None:
+@contextmanager
+def _connection():
+    """
+    Borrows a connection from the pool, waiting while all of them are in use. Commits when the block succeeds and
+    rolls back when it raises. Broken connections are discarded instead of going back to the pool.
+    """
+    pool = _get_pool()
+    with _connection_slots:
+        connection = pool.getconn()
+        try:
+            yield connection
+            connection.commit()
+        except Exception:
+            if not connection.closed:
+                connection.rollback()
+            raise
+        finally:
+            pool.putconn(connection, close=bool(connection.closed))
+
+
+def run_query(query: str, params=None) -> list | None:
     """
     Returns TUPLES of the records returned by the query.
     :param query:
+    :param params: parameters passed to cursor.execute, to avoid formatting values into the query.
     :return:
     """
+    try:
+        with metrics.DB_SECONDS.time(table="postgres", operation="query"):
+            with _connection() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute(query, params)
+                    rows = cursor.fetchall()
+        metrics.DB_REQUESTS.inc(table="postgres", operation="query", status="ok")
+        return rows
 
-    global cursor, connection
+    except Exception as e:
+        metrics.DB_REQUESTS.inc(table="postgres", operation="query", status="error")
+        logger.error(f"An error occurred: {e}")
+        return None
+
+
+def execute(query: str, params=None) -> int | None:
+    """
+    Runs a statement that returns no records, in its own transaction.
+    :return: Amount of rows affected, None if it failed.
+    """
     try:
-        # Connect to the PostgreSQL database
-        connection = psycopg2.connect(
-            dbname=common.SUPABASE_NAME,
-            user=common.SUPABASE_USER,
-            password=common.SUPABASE_PASSWORD,
-            host=common.SUPABASE_HOST,
-            port=common.SUPABASE_PORT
-        )
-
-        # Fetch results using standard cursor
-        with connection.cursor() as cursor:
-            cursor.execute(query)
-            rows = cursor.fetchall()
-            return rows
+        with metrics.DB_SECONDS.time(table="postgres", operation="execute"):
+            with _connection() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute(query, params)
+                    rowcount = cursor.rowcount
+        metrics.DB_REQUESTS.inc(table="postgres", operation="execute", status="ok")
+        return rowcount
 
     except Exception as e:
-        print(f"An error occurred: {e}")
+        metrics.DB_REQUESTS.inc(table="postgres", operation="execute", status="error")
+        logger.error(f"An error occurred: {e}")
         return None
 
-    finally:
-        # Close the cursor and connection
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
+
+def stream_query(
+    query: str, params=None, itersize: int = STREAM_ITERSIZE
+) -> Iterator[tuple]:
+    """
+    Yields TUPLES of the records returned by the query, fetched through a server side cursor itersize rows at a time,
+    so large results never have to fit in memory. The connection is held until the iteration finishes or the
+    generator is closed. Errors are raised to the caller, who may have consumed part of the rows already.
+    """
+    with _connection() as connection:
+        # Named cursors live on the server, the name only has to be unique within the connection.
+        with connection.cursor(name=f"stream_{uuid.uuid4().hex}") as cursor:
+            cursor.itersize = itersize
+            metrics.DB_REQUESTS.inc(table="postgres", operation="stream", status="ok")
+            cursor.execute(query, params)
+            yield from cursor
+
+
+def close_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
@@ -1,13 +1,20 @@
-import requests
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from typing import List
 
 import common
+import metrics
 
 logger = common.get_logger()
 
+# Max amount of proxy checks in flight at the same time when verifying concurrently.
+MAX_PROXY_CHECKS_IN_FLIGHT = 64
+
 
 def get_proxies() -> List[str]:
+    import requests
+
     # ProxyScrape API URL to fetch HTTP proxies
     url = "https://api.proxyscrape.com/v2/?request=getproxies&protocol=http&timeout=10000&country=all&ssl=all&anonymity=all"
 
@@ -24,6 +31,8 @@ def get_proxies() -> List[str]:
 def _verify_proxies(
     proxies, max_proxies: int = 100, test_url="https://httpbin.org/ip", timeout=1
 ) -> List[str]:
+    import requests
+
     working_proxies = []
     total_proxies = len(proxies)
 
@@ -58,9 +67,100 @@ def _verify_proxies(
     return working_proxies
 
 
-def get_verified_proxies(max_proxies: int = 100) -> List[str]:
+def _check_proxy(proxy: str, test_url: str, timeout: float) -> float | None:
+    """
+    Checks that the proxy is able to reach the test url.
+    :return: Latency of the request in seconds, None if the proxy is not working.
+    """
+    import requests
+
+    proxy_dict = {
+        "http": f"http://{proxy}",
+    }
+    start = time.perf_counter()
+    try:
+        response = requests.get(test_url, proxies=proxy_dict, timeout=timeout)
+        if response.status_code == 200:
+            latency = time.perf_counter() - start
+            metrics.PROXY_CHECK_SECONDS.observe(latency, result="ok")
+            metrics.PROXY_CHECKS.inc(result="ok")
+            return latency
+    except requests.exceptions.RequestException:
+        pass
+    metrics.PROXY_CHECK_SECONDS.observe(time.perf_counter() - start, result="failed")
+    metrics.PROXY_CHECKS.inc(result="failed")
+    return None
+
+
+def verify_proxies_concurrent(
+    proxies,
+    max_proxies: int = 100,
+    test_url="https://httpbin.org/ip",
+    timeout=1,
+    max_in_flight: int = MAX_PROXY_CHECKS_IN_FLIGHT,
+) -> List[tuple[str, float]]:
+    """
+    Verifies up to max_in_flight proxies at the same time, stops as soon as max_proxies of them are working.
+    :return: List of (proxy, latency in seconds) of the working proxies, fastest first.
+    """
+    working_proxies: List[tuple[str, float]] = []
+    total_proxies = len(proxies)
+    checked = 0
+    proxies_iter = iter(proxies)
+
+    pool = ThreadPoolExecutor(max_workers=max_in_flight)
+    futures = {}
+    try:
+        for proxy in proxies_iter:
+            futures[pool.submit(_check_proxy, proxy, test_url, timeout)] = proxy
+            if len(futures) >= max_in_flight:
+                break
+
+        while futures and len(working_proxies) < max_proxies:
+            done, _ = wait(futures.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                proxy = futures.pop(future)
+                checked += 1
+                latency = future.result()
+                if latency is not None:
+                    working_proxies.append((proxy, latency))
+                if len(working_proxies) >= max_proxies:
+                    continue
+                # Keep the amount of checks in flight constant until we run out of proxies.
+                next_proxy = next(proxies_iter, None)
+                if next_proxy is not None:
+                    futures[
+                        pool.submit(_check_proxy, next_proxy, test_url, timeout)
+                    ] = next_proxy
+
+            sys.stdout.write(
+                f"\rChecking proxy {checked}/{total_proxies} (working: {len(working_proxies)})"
+            )
+            sys.stdout.flush()
+    finally:
+        # Checks already running will end on their own after the timeout, the queued ones are dropped.
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    sys.stdout.write(
+        f"\rFinished checking {checked} proxies. {len(working_proxies)} working proxies found.\n"
+    )
+    sys.stdout.flush()
+
+    working_proxies.sort(key=lambda proxy_latency: proxy_latency[1])
+    return working_proxies[:max_proxies]
+
+
+def get_verified_proxies(max_proxies: int = 100, concurrent: bool = True) -> List[str]:
+    """
+    :param concurrent: verify many proxies at the same time, False to check them one after the other like before.
+    """
     proxies = get_proxies()
-    valid_proxies = _verify_proxies(proxies, max_proxies)
+    if concurrent:
+        valid_proxies = [
+            proxy for proxy, _ in verify_proxies_concurrent(proxies, max_proxies)
+        ]
+    else:
+        valid_proxies = _verify_proxies(proxies, max_proxies)
 
     if valid_proxies:
         logger.info(f"Found {len(valid_proxies)} valid proxies.")
@@ -1,5 +1,8 @@
-from typing import TypedDict, Optional
-from datetime import datetime
+from typing import TypedDict, Optional, TYPE_CHECKING
+from datetime import datetime, timedelta
+
+if TYPE_CHECKING:
+    from proxy_pool import ProxyPool
 
 
 class JobEntry(TypedDict):
@@ -42,6 +45,7 @@ class SearchEntry(TypedDict):
     created_at: Optional[datetime]
     user_id: str
     last_processed: Optional[datetime]
+    refresh_interval: Optional[timedelta]
 
 
 # Define a type for the list of such dictionaries
@@ -63,3 +67,26 @@ class MissingRatingEntry(TypedDict):
 
 
 MissingRatingEntryList = list[MissingRatingEntry]
+
+
+class ScrapeUnit(TypedDict):
+    search: SearchEntry
+    # Every search sharing this scrape, see scraper.coalesce_scrape_units.
+    searches: SearchEntryList
+    job_source: str
+    search_term: str
+    results_wanted: Optional[int]
+    is_new_search: bool
+    proxies: Optional[list[str]]
+    proxy_pool: Optional["ProxyPool"]
+
+
+ScrapeUnitList = list[ScrapeUnit]
+
+
+class ScrapeUnitError(TypedDict):
+    unit: ScrapeUnit
+    error: str
+
+
+ScrapeUnitErrorList = list[ScrapeUnitError]
@@ -0,0 +1,176 @@
+import hashlib
+import re
+
+import numpy as np
+
+import common
+from my_types import JobEntryList
+
+logger = common.get_logger()
+
+# 16 bands of 8 rows make pairs above ~0.7 Jaccard similarity very likely to share a bucket.
+NUM_PERMUTATIONS = 128
+NUM_BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // NUM_BANDS
+SHINGLE_SIZE = 5
+# Estimated Jaccard similarity above which two descriptions belong to the same cluster.
+SIMILARITY_THRESHOLD = 0.8
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+# Fixed seed, signatures stored in the database must stay comparable between runs.
+_random = np.random.RandomState(1)
+_PERMUTATION_A = _random.randint(
+    1, np.iinfo(np.int64).max, size=NUM_PERMUTATIONS, dtype=np.int64
+).astype(np.uint64)
+_PERMUTATION_B = _random.randint(
+    0, np.iinfo(np.int64).max, size=NUM_PERMUTATIONS, dtype=np.int64
+).astype(np.uint64)
+
+
+def _shingles(text: str) -> set[str]:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {
+        " ".join(words[i : i + SHINGLE_SIZE])
+        for i in range(len(words) - SHINGLE_SIZE + 1)
+    }
+
+
+def minhash_signature(text: str) -> np.ndarray | None:
+    """
+    MinHash signature of the word shingles of the text.
+    :return: Array of NUM_PERMUTATIONS hashes, None if the text has no words.
+    """
+    shingles = _shingles(text or "")
+    if not shingles:
+        return None
+    hashes = np.fromiter(
+        (
+            int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "big")
+            for s in shingles
+        ),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+    # Every permutation is applied to every shingle at once, overflow wraps around like in datasketch.
+    permuted = (
+        np.outer(hashes, _PERMUTATION_A) + _PERMUTATION_B
+    ) % _MERSENNE_PRIME & _MAX_HASH
+    return permuted.min(axis=0)
+
+
+def lsh_buckets(signature: np.ndarray) -> list[str]:
+    """
+    :return: One bucket per band, jobs sharing any bucket are candidates to be near duplicates.
+    """
+    return [
+        f"{band}:"
+        + hashlib.blake2b(
+            signature[band * ROWS_PER_BAND : (band + 1) * ROWS_PER_BAND].tobytes(),
+            digest_size=8,
+        ).hexdigest()
+        for band in range(NUM_BANDS)
+    ]
+
+
+def estimate_similarity(signature: np.ndarray, other: np.ndarray) -> float:
+    return float(np.mean(signature == other))
+
+
+def assign_clusters(jobs: JobEntryList) -> int:
+    """
+    Assigns each of the just inserted jobs to the cluster of its closest near duplicate, or to a new cluster of its own.
+    Lookups only touch the jobs sharing an LSH bucket, so they don't grow with the size of the job table.
+    :param jobs: jobs with their database id set.
+    :return: Amount of jobs that were found to be near duplicates of another one.
+    """
+    signatures: dict[int, np.ndarray] = {}
+    buckets: dict[int, list[str]] = {}
+    for job in jobs:
+        signature = minhash_signature(
+            f"{job.get('title') or ''} {job.get('description') or ''}"
+        )
+        if job.get("id") is None or signature is None:
+            continue
+        signatures[job["id"]] = signature
+        buckets[job["id"]] = lsh_buckets(signature)
+    if not signatures:
+        return 0
+
+    # Candidates already in the database, found with one lookup of every bucket of the batch.
+    candidates_by_bucket: dict[str, set[int]] = {}
+    for row in common.select_in(
+        "job_lsh_bucket",
+        ("bucket", "job_id"),
+        "bucket",
+        {bucket for job_buckets in buckets.values() for bucket in job_buckets},
+    ):
+        candidates_by_bucket.setdefault(row["bucket"], set()).add(row["job_id"])
+    candidate_ids = set().union(*candidates_by_bucket.values()) - signatures.keys()
+    candidates = {
+        row["id"]: row
+        for row in common.select_in(
+            "job", ("id", "minhash", "canonical_job_id"), "id", candidate_ids
+        )
+        if row["minhash"]
+    }
+    candidate_signatures = {
+        job_id: np.array(row["minhash"], dtype=np.uint64)
+        for job_id, row in candidates.items()
+    }
+    canonical_ids = {
+        job_id: row["canonical_job_id"] or job_id for job_id, row in candidates.items()
+    }
+
+    duplicates = 0
+    updates = []
+    jobs_by_id = {job["id"]: job for job in jobs if job.get("id") in signatures}
+    for job_id, signature in signatures.items():
+        best_id, best_similarity = None, SIMILARITY_THRESHOLD
+        for bucket in buckets[job_id]:
+            for candidate_id in candidates_by_bucket.get(bucket, ()):
+                if candidate_id not in candidate_signatures:
+                    continue
+                similarity = estimate_similarity(
+                    signature, candidate_signatures[candidate_id]
+                )
+                if similarity >= best_similarity:
+                    best_id, best_similarity = candidate_id, similarity
+        canonical_id = canonical_ids[best_id] if best_id is not None else job_id
+        if best_id is not None:
+            duplicates += 1
+
+        # Later jobs of the same batch can be near duplicates of this one.
+        candidate_signatures[job_id] = signature
+        canonical_ids[job_id] = canonical_id
+        for bucket in buckets[job_id]:
+            candidates_by_bucket.setdefault(bucket, set()).add(job_id)
+
+        jobs_by_id[job_id]["canonical_job_id"] = canonical_id
+        updates.append(
+            {
+                "id": job_id,
+                "job_url": jobs_by_id[job_id]["job_url"],
+                "canonical_job_id": canonical_id,
+                "minhash": signature.tolist(),
+            }
+        )
+
+    common.get_supabase_client().table("job").upsert(
+        updates, on_conflict="job_url", default_to_null=False
+    ).execute()
+    common.get_supabase_client().table("job_lsh_bucket").upsert(
+        [
+            {"bucket": bucket, "job_id": job_id}
+            for job_id, job_buckets in buckets.items()
+            for bucket in job_buckets
+        ],
+        ignore_duplicates=True,
+        default_to_null=False,
+    ).execute()
+    logger.info(
+        f"Assigned {len(signatures)} jobs to clusters, {duplicates} near duplicates found."
+    )
+    return duplicates
@@ -0,0 +1,133 @@
+import queue
+import threading
+from typing import Callable
+
+import common
+import my_types
+import rating_queue
+
+logger = common.get_logger()
+
+# Max job ids waiting to be rated, scrapes block once it is full until the rating workers catch up.
+PIPELINE_QUEUE_SIZE = 2000
+# Max job ids rated together, their missing ratings are leased in one query and rated in one call.
+PIPELINE_BATCH_SIZE = 100
+# Threads taking batches off the queue, each batch is rated with the concurrency of process_missing_ratings.
+PIPELINE_RATING_WORKERS = 2
+
+# Tells a rating worker that no more jobs are coming.
+_DONE = object()
+
+
+class RatingPipeline:
+    """
+    Rates the jobs while they are still being scraped: scrapes put the ids of the jobs they stored on a bounded queue
+    and rating workers take them off it in batches. Once full, put blocks, so a fast scrape waits for the rating
+    instead of piling up jobs in memory.
+    Every worker queues the missing ratings of its batch in rating_queue and leases them, like a queue worker, so a
+    job put twice or a concurrent worker never rates the same pair twice. Once rated the pairs are released
+    instead of acknowledged: the ones without a rating, failed or left by rate, are claimed right away by the next
+    process_it. The last_processed watermark is never advanced here.
+    """
+
+    def __init__(
+        self,
+        rate: Callable[[my_types.MissingRatingEntryList], int],
+        queue_size: int = PIPELINE_QUEUE_SIZE,
+        batch_size: int = PIPELINE_BATCH_SIZE,
+        workers: int = PIPELINE_RATING_WORKERS,
+    ):
+        """
+        :param rate: rates a list of missing ratings and returns the amount stored, e.g.
+        processor.process_missing_ratings.
+        """
+        self.rate = rate
+        self.batch_size = batch_size
+        self.stored = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        # Job ids already put, their pairs were leased once and are not looked up again. Pairs the job gets later,
+        # from another search, are left to process_it.
+        self._seen: set[int] = set()
+        self._threads = [
+            threading.Thread(
+                target=self._work,
+                args=(rating_queue.new_worker_id(),),
+                name=f"rating-pipeline-{i}",
+                daemon=True,
+            )
+            for i in range(workers)
+        ]
+
+    def __enter__(self) -> "RatingPipeline":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def start(self) -> None:
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, job_ids: list[int]) -> None:
+        """
+        Queues the jobs to be rated, blocks while the queue is full. Jobs already put are left out. Safe to call from
+        any thread.
+        """
+        with self._lock:
+            job_ids = [
+                job_id for job_id in dict.fromkeys(job_ids) if job_id not in self._seen
+            ]
+            self._seen.update(job_ids)
+        for job_id in job_ids:
+            self._queue.put(job_id)
+
+    def close(self) -> int:
+        """
+        Waits for the rating workers to rate every queued job.
+        :return: Amount of ratings stored.
+        """
+        for _ in self._threads:
+            self._queue.put(_DONE)
+        for thread in self._threads:
+            thread.join()
+        logger.info(f"Rating pipeline stored {self.stored} ratings.")
+        return self.stored
+
+    def _next_batch(self) -> tuple[list[int], bool]:
+        """
+        Waits for a job id and takes the ones already queued behind it, up to batch_size.
+        :return: Tuple of (job ids, whether no more jobs are coming).
+        """
+        job_ids = []
+        item = self._queue.get()
+        while item is not _DONE:
+            job_ids.append(item)
+            if len(job_ids) >= self.batch_size:
+                return job_ids, False
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return job_ids, False
+        return job_ids, True
+
+    def _work(self, owner: str) -> None:
+        """
+        :param owner: lease owner of this worker, the workers never release each other's pairs.
+        """
+        done = False
+        while not done:
+            job_ids, done = self._next_batch()
+            if not job_ids:
+                continue
+            missing_ratings = rating_queue.lease_jobs(owner, job_ids)
+            if not missing_ratings:
+                continue
+            try:
+                stored = self.rate(missing_ratings)
+                with self._lock:
+                    self.stored += stored
+            except Exception as e:
+                logger.error(f"Error rating a batch of {len(job_ids)} jobs: {str(e)}")
+            rating_queue.release(owner)
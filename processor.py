@@ -1,85 +1,676 @@
-from supabase import Client
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
 
 import common
+import metrics
 import my_types
-from ai_calls import generate_rating
+import rating_queue
+from compaction import compact_jobs
+from ai_calls import (
+    estimate_tokens,
+    generate_group_rating,
+    generate_rating,
+    plan_rating_groups,
+    MODEL,
+    RATING_GROUP_SYSTEM_PROMPT,
+    RATING_SYSTEM_PROMPT,
+    RATING_TEMPERATURE,
+)
+from rating_cache import RatingCache, rating_cache_key
+from similarity import pair_similarities, select_pairs
 
-# Initialize Logger, Supabase and OpenAI
+# Initialize Logger
 logger = common.get_logger()
-supabase: Client = common.get_supabase_client()
-openai = common.get_openai_client()
 
+# Max amount of rows sent in a single insert or upsert.
+WRITE_CHUNK_SIZE = 200
+# Only the columns used to build the prompt and store the rating.
+JOB_COLUMNS = ("id", "title", "description", "canonical_job_id")
+RESUME_COLUMNS = ("id", "content", "user_id")
+# Columns copied from the rating of a near duplicate instead of calling the model again.
+RATING_COLUMNS = (
+    "job_id",
+    "resume_id",
+    "rating",
+    "justification",
+    "display_data",
+    "model",
+    "token_limit",
+    "system_prompt",
+    "user_prompt",
+    "temperature",
+)
+JOB_DATA_COLUMNS = (
+    "id",
+    "interval",
+    "min_amount",
+    "max_amount",
+    "currency",
+    "is_remote",
+)
+# Ratings in flight at the same time, the rate limiter in ai_calls decides how fast they actually go.
+MAX_RATING_WORKERS = 32
 
-def process_missing_ratings(missing_ratings: my_types.MissingRatingEntryList):
-    for missing_rating in missing_ratings:
-        try:
-            response = (
-                supabase.table("job")
-                .select("*")
-                .eq("id", missing_rating["job_id"])
-                .execute()
-            )
-            if not response.data or len(response.data) <= 0:
-                logger.error(
-                    f"Error fetching unprocessed jobs or job is missing with ID {missing_rating['job_id']}."
-                )
-                continue
-            job = response.data[0]
-
-            response = (
-                supabase.table("resume")
-                .select("*")
-                .eq("id", missing_rating["resume_id"])
-                .execute()
-            )
-            if not response.data or len(response.data) <= 0:
-                logger.error(
-                    f"Error fetching unprocessed jobs or resume is missing with ID {missing_rating['resume_id']}."
-                )
-                continue
-            resume = response.data[0]
+# Local TF-IDF pre-filter, pairs below the similarity threshold that are not in the top k of their resume are skipped.
+# Off by default: the top k is picked among the pairs of a single claimed batch, so whether a pair is rated or skipped
+# for good depends on the pairs it was claimed with.
+PREFILTER_ENABLED = False
+PREFILTER_TOP_K = 10
+PREFILTER_MIN_SIMILARITY = 0.05
+PREFILTER_MODEL = "tfidf-prefilter"
+# Whether several jobs of the same resume are rated with a single completion.
+GROUPED_RATINGS = False
+# Whether job descriptions are stripped of boilerplate and cut to the token budget before being sent to the model.
+COMPACTION_ENABLED = True
+
+rating_cache = RatingCache()
+
+
+def _fetch_by_ids(table: str, columns: tuple[str, ...], ids) -> dict[int, dict]:
+    """
+    Fetches the rows of the table with the given ids using as few in_() queries as possible.
+    :return: Dictionary of the rows by id.
+    """
+    return {row["id"]: row for row in common.select_in(table, columns, "id", ids)}
+
+
+def _prefetch(
+    missing_ratings: my_types.MissingRatingEntryList,
+    resume_cache: dict[int, dict],
+) -> dict[int, dict]:
+    """
+    Fetches every job of the missing ratings in bulk and adds the resumes that are not cached yet to resume_cache.
+    :return: Dictionary of the jobs by id.
+    """
+    jobs = _fetch_by_ids("job", JOB_COLUMNS, [mr["job_id"] for mr in missing_ratings])
+    missing_resume_ids = [
+        mr["resume_id"] for mr in missing_ratings if mr["resume_id"] not in resume_cache
+    ]
+    if missing_resume_ids:
+        resume_cache.update(_fetch_by_ids("resume", RESUME_COLUMNS, missing_resume_ids))
+    logger.info(
+        f"Prefetched {len(jobs)} jobs and {len(resume_cache)} resumes for {len(missing_ratings)} missing ratings."
+    )
+    return jobs
+
+
+def _fetch_cluster_ratings(
+    cluster_keys: list[tuple[int, int]],
+) -> dict[tuple[int, int], tuple[dict, dict]]:
+    """
+    Finds the ratings already stored for the canonical job of each (cluster_id, resume_id), so that a new near
+    duplicate of an already rated job gets a copy of its rating.
+    :return: Dictionary of (job_data, rating_data) by (cluster_id, resume_id).
+    """
+    wanted = set(cluster_keys)
+    ratings = {}
+    for rating in common.select_in(
+        "rating",
+        RATING_COLUMNS,
+        "job_id",
+        [cluster_id for cluster_id, _ in cluster_keys],
+    ):
+        key = (rating.pop("job_id"), rating.pop("resume_id"))
+        if key in wanted:
+            ratings[key] = rating
+    if not ratings:
+        return {}
+
+    jobs_data = _fetch_by_ids(
+        "job", JOB_DATA_COLUMNS, [cluster_id for cluster_id, _ in ratings]
+    )
+    return {
+        key: (
+            {k: v for k, v in jobs_data[key[0]].items() if k != "id"},
+            rating,
+        )
+        for key, rating in ratings.items()
+        if key[0] in jobs_data
+    }
+
+
+def _already_rated(job_ids) -> set[tuple[int, int]]:
+    """
+    :return: The (job_id, resume_id) pairs of the jobs that already have a rating.
+    """
+    return {
+        (r["job_id"], r["resume_id"])
+        for r in common.select_in("rating", ("job_id", "resume_id"), "job_id", job_ids)
+    }
+
+
+def _store_rating(
+    missing_rating: my_types.MissingRatingEntry,
+    resume: dict,
+    job_data: dict,
+    rating_data: dict,
+) -> bool:
+    """
+    Updates the job with the data found by the model and inserts the rating of the (job, resume) pair.
+    :param job_data: empty to leave the job untouched.
+    :return: True if the rating was stored.
+    """
+    if job_data:
+        update_response = (
+            common.get_supabase_client()
+            .table("job")
+            .update(job_data)
+            .eq("id", missing_rating["job_id"])
+            .execute()
+        )
+        if not update_response.data or len(update_response.data) < 0:
+            logger.error(f"Error updating job with ID: {missing_rating['job_id']}")
+        else:
+            logger.info(f"Processed job with ID: {missing_rating['job_id']}")
+
+    rating_data["job_id"] = missing_rating["job_id"]
+    rating_data["resume_id"] = missing_rating["resume_id"]
+    rating_data["user_id"] = resume["user_id"]
+
+    response = (
+        common.get_supabase_client().table("rating").insert(rating_data).execute()
+    )
+    if not response.data or len(response.data) < 0:
+        logger.error(
+            f"Error inserting rating with IDs: {missing_rating['job_id']}, {missing_rating['resume_id']}"
+        )
+        return False
+    metrics.RATINGS_STORED.inc(source="single")
+    logger.info(f"Processed rating with ID: {response.data[0]['id']}")
+    return True
 
-            candidate_data = f"""
+
+def _store_ratings(
+    results: list[tuple[my_types.MissingRatingEntry, dict, dict, dict]],
+) -> int:
+    """
+    Bulk version of _store_rating, updates the jobs with one upsert and inserts the ratings with one insert per chunk.
+    Pairs that already have a rating are left untouched, so storing the same results twice is harmless.
+    :param results: list of (missing_rating, resume, job_data, rating_data).
+    :return: Amount of ratings stored.
+    """
+    already_rated = _already_rated([mr["job_id"] for mr, _, _, _ in results])
+
+    jobs_data = {}
+    ratings = []
+    for missing_rating, resume, job_data, rating_data in results:
+        if (missing_rating["job_id"], missing_rating["resume_id"]) in already_rated:
+            continue
+        if job_data:
+            jobs_data[missing_rating["job_id"]] = {
+                "id": missing_rating["job_id"],
+                **job_data,
+            }
+        ratings.append(
+            {
+                **rating_data,
+                "job_id": missing_rating["job_id"],
+                "resume_id": missing_rating["resume_id"],
+                "user_id": resume["user_id"],
+            }
+        )
+
+    job_rows = _fetch_by_ids("job", ("id", "job_url"), list(jobs_data.keys()))
+    job_updates = [
+        {**job_data, "job_url": job_rows[job_id]["job_url"]}
+        for job_id, job_data in jobs_data.items()
+        if job_id in job_rows
+    ]
+    for i in range(0, len(job_updates), WRITE_CHUNK_SIZE):
+        common.get_supabase_client().table("job").upsert(
+            job_updates[i : i + WRITE_CHUNK_SIZE],
+            on_conflict="job_url",
+            default_to_null=False,
+        ).execute()
+
+    stored = 0
+    for i in range(0, len(ratings), WRITE_CHUNK_SIZE):
+        response = (
+            common.get_supabase_client()
+            .table("rating")
+            .insert(ratings[i : i + WRITE_CHUNK_SIZE], default_to_null=False)
+            .execute()
+        )
+        stored += len(response.data or [])
+    metrics.RATINGS_STORED.inc(stored, source="bulk")
+    logger.info(
+        f"Stored {stored} ratings, {len(results) - len(ratings)} were already rated."
+    )
+    return stored
+
+
+def _cluster_results(
+    cluster: my_types.MissingRatingEntryList,
+    resume: dict,
+    job_data: dict,
+    rating_data: dict,
+    rated_job_id: int | None,
+) -> list[tuple[my_types.MissingRatingEntry, dict, dict, dict]]:
+    """
+    Results to store for every missing rating of a near duplicate cluster. Only the job the model read gets the job
+    data found by it, the other members may differ in pay or remote status and only get a copy of the rating.
+    :param rated_job_id: id of the job the rating was made for, None if it is not part of the cluster.
+    :return: List of (missing_rating, resume, job_data, rating_data), as taken by _store_ratings.
+    """
+    return [
+        (
+            missing_rating,
+            resume,
+            job_data if missing_rating["job_id"] == rated_job_id else {},
+            rating_data,
+        )
+        for missing_rating in cluster
+    ]
+
+
+def _candidate_data(job: dict, resume: dict) -> str:
+    return f"""
             \n\nJob Title: {job['title']}
             \n\nJob Description: {job['description']}
             \n\nResume: {resume['content']}
             """
-            try:
-                # Make the API call to GPT
-                job_data, rating_data = generate_rating(candidate_data)
-                if not job_data:
-                    continue
-
-                update_response = (
-                    supabase.table("job")
-                    .update(job_data)
-                    .eq("id", missing_rating["job_id"])
-                    .execute()
-                )
-                if not update_response.data or len(response.data) < 0:
-                    logger.error(
-                        f"Error updating job with ID: {missing_rating['job_id']}"
-                    )
-                else:
-                    logger.info(f"Processed job with ID: {missing_rating['job_id']}")
-
-                rating_data["job_id"] = missing_rating["job_id"]
-                rating_data["resume_id"] = missing_rating["resume_id"]
-                rating_data["user_id"] = resume["user_id"]
-
-                response = supabase.table("rating").insert(rating_data).execute()
-                if not response.data or len(response.data) < 0:
-                    logger.error(
-                        f"Error inserting rating with IDs: {missing_rating['job_id']}, {missing_rating['resume_id']}"
-                    )
-                else:
-                    logger.info(f"Processed rating with ID: {response.data[0]['id']}")
-
-            except Exception as e:
-                logger.error(
-                    f"Error processing missing_rating with ID {missing_rating['job_id']}, {missing_rating['resume_id']}: {str(e)}"
-                )
+
+
+def _rating_cache_key(
+    job: dict, resume: dict, system_prompt: list = RATING_SYSTEM_PROMPT
+) -> str:
+    """
+    :param system_prompt: prompt the rating is made with, grouped ratings are cached apart from single ones.
+    """
+    return rating_cache_key(
+        job["title"],
+        job["description"],
+        resume["content"],
+        system_prompt,
+        MODEL,
+        RATING_TEMPERATURE,
+    )
+
+
+def _rate(job: dict, resume: dict) -> tuple[dict, dict] | None:
+    """
+    Rates how well the resume matches the job, duplicated postings are served from the rating cache without calling
+    the model.
+    :return: Tuple of (job_data, rating_data), None if the model failed.
+    """
+    cache_key = _rating_cache_key(job, resume)
+    result = rating_cache.get(cache_key)
+    if result is None:
+        # Make the API call to GPT
+        result = generate_rating(_candidate_data(job, resume))
+        if not result:
+            return None
+        rating_cache.put(cache_key, *result)
+    return result
+
+
+def _process_missing_rating_cluster(
+    missing_ratings: my_types.MissingRatingEntryList,
+    job: dict,
+    resume: dict,
+    result: tuple[dict, dict] | None = None,
+) -> int:
+    """
+    Rates the representative job of a near duplicate cluster for a resume and stores the same rating for every missing
+    rating of the cluster, safe to call from multiple threads.
+    :param result: rating of the canonical job of the cluster, already stored, the model is only called without it.
+    :return: Amount of ratings stored.
+    """
+    try:
+        # A known result was made for the canonical job, which is not among the missing ratings.
+        rated_job_id = None
+        if result is None:
+            result = _rate(job, resume)
+            rated_job_id = job["id"]
+        if result is None:
+            return 0
+        job_data, rating_data = result
+    except Exception as e:
+        logger.error(
+            f"Error processing missing_rating with ID {job['id']}, {resume['id']}: {str(e)}"
+        )
+        return 0
+
+    stored = 0
+    for missing_rating, _, member_job_data, _ in _cluster_results(
+        missing_ratings, resume, job_data, rating_data, rated_job_id
+    ):
+        try:
+            if _store_rating(
+                missing_rating, resume, dict(member_job_data), dict(rating_data)
+            ):
+                stored += 1
         except Exception as e:
             logger.error(
-                f"Error fetching job with ID {missing_rating['job_id']}: {str(e)}"
+                f"Error processing missing_rating with ID {missing_rating['job_id']}, {missing_rating['resume_id']}: {str(e)}"
+            )
+    return stored
+
+
+def _prefilter(
+    missing_ratings: my_types.MissingRatingEntryList,
+    jobs: dict[int, dict],
+    resume_cache: dict[int, dict],
+    defer_dissimilar: bool = False,
+) -> tuple[my_types.MissingRatingEntryList, int]:
+    """
+    Scores every pair locally with TF-IDF before calling the model. Pairs that are neither above
+    PREFILTER_MIN_SIMILARITY nor in the top PREFILTER_TOP_K of their resume get a skipped rating stored, so they are not
+    queued again.
+    :param defer_dissimilar: keep only the pairs above PREFILTER_MIN_SIMILARITY and leave the others missing, without
+    a skipped rating, for a later run to pick the top PREFILTER_TOP_K among more of the jobs of their resume.
+    :return: Tuple of the missing ratings worth sending to the model and the amount of skipped ones.
+    """
+    if not missing_ratings:
+        return missing_ratings, 0
+    pairs = [(mr["job_id"], mr["resume_id"]) for mr in missing_ratings]
+    similarities = pair_similarities(
+        {
+            job_id: f"{job['title'] or ''} {job['description'] or ''}"
+            for job_id, job in jobs.items()
+        },
+        {
+            resume_id: resume["content"] or ""
+            for resume_id, resume in resume_cache.items()
+        },
+        pairs,
+    )
+    keep = select_pairs(
+        similarities,
+        np.array([resume_id for _, resume_id in pairs]),
+        0 if defer_dissimilar else PREFILTER_TOP_K,
+        PREFILTER_MIN_SIMILARITY,
+    )
+    if defer_dissimilar:
+        logger.info(
+            f"Pre-filter kept {int(keep.sum())} of {len(missing_ratings)} missing ratings, deferred the rest."
+        )
+        return [mr for mr, kept in zip(missing_ratings, keep) if kept], 0
+
+    skipped_ratings = [
+        {
+            "job_id": missing_rating["job_id"],
+            "resume_id": missing_rating["resume_id"],
+            "user_id": resume_cache[missing_rating["resume_id"]]["user_id"],
+            "rating": 0,
+            "justification": f"Skipped, the resume is not similar enough to the job description "
+            f"(similarity {similarity:.3f}).",
+            "model": PREFILTER_MODEL,
+        }
+        for missing_rating, similarity, kept in zip(missing_ratings, similarities, keep)
+        if not kept
+    ]
+    for i in range(0, len(skipped_ratings), WRITE_CHUNK_SIZE):
+        response = (
+            common.get_supabase_client()
+            .table("rating")
+            .insert(skipped_ratings[i : i + WRITE_CHUNK_SIZE], default_to_null=False)
+            .execute()
+        )
+        metrics.RATINGS_STORED.inc(len(response.data or []), source="prefilter")
+    logger.info(
+        f"Pre-filter kept {int(keep.sum())} of {len(missing_ratings)} missing ratings."
+    )
+    return [mr for mr, kept in zip(missing_ratings, keep) if kept], len(skipped_ratings)
+
+
+def _process_missing_rating_group(
+    clusters: list[my_types.MissingRatingEntryList],
+    jobs: list[dict],
+    resume: dict,
+) -> int:
+    """
+    Rates the representative jobs of several clusters against the same resume with a single grouped completion and
+    stores the ratings, falling back to rating each cluster on its own if the answer is malformed.
+    :return: Amount of ratings stored.
+    """
+    try:
+        results = None
+        if len(jobs) > 1:
+            results = generate_group_rating(
+                resume["content"], [(job["title"], job["description"]) for job in jobs]
+            )
+        if results is None:
+            return sum(
+                _process_missing_rating_cluster(cluster, job, resume)
+                for cluster, job in zip(clusters, jobs)
+            )
+
+        stored_results = []
+        for cluster, job, (job_data, rating_data) in zip(clusters, jobs, results):
+            rating_cache.put(
+                _rating_cache_key(job, resume, RATING_GROUP_SYSTEM_PROMPT),
+                job_data,
+                rating_data,
+            )
+            stored_results += _cluster_results(
+                cluster, resume, job_data, rating_data, job["id"]
+            )
+        return _store_ratings(stored_results)
+    except Exception as e:
+        logger.error(
+            f"Error processing grouped rating of resume with ID {resume['id']}: {str(e)}"
+        )
+        return 0
+
+
+def _submit_groups(
+    pool: ThreadPoolExecutor,
+    jobs: dict[int, dict],
+    resume_cache: dict[int, dict],
+    clusters: dict[tuple[int, int], my_types.MissingRatingEntryList],
+    cluster_ratings: dict[tuple[int, int], tuple[dict, dict]],
+) -> tuple[list, int]:
+    """
+    Stores the clusters whose rating is already known and submits the rest grouped by resume, in groups sized by
+    ai_calls.plan_rating_groups.
+    :return: Tuple of the submitted futures and the amount of ratings stored right away.
+    """
+    known_results = []
+    pending: dict[int, list[tuple[int, int]]] = {}
+    for cluster_key, cluster in clusters.items():
+        job = jobs[cluster[0]["job_id"]]
+        resume = resume_cache[cluster_key[1]]
+        result, rated_job_id = cluster_ratings.get(cluster_key), None
+        # Single ratings are reused by grouped runs, not the other way around.
+        for system_prompt in (RATING_SYSTEM_PROMPT, RATING_GROUP_SYSTEM_PROMPT):
+            if result is None:
+                result = rating_cache.get(_rating_cache_key(job, resume, system_prompt))
+                rated_job_id = job["id"]
+        if result is not None:
+            known_results += _cluster_results(cluster, resume, *result, rated_job_id)
+        else:
+            pending.setdefault(cluster_key[1], []).append(cluster_key)
+    stored = _store_ratings(known_results) if known_results else 0
+
+    futures = []
+    for resume_id, cluster_keys in pending.items():
+        resume = resume_cache[resume_id]
+        group_jobs = [jobs[clusters[key][0]["job_id"]] for key in cluster_keys]
+        groups = plan_rating_groups(
+            [
+                estimate_tokens(f"{job['title']} {job['description']}")
+                for job in group_jobs
+            ],
+            estimate_tokens(resume["content"] or ""),
+        )
+        for group in groups:
+            futures.append(
+                pool.submit(
+                    _process_missing_rating_group,
+                    [clusters[cluster_keys[i]] for i in group],
+                    [group_jobs[i] for i in group],
+                    resume,
+                )
+            )
+    return futures, stored
+
+
+def _prepare(
+    missing_ratings: my_types.MissingRatingEntryList,
+    defer_dissimilar: bool = False,
+) -> tuple[dict, dict, dict, dict, int] | None:
+    """
+    Prefetches everything needed to rate the missing ratings, drops the ones the pre-filter skips and groups the rest
+    into near duplicate clusters.
+    :return: Tuple of (jobs, resumes, clusters by (cluster_id, resume_id), ratings already known for some clusters,
+    amount of skipped ratings), None if the prefetch failed.
+    """
+    resume_cache: dict[int, dict] = {}
+    try:
+        jobs = _prefetch(missing_ratings, resume_cache)
+    except Exception as e:
+        logger.error(f"Error prefetching jobs and resumes: {str(e)}")
+        return None
+
+    valid_ratings: my_types.MissingRatingEntryList = []
+    for missing_rating in missing_ratings:
+        if missing_rating["job_id"] not in jobs:
+            logger.error(
+                f"Error fetching unprocessed jobs or job is missing with ID {missing_rating['job_id']}."
             )
+            continue
+
+        if missing_rating["resume_id"] not in resume_cache:
+            logger.error(
+                f"Error fetching unprocessed jobs or resume is missing with ID {missing_rating['resume_id']}."
+            )
+            continue
+
+        valid_ratings.append(missing_rating)
+
+    # A pair claimed again after its rating was stored, e.g. because its worker died before the ack, is not rated twice.
+    try:
+        rated = _already_rated([mr["job_id"] for mr in valid_ratings])
+    except Exception as e:
+        logger.error(f"Error looking up the pairs already rated: {str(e)}")
+        return None
+    unrated = [
+        mr for mr in valid_ratings if (mr["job_id"], mr["resume_id"]) not in rated
+    ]
+    if len(unrated) < len(valid_ratings):
+        logger.info(
+            f"{len(valid_ratings) - len(unrated)} missing ratings were already rated."
+        )
+    valid_ratings = unrated
+
+    skipped = 0
+    if PREFILTER_ENABLED:
+        try:
+            valid_ratings, skipped = _prefilter(
+                valid_ratings, jobs, resume_cache, defer_dissimilar
+            )
+        except Exception as e:
+            logger.error(f"Error in the similarity pre-filter: {str(e)}")
+
+    if COMPACTION_ENABLED:
+        # Only the jobs that will actually be sent to the model, the pre-filter works on the full descriptions.
+        rated_job_ids = {mr["job_id"] for mr in valid_ratings}
+        try:
+            saved = compact_jobs(
+                {job_id: job for job_id, job in jobs.items() if job_id in rated_job_ids}
+            )
+            logger.info(
+                f"Compacted {len(rated_job_ids)} job descriptions, {saved} tokens saved."
+            )
+        except Exception as e:
+            logger.error(f"Error compacting job descriptions: {str(e)}")
+
+    clusters: dict[tuple[int, int], my_types.MissingRatingEntryList] = {}
+    for missing_rating in valid_ratings:
+        job = jobs[missing_rating["job_id"]]
+        cluster_id = job.get("canonical_job_id") or job["id"]
+        clusters.setdefault((cluster_id, missing_rating["resume_id"]), []).append(
+            missing_rating
+        )
+
+    try:
+        cluster_ratings = _fetch_cluster_ratings(list(clusters.keys()))
+    except Exception as e:
+        logger.error(f"Error fetching ratings of near duplicates: {str(e)}")
+        cluster_ratings = {}
+
+    logger.info(
+        f"{len(valid_ratings)} missing ratings to process in {len(clusters)} clusters, "
+        f"{len(cluster_ratings)} clusters already rated, {skipped} skipped by the pre-filter."
+    )
+    return jobs, resume_cache, clusters, cluster_ratings, skipped
+
+
+def process_missing_ratings(
+    missing_ratings: my_types.MissingRatingEntryList,
+    max_workers: int = MAX_RATING_WORKERS,
+    grouped: bool = GROUPED_RATINGS,
+    defer_dissimilar: bool = False,
+) -> int:
+    """
+    Rates the missing ratings concurrently, the shared rate limiter in ai_calls keeps the calls under the API limits.
+    Only one job per near duplicate cluster is rated for each resume, the others get a copy of its rating.
+    :param grouped: rate several jobs of the same resume per completion instead of one.
+    :param defer_dissimilar: only rate the pairs the pre-filter keeps whatever the other jobs of their resume, and leave
+    the rest missing, e.g. when rating a few jobs at a time while they are scraped.
+    :return: Amount of ratings stored.
+    """
+    prepared = _prepare(missing_ratings, defer_dissimilar)
+    if prepared is None:
+        return 0
+    jobs, resume_cache, clusters, cluster_ratings, skipped = prepared
+
+    stored = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        if grouped:
+            futures, stored = _submit_groups(
+                pool, jobs, resume_cache, clusters, cluster_ratings
+            )
+        else:
+            futures = [
+                pool.submit(
+                    _process_missing_rating_cluster,
+                    cluster,
+                    jobs[cluster[0]["job_id"]],
+                    resume_cache[cluster_key[1]],
+                    cluster_ratings.get(cluster_key),
+                )
+                for cluster_key, cluster in clusters.items()
+            ]
+        for future in as_completed(futures):
+            stored += future.result()
+
+    cache_stats = rating_cache.stats()
+    logger.info(
+        f"Stored {stored} of {len(missing_ratings)} missing ratings, {skipped} skipped by the pre-filter. "
+        f"Rating cache hits: {cache_stats['hits']}, misses: {cache_stats['misses']}."
+    )
+    return stored
+
+
+def process_rating_queue(
+    owner: str | None = None,
+    max_workers: int = MAX_RATING_WORKERS,
+    grouped: bool = GROUPED_RATINGS,
+    max_ratings: int | None = None,
+    time_budget: float | None = None,
+    stop: threading.Event | None = None,
+) -> int:
+    """
+    Worker loop over rating_queue: claims batches of missing ratings, rates them with process_missing_ratings and
+    acknowledges them, until the queue is empty. Run as many of these as needed, on any amount of machines.
+    :param owner: id of the worker holding the leases, a unique one by default.
+    :param max_ratings: max amount of queued pairs to rate, None for all of them.
+    :param time_budget: seconds after which no more batches are claimed, None for no limit.
+    :param stop: no more batches are claimed once it is set.
+    :return: Amount of ratings stored.
+    """
+    return rating_queue.run_worker(
+        lambda missing_ratings: process_missing_ratings(
+            missing_ratings, max_workers=max_workers, grouped=grouped
+        ),
+        owner=owner,
+        max_pairs=max_ratings,
+        deadline=None if time_budget is None else time.monotonic() + time_budget,
+        stop=stop,
+    )
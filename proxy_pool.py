@@ -0,0 +1,217 @@
+import json
+import os
+import threading
+import time
+from typing import List, TypedDict
+
+import common
+import metrics
+import my_proxies
+
+logger = common.get_logger()
+
+PROXY_POOL_PATH = os.path.join(".cache", "proxy_pool.json")
+# Seconds after which a verified proxy has to be checked again.
+PROXY_TTL = 60 * 60
+# Health is an exponential moving average of the recent outcomes, 1 means every recent request worked.
+HEALTH_DECAY = 0.8
+MIN_HEALTH = 0.3
+# Amount of proxies handed to each scrape.
+PROXIES_PER_SCRAPE = 10
+# Amount of the highest scored proxies the scrapes take turns on, so concurrent scrapes spread over them.
+ROTATION_SIZE = 5 * PROXIES_PER_SCRAPE
+# Exceptions, by class name, raised when the proxy could not be reached or dropped the connection, as opposed to the
+# job board answering with an error. Matched by name to not import the HTTP libraries here.
+PROXY_ERRORS = {
+    "ProxyError",
+    "ConnectionError",
+    "ConnectTimeout",
+    "ReadTimeout",
+    "Timeout",
+    "TimeoutError",
+    "SSLError",
+    "TLSClientExeption",
+}
+
+
+class ProxyEntry(TypedDict):
+    latency: float
+    checked_at: float
+    health: float
+
+
+class ProxyPool:
+    """
+    Keeps the verified proxies on disk between runs, so only the stale ones have to be verified again.
+    Proxies are scored by their recent success rate and latency, the ones reported as failing are dropped.
+    """
+
+    def __init__(self, path: str = PROXY_POOL_PATH, ttl: float = PROXY_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._proxies: dict[str, ProxyEntry] = {}
+        # Start of the next rotation window of best.
+        self._next = 0
+        self.load()
+
+    def __len__(self) -> int:
+        return len(self._proxies)
+
+    def load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as file:
+                proxies = json.load(file)
+            with self._lock:
+                self._proxies = proxies
+            logger.info(f"Loaded {len(proxies)} proxies from {self.path}.")
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading proxy pool, starting empty: {e}")
+
+    def save(self) -> None:
+        with self._lock:
+            proxies = dict(self._proxies)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Write to a temporary file first so an interrupted run never leaves a corrupt pool behind.
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(proxies, file)
+        os.replace(tmp_path, self.path)
+
+    def needs_refresh(self, min_proxies: int = 100) -> bool:
+        """
+        :return: True if the pool has less than min_proxies or some of them are stale.
+        """
+        now = time.time()
+        with self._lock:
+            return len(self._proxies) < min_proxies or any(
+                now - entry["checked_at"] > self.ttl for entry in self._proxies.values()
+            )
+
+    def refresh(self, min_proxies: int = 100) -> None:
+        """
+        Verifies again the stale proxies and, if there are less than min_proxies left, fetches and verifies new ones.
+        Does nothing while the pool has min_proxies fresh proxies, so it is cheap to call before every scrape.
+        """
+        if not self.needs_refresh(min_proxies):
+            return
+        with metrics.STAGE_SECONDS.time(stage="proxy_verification"):
+            self._refresh(min_proxies)
+
+    def _refresh(self, min_proxies: int) -> None:
+        now = time.time()
+        with self._lock:
+            stale = [
+                proxy
+                for proxy, entry in self._proxies.items()
+                if now - entry["checked_at"] > self.ttl
+            ]
+        if stale:
+            logger.info(f"Verifying {len(stale)} stale proxies.")
+            verified = dict(
+                my_proxies.verify_proxies_concurrent(stale, max_proxies=len(stale))
+            )
+            with self._lock:
+                for proxy in stale:
+                    if proxy in verified:
+                        self._add(proxy, verified[proxy], now)
+                    else:
+                        self._proxies.pop(proxy, None)
+
+        missing = min_proxies - len(self._proxies)
+        if missing > 0:
+            with self._lock:
+                known = set(self._proxies.keys())
+            candidates = [
+                proxy for proxy in my_proxies.get_proxies() if proxy not in known
+            ]
+            for proxy, latency in my_proxies.verify_proxies_concurrent(
+                candidates, max_proxies=missing
+            ):
+                with self._lock:
+                    self._add(proxy, latency, now)
+
+        logger.info(f"Proxy pool has {len(self._proxies)} verified proxies.")
+        self.save()
+
+    def _add(self, proxy: str, latency: float, checked_at: float) -> None:
+        entry = self._proxies.get(proxy)
+        self._proxies[proxy] = {
+            "latency": latency,
+            "checked_at": checked_at,
+            # A successful verification counts as a successful request.
+            "health": (
+                HEALTH_DECAY * entry["health"] + (1 - HEALTH_DECAY) if entry else 1.0
+            ),
+        }
+
+    @staticmethod
+    def _score(entry: ProxyEntry) -> float:
+        return entry["health"] / (1 + entry["latency"])
+
+    def best(self, amount: int = PROXIES_PER_SCRAPE) -> List[str]:
+        """
+        Takes the proxies in turns from the ROTATION_SIZE ones with the highest score, each call gets the next window
+        of them so concurrent scrapes don't all go through the same proxies.
+        :return: Up to amount proxies, highest score first.
+        """
+        with self._lock:
+            ranked = sorted(
+                self._proxies.items(),
+                key=lambda proxy_entry: self._score(proxy_entry[1]),
+                reverse=True,
+            )[:ROTATION_SIZE]
+            if not ranked:
+                return []
+            amount = min(amount, len(ranked))
+            start = self._next % len(ranked)
+            self._next = start + amount
+        window = {(start + i) % len(ranked) for i in range(amount)}
+        return [proxy for i, (proxy, _) in enumerate(ranked) if i in window]
+
+    def report(self, proxies: List[str], success: bool) -> None:
+        """
+        Records the outcome of a request done through the proxies, drops the ones whose health gets too low.
+        """
+        with self._lock:
+            for proxy in proxies:
+                entry = self._proxies.get(proxy)
+                if entry is None:
+                    continue
+                entry["health"] = HEALTH_DECAY * entry["health"] + (
+                    (1 - HEALTH_DECAY) if success else 0
+                )
+                if entry["health"] < MIN_HEALTH:
+                    del self._proxies[proxy]
+                    logger.info(f"Dropped failing proxy {proxy}.")
+
+    def report_success(self, proxies: List[str]) -> None:
+        self.report(proxies, True)
+
+    def report_failure(self, proxies: List[str]) -> None:
+        self.report(proxies, False)
+
+    def report_error(self, proxies: List[str], error: BaseException) -> None:
+        """
+        Reports the failure of a request done through the proxies, only if the error came from reaching them and not
+        from the job board itself, e.g. blocking the search or changing its page.
+        """
+        if is_proxy_error(error):
+            self.report_failure(proxies)
+
+
+def is_proxy_error(error: BaseException | None) -> bool:
+    """
+    :return: Whether the error, or any error it was raised from, is one of PROXY_ERRORS.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if any(cls.__name__ in PROXY_ERRORS for cls in type(error).__mro__):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
@@ -0,0 +1,97 @@
+import threading
+import time
+
+import common
+
+logger = common.get_logger()
+
+# Fraction of the per minute limits that can be spent in a single burst.
+BURST_FRACTION = 0.1
+# On a 429 the allowed rate is multiplied by this factor, it recovers slowly on each success.
+BACKOFF_FACTOR = 0.5
+RECOVERY_STEP = 0.02
+MIN_RATE_FACTOR = 0.1
+DEFAULT_RETRY_AFTER = 5.0
+
+
+class RateLimiter:
+    """
+    Token bucket limiter shared between threads that enforces both requests per minute and tokens per minute.
+    Backs off adaptively when the API still answers with 429, and recovers the full rate as requests succeed.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_capacity = max(1.0, requests_per_minute * BURST_FRACTION)
+        self._token_capacity = max(1.0, tokens_per_minute * BURST_FRACTION)
+        self._requests = self._request_capacity
+        self._tokens = self._token_capacity
+        self._rate_factor = 1.0
+        self._paused_until = 0.0
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._requests = min(
+            self._request_capacity,
+            self._requests
+            + elapsed * self.requests_per_minute / 60 * self._rate_factor,
+        )
+        self._tokens = min(
+            self._token_capacity,
+            self._tokens + elapsed * self.tokens_per_minute / 60 * self._rate_factor,
+        )
+
+    def acquire(self, tokens: int = 0) -> None:
+        """
+        Blocks until a request using the given amount of tokens is allowed.
+        """
+        # A request bigger than the bucket would wait forever, it only has to wait for the bucket to be full.
+        tokens = min(tokens, self._token_capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self._requests >= 1 and self._tokens >= tokens:
+                        self._requests -= 1
+                        self._tokens -= tokens
+                        return
+                    request_rate = self.requests_per_minute / 60 * self._rate_factor
+                    token_rate = self.tokens_per_minute / 60 * self._rate_factor
+                    wait = max(
+                        (1 - self._requests) / request_rate,
+                        (tokens - self._tokens) / token_rate,
+                    )
+            time.sleep(max(wait, 0.001))
+
+    def record_usage(self, estimated_tokens: int, used_tokens: int) -> None:
+        """
+        Corrects the token bucket once the real usage of a request is known.
+        """
+        with self._lock:
+            self._tokens = min(
+                self._token_capacity, self._tokens + estimated_tokens - used_tokens
+            )
+
+    def on_success(self) -> None:
+        with self._lock:
+            self._rate_factor = min(1.0, self._rate_factor + RECOVERY_STEP)
+
+    def on_rate_limited(self, retry_after: float | None = None) -> None:
+        """
+        Pauses every caller for retry_after seconds and lowers the allowed rate.
+        """
+        with self._lock:
+            self._rate_factor = max(MIN_RATE_FACTOR, self._rate_factor * BACKOFF_FACTOR)
+            self._paused_until = max(
+                self._paused_until,
+                time.monotonic() + (retry_after or DEFAULT_RETRY_AFTER),
+            )
+            logger.warning(
+                f"Rate limited, pausing requests and lowering rate to {self._rate_factor:.0%}."
+            )
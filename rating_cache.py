@@ -0,0 +1,105 @@
+import hashlib
+import json
+import re
+import threading
+
+
+import common
+from disk_cache import DiskCache
+
+logger = common.get_logger()
+
+RATING_CACHE_MAX_ENTRIES = 100_000
+
+
+def _normalize(text: str | None) -> str:
+    return re.sub(r"\s+", " ", text or "").strip().lower()
+
+
+def rating_cache_key(
+    title: str | None,
+    description: str | None,
+    resume_content: str | None,
+    system_prompt: list,
+    model: str,
+    temperature: float,
+) -> str:
+    """
+    Hash of everything that decides the outcome of a rating, the same posting under a different job_url gets the same
+    key as long as its title and description only differ in casing and whitespace.
+    """
+    payload = json.dumps(
+        [
+            _normalize(title),
+            _normalize(description),
+            resume_content or "",
+            system_prompt,
+            model,
+            temperature,
+        ]
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class RatingCache:
+    """
+    Stores the job and rating data returned by the model by rating_cache_key, so duplicated postings are only rated
+    once. Lives on a local LRU bounded file and, if shared, also on the rating_cache table for other workers.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = RATING_CACHE_MAX_ENTRIES,
+        shared: bool = common.RATING_CACHE_SHARED,
+    ):
+        self._local = DiskCache("rating_cache", max_entries)
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key: str) -> tuple[dict, dict] | None:
+        """
+        :return: Copies of the cached (job_data, rating_data), None on a miss.
+        """
+        value = self._local.get(key)
+        if value is None and self.shared:
+            try:
+                response = (
+                    common.get_supabase_client()
+                    .table("rating_cache")
+                    .select("job_data", "rating_data")
+                    .eq("key", key)
+                    .execute()
+                )
+                if response.data:
+                    value = response.data[0]
+                    self._local.put(key, value)
+            except Exception as e:
+                logger.error(f"Error reading shared rating cache: {str(e)}")
+        self._count(value is not None)
+        if value is None:
+            return None
+        return dict(value["job_data"]), dict(value["rating_data"])
+
+    def put(self, key: str, job_data: dict, rating_data: dict) -> None:
+        value = {"job_data": dict(job_data), "rating_data": dict(rating_data)}
+        self._local.put(key, value)
+        if self.shared:
+            try:
+                common.get_supabase_client().table("rating_cache").upsert(
+                    {"key": key, **value}, ignore_duplicates=True
+                ).execute()
+            except Exception as e:
+                logger.error(f"Error writing shared rating cache: {str(e)}")
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
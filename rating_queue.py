@@ -0,0 +1,188 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Callable
+
+import common
+import db_queries
+import my_db
+import my_types
+
+logger = common.get_logger()
+
+# Pairs leased per claim, small enough for a batch to be rated well within its lease.
+CLAIM_BATCH_SIZE = 500
+# Seconds a claimed batch stays leased, past it the pairs are claimed again by any worker.
+LEASE_SECONDS = 30 * 60
+# Seconds before a pair that failed is claimed again.
+RETRY_SECONDS = 5 * 60
+# Pairs that failed this many times are left in the queue and no longer claimed, until a full rescan queues them again.
+MAX_ATTEMPTS = 5
+
+
+def new_worker_id() -> str:
+    """
+    :return: Lease owner unique to this worker, also telling the machine and process it runs in.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def enqueue_missing_ratings(full_rescan: bool = False) -> int | None:
+    """
+    Adds the missing ratings found since the last_processed watermark of each search to the queue and advances the
+    watermarks, in a single transaction.
+    :param full_rescan: look for missing ratings in the whole history instead, e.g. to recover ratings lost before
+    the watermark, and retry the pairs that reached MAX_ATTEMPTS.
+    :return: Amount of rows touched, None if it failed.
+    """
+    rows = my_db.execute(
+        db_queries.enqueue_missing_ratings,
+        {"full_rescan": full_rescan, "max_attempts": MAX_ATTEMPTS},
+    )
+    if rows is None:
+        logger.error("Error queueing the missing ratings.")
+    return rows
+
+
+def claim(
+    owner: str,
+    batch_size: int = CLAIM_BATCH_SIZE,
+    lease_seconds: int = LEASE_SECONDS,
+) -> my_types.MissingRatingEntryList | None:
+    """
+    Leases a batch of queued pairs to the worker, concurrent workers always get different pairs.
+    :return: The leased missing ratings, None if the claim failed.
+    """
+    rows = my_db.run_query(
+        db_queries.claim_rating_queue,
+        {
+            "owner": owner,
+            "lease_seconds": lease_seconds,
+            "batch_size": batch_size,
+            "max_attempts": MAX_ATTEMPTS,
+        },
+    )
+    if rows is None:
+        return None
+    return [{"job_id": job_id, "resume_id": resume_id} for job_id, resume_id in rows]
+
+
+def lease_jobs(
+    owner: str, job_ids: list[int], lease_seconds: int = LEASE_SECONDS
+) -> my_types.MissingRatingEntryList | None:
+    """
+    Queues the missing ratings of the jobs and leases them to the worker, leaving out the pairs another worker holds.
+    :return: The leased missing ratings, None if it failed.
+    """
+    rows = my_db.run_query(
+        db_queries.lease_missing_ratings_for_jobs,
+        {
+            "job_ids": job_ids,
+            "owner": owner,
+            "lease_seconds": lease_seconds,
+            "max_attempts": MAX_ATTEMPTS,
+        },
+    )
+    if rows is None:
+        logger.error(f"Error leasing the missing ratings of {len(job_ids)} jobs.")
+        return None
+    return [{"job_id": job_id, "resume_id": resume_id} for job_id, resume_id in rows]
+
+
+def ack(owner: str) -> bool:
+    """
+    Removes the leased pairs that got a rating from the queue and releases the others to be retried after
+    RETRY_SECONDS.
+    :return: True if it succeeded.
+    """
+    result = my_db.execute(
+        db_queries.ack_rating_queue, {"owner": owner, "retry_seconds": RETRY_SECONDS}
+    )
+    if result is None:
+        logger.error(f"Error acknowledging the rating queue of worker {owner}.")
+        return False
+    return True
+
+
+def release(owner: str) -> bool:
+    """
+    Removes the leased pairs that got a rating from the queue and hands the others back to it right away, without
+    counting an attempt.
+    :return: True if it succeeded.
+    """
+    result = my_db.execute(db_queries.release_rating_queue, {"owner": owner})
+    if result is None:
+        logger.error(f"Error releasing the rating queue of worker {owner}.")
+        return False
+    return True
+
+
+def count_exhausted() -> int | None:
+    """
+    :return: Amount of queued pairs that reached MAX_ATTEMPTS and are no longer claimed, None if the query failed.
+    """
+    rows = my_db.run_query(
+        db_queries.count_exhausted_rating_queue, {"max_attempts": MAX_ATTEMPTS}
+    )
+    if rows is None:
+        logger.error("Error counting the exhausted pairs of the rating queue.")
+        return None
+    return rows[0][0]
+
+
+def run_worker(
+    process_batch: Callable[[my_types.MissingRatingEntryList], int],
+    owner: str | None = None,
+    batch_size: int = CLAIM_BATCH_SIZE,
+    lease_seconds: int = LEASE_SECONDS,
+    max_batches: int | None = None,
+    max_pairs: int | None = None,
+    deadline: float | None = None,
+    stop: threading.Event | None = None,
+) -> int:
+    """
+    Claims batches of the queue and rates them with process_batch until the queue is empty. Any amount of workers can
+    run this at the same time, on one or many machines, without rating the same pair twice.
+    :param process_batch: rates a list of missing ratings and returns the amount stored.
+    :param max_batches: stop after this many batches, None to drain the queue.
+    :param max_pairs: stop after claiming this many pairs, None to drain the queue.
+    :param deadline: time.monotonic() after which no more batches are claimed, the batch running by then finishes.
+    :param stop: no more batches are claimed once it is set, e.g. on shutdown, the batch running by then finishes.
+    :return: Amount of ratings stored.
+    """
+    owner = owner or new_worker_id()
+    stored = 0
+    batches = 0
+    claimed = 0
+    while max_batches is None or batches < max_batches:
+        if deadline is not None and time.monotonic() >= deadline:
+            logger.info(f"Worker {owner} ran out of time.")
+            break
+        if stop is not None and stop.is_set():
+            logger.info(f"Worker {owner} was asked to stop.")
+            break
+        size = batch_size if max_pairs is None else min(batch_size, max_pairs - claimed)
+        if size <= 0:
+            break
+        missing_ratings = claim(owner, size, lease_seconds)
+        if not missing_ratings:
+            exhausted = count_exhausted()
+            if exhausted:
+                logger.warning(
+                    f"{exhausted} pairs of the rating queue failed {MAX_ATTEMPTS} times and are no longer claimed, "
+                    f"run with --full-rescan to retry them."
+                )
+            break
+        batches += 1
+        claimed += len(missing_ratings)
+        try:
+            stored += process_batch(missing_ratings)
+        except Exception as e:
+            logger.error(f"Error processing a batch of the rating queue: {str(e)}")
+        # Released even if the batch failed, so its pairs don't wait for the lease to expire.
+        if not ack(owner):
+            break
+    logger.info(f"Worker {owner} processed {batches} batches, {stored} ratings stored.")
+    return stored
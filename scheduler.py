@@ -0,0 +1,170 @@
+import datetime
+import heapq
+import random
+import signal
+import threading
+import time
+from typing import Callable
+
+import common
+import my_types
+import searches
+
+logger = common.get_logger()
+
+# Seconds between two reloads of the searches from the database, new or changed searches are picked up by them.
+SCHEDULE_REFRESH_INTERVAL = 5 * 60
+# Max seconds added at random to the due time of a search, spreads searches due at the same time apart.
+MAX_JITTER_SECONDS = 2 * 60
+# Max searches scraped per tick, the rest wait for the next one.
+MAX_SEARCHES_PER_TICK = 20
+# Seconds between two runs of the rating processing.
+PROCESS_INTERVAL = 5 * 60
+
+
+class Scheduler:
+    """
+    Long running alternative to running main.main periodically: keeps a heap of the searches ordered by the time they
+    are next due and scrapes them as they become due, instead of all of them in a burst every run.
+    Ratings are processed periodically in a background thread. Stops gracefully on SIGINT or SIGTERM, after the
+    current tick.
+    """
+
+    def __init__(
+        self,
+        scrape_searches: Callable[[my_types.SearchEntryList], None],
+        process: Callable[[threading.Event], None] | None = None,
+        on_refresh: Callable[[], None] | None = None,
+        refresh_interval: float = SCHEDULE_REFRESH_INTERVAL,
+        process_interval: float = PROCESS_INTERVAL,
+        max_jitter: float = MAX_JITTER_SECONDS,
+        max_searches_per_tick: int = MAX_SEARCHES_PER_TICK,
+    ):
+        """
+        :param scrape_searches: scrapes the due searches and marks them as updated.
+        :param process: rates the missing ratings, None to only scrape. Gets the stop event of the scheduler and should
+        stop claiming work once it is set, run waits for it before returning.
+        :param on_refresh: called on every reload of the searches, e.g. to refresh the proxy pool.
+        """
+        self.scrape_searches = scrape_searches
+        self.process = process
+        self.on_refresh = on_refresh
+        self.refresh_interval = refresh_interval
+        self.process_interval = process_interval
+        self.max_jitter = max_jitter
+        self.max_searches_per_tick = max_searches_per_tick
+        # Heap of (due time, search id), only the entry matching _due of its search is valid.
+        self._heap: list[tuple[float, int]] = []
+        self._due: dict[int, float] = {}
+        self._searches: dict[int, my_types.SearchEntry] = {}
+        self._stop = threading.Event()
+
+    def _schedule(self, search: my_types.SearchEntry, due: float) -> None:
+        due += random.uniform(0, self.max_jitter)
+        self._searches[search["id"]] = search
+        self._due[search["id"]] = due
+        heapq.heappush(self._heap, (due, search["id"]))
+
+    def refresh(self, now: float | None = None) -> bool:
+        """
+        Rebuilds the heap with the searches due before the next refresh, which drops the deleted ones and picks up the
+        new and changed ones.
+        :return: True if the searches were loaded.
+        """
+        now = time.time() if now is None else now
+        due_searches = searches.get_due_searches(
+            horizon=datetime.timedelta(seconds=self.refresh_interval)
+        )
+        if due_searches is None:
+            return False
+        self._heap, self._due, self._searches = [], {}, {}
+        for search in due_searches:
+            due = searches.next_due(search)
+            self._schedule(search, max(now, due.timestamp()) if due else now)
+        logger.info(f"Scheduled {len(due_searches)} searches.")
+        if self.on_refresh:
+            self.on_refresh()
+        return True
+
+    def pop_due(self, now: float | None = None) -> my_types.SearchEntryList:
+        """
+        :return: Up to max_searches_per_tick searches due by now, removed from the heap.
+        """
+        now = time.time() if now is None else now
+        due_searches = []
+        while (
+            self._heap
+            and self._heap[0][0] <= now
+            and len(due_searches) < self.max_searches_per_tick
+        ):
+            due, search_id = heapq.heappop(self._heap)
+            if self._due.get(search_id) != due:
+                continue
+            del self._due[search_id]
+            due_searches.append(self._searches.pop(search_id))
+        return due_searches
+
+    def next_wakeup(self) -> float | None:
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def stop(self, *args) -> None:
+        logger.info("Stopping the scheduler after the current tick.")
+        self._stop.set()
+
+    def _process_loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.process(self._stop)
+            except Exception as e:
+                logger.error(f"Error processing ratings: {str(e)}")
+            self._stop.wait(self.process_interval)
+
+    def run(self) -> None:
+        previous_handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                previous_handlers[signum] = signal.signal(signum, self.stop)
+
+        process_thread = None
+        if self.process:
+            process_thread = threading.Thread(
+                target=self._process_loop, name="process", daemon=True
+            )
+            process_thread.start()
+
+        next_refresh = 0.0
+        while not self._stop.is_set():
+            now = time.time()
+            if now >= next_refresh:
+                self.refresh(now)
+                next_refresh = now + self.refresh_interval
+
+            due_searches = self.pop_due(now)
+            if due_searches:
+                try:
+                    self.scrape_searches(due_searches)
+                except Exception as e:
+                    logger.error(f"Error scraping {len(due_searches)} searches: {e}")
+                # Failed searches are still due in the database and come back with the next refresh.
+                for search in due_searches:
+                    interval = (
+                        search.get("refresh_interval")
+                        or searches.DEFAULT_REFRESH_INTERVAL
+                    )
+                    due = time.time() + interval.total_seconds()
+                    if due < next_refresh:
+                        self._schedule(search, due)
+                continue
+
+            wakeup = next_refresh
+            if self.next_wakeup() is not None:
+                wakeup = min(wakeup, self.next_wakeup())
+            self._stop.wait(max(0.0, wakeup - time.time()))
+
+        if process_thread:
+            process_thread.join()
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+        logger.info("Scheduler stopped.")
@@ -0,0 +1,94 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, Future
+from typing import Callable, Optional
+
+import common
+from my_types import ScrapeUnit, ScrapeUnitList, ScrapeUnitErrorList
+
+logger = common.get_logger()
+
+# Max amount of scrape units running at the same time, across all job boards.
+MAX_SCRAPE_WORKERS = 8
+# Max amount of scrape units running at the same time against a single job board.
+BOARD_CONCURRENCY = {
+    "linkedin": 2,
+    "indeed": 4,
+    "glassdoor": 2,
+    "zip_recruiter": 2,
+    "google": 2,
+}
+DEFAULT_BOARD_CONCURRENCY = 2
+
+
+def run_scrape_units(
+    units: ScrapeUnitList,
+    scrape_unit: Callable[[ScrapeUnit], None],
+    max_workers: int = MAX_SCRAPE_WORKERS,
+    board_concurrency: Optional[dict[str, int]] = None,
+    on_unit_done: Optional[Callable[[ScrapeUnit, Optional[str]], None]] = None,
+    deadline: Optional[float] = None,
+) -> ScrapeUnitErrorList:
+    """
+    Runs the scrape units concurrently, never exceeding max_workers units in total nor the concurrency of each board.
+    Units of the same board are started in the order received, units of different boards are interleaved.
+    :param units: scrape units to run.
+    :param scrape_unit: function that scrapes and stores a single unit, raises on error.
+    :param max_workers: global concurrency cap.
+    :param board_concurrency: concurrency cap per job board, defaults to BOARD_CONCURRENCY.
+    :param on_unit_done: called from the calling thread after each unit finishes, with the error message if it failed.
+    :param deadline: time.monotonic() after which no more units are started, the running ones finish. Units never
+    started are neither returned nor passed to on_unit_done.
+    :return: List of the units that failed together with their error.
+    """
+    if board_concurrency is None:
+        board_concurrency = BOARD_CONCURRENCY
+
+    pending: dict[str, deque[ScrapeUnit]] = {}
+    for unit in units:
+        pending.setdefault(unit["job_source"], deque()).append(unit)
+    running = {board: 0 for board in pending}
+    errors: ScrapeUnitErrorList = []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures: dict[Future, ScrapeUnit] = {}
+        while pending or futures:
+            if deadline is not None and pending and time.monotonic() >= deadline:
+                skipped = sum(len(queue) for queue in pending.values())
+                logger.info(f"Out of time, {skipped} scrape units not started.")
+                pending = {}
+                if not futures:
+                    break
+            for board in list(pending.keys()):
+                board_limit = board_concurrency.get(board, DEFAULT_BOARD_CONCURRENCY)
+                queue = pending[board]
+                while (
+                    queue
+                    and running[board] < max(board_limit, 1)
+                    and len(futures) < max_workers
+                ):
+                    unit = queue.popleft()
+                    futures[pool.submit(scrape_unit, unit)] = unit
+                    running[board] += 1
+                if not queue:
+                    del pending[board]
+
+            done, _ = wait(futures.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                unit = futures.pop(future)
+                running[unit["job_source"]] -= 1
+                error = None
+                try:
+                    future.result()
+                except Exception as e:
+                    error = str(e)
+                    logger.error(
+                        f"Error during job scraping of search {unit['search']['id']} "
+                        f"({unit['job_source']}, {unit['search_term']}): {error}"
+                    )
+                    errors.append({"unit": unit, "error": error})
+                if on_unit_done is not None:
+                    on_unit_done(unit, error)
+
+    logger.info(f"Finished {len(units)} scrape units, {len(errors)} failed.")
+    return errors
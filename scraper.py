@@ -1,27 +1,101 @@
-from typing import Optional
-
-from pandas import DataFrame
+from typing import TYPE_CHECKING, Callable, Optional, get_args
 
 import common
-from my_types import SearchJobEntry, SearchEntry, JobEntry, JobEntryList
+import metrics
+import near_duplicates
+from my_types import (
+    SearchJobEntry,
+    SearchEntry,
+    JobEntry,
+    JobEntryList,
+    ScrapeUnit,
+    ScrapeUnitList,
+)
 from helper import (
     parse_delimited_string,
     list_to_delimited_string,
 )
-from jobspy import scrape_jobs
-from datetime import datetime
-from supabase import Client
+from datetime import date, datetime, time, timedelta
 
-# Initialize Logger, Supabase and OpenAI
+# pandas and jobspy take most of the import time and are only needed once jobs are scraped.
+if TYPE_CHECKING:
+    from pandas import DataFrame, Series
+
+# Initialize Logger
 logger = common.get_logger()
-supabase: Client = common.get_supabase_client()
-client = common.get_openai_client()
 
 HOURS_OLD_NEW = 24
 HOURS_OLD_UPDATE = 4
 
 
-def _format_jobs(jobs_df: DataFrame) -> JobEntryList:
+# Types inferred by pandas.api.types.infer_dtype for columns whose values all share a single Python type.
+SINGLE_TYPE_COLUMNS = {
+    "string": str,
+    "boolean": bool,
+    "datetime": datetime,
+    "datetime64": datetime,
+    "integer": int,
+    "floating": float,
+    "decimal": float,
+    "complex": complex,
+    "bytes": bytes,
+    "date": date,
+    "time": time,
+    "timedelta": timedelta,
+    "timedelta64": timedelta,
+}
+
+
+def scrape_jobs(**kwargs) -> "DataFrame":
+    """
+    jobspy.scrape_jobs, imported on the first scrape.
+    """
+    from jobspy import scrape_jobs as jobspy_scrape_jobs
+
+    return jobspy_scrape_jobs(**kwargs)
+
+
+def _format_value(value, expected_type: type):
+    if value is None or isinstance(value, expected_type):
+        if isinstance(value, datetime):
+            try:
+                return value.strftime("%Y-%m-%d")
+            except ValueError:
+                return None
+        return value
+    return None
+
+
+def _format_column(column: "Series", expected_type: type) -> list:
+    """
+    Coerces a column of the JobSpy dataframe to the expected type: values of other types and missing values become
+    None and datetimes are formatted as %Y-%m-%d. Columns of a single type are converted at once, mixed ones value by
+    value.
+    """
+    from pandas import to_datetime
+    from pandas.api.types import infer_dtype
+
+    inferred_dtype = infer_dtype(column, skipna=True)
+    inferred_type = SINGLE_TYPE_COLUMNS.get(inferred_dtype)
+    if inferred_dtype == "empty" or (
+        inferred_type is not None and not issubclass(inferred_type, expected_type)
+    ):
+        return [None] * len(column)
+    if inferred_type is datetime:
+        try:
+            column = to_datetime(column).dt.strftime("%Y-%m-%d")
+        except (ValueError, TypeError):
+            # e.g. mixed timezones, formatted one by one.
+            inferred_type = None
+    if inferred_type is None:
+        return [
+            _format_value(value, expected_type)
+            for value in column.to_numpy(dtype=object)
+        ]
+    return column.to_numpy(dtype=object, na_value=None).tolist()
+
+
+def _format_jobs(jobs_df: "DataFrame") -> JobEntryList:
     """
     Formats the jobs received from JobSpy to remove unnecessary fields and change the format of others to be ready to
     upload it.
@@ -53,25 +127,19 @@ def _format_jobs(jobs_df: DataFrame) -> JobEntryList:
         "matched_words": Optional[str],
         "job_level": Optional[str],
     }
+    if jobs_df.empty:
+        return []
 
-    filtered_jobs: JobEntryList = []
-    jobs_raw = jobs_df.to_dict("records")
-    for job_raw in jobs_raw:
-        job_raw["site_id"] = job_raw["id"]
-        filtered_job: JobEntry = {}
-        for key, expected_type in expected_keys.items():
-            value = job_raw.pop(key, None)
-            if value is None or isinstance(value, expected_type):
-                filtered_job[key] = value
-            elif expected_type == Optional[datetime] and isinstance(value, datetime):
-                try:
-                    filtered_job[key] = value.strftime("%Y-%m-%d")
-                except ValueError:
-                    filtered_job[key] = None
-            else:
-                filtered_job[key] = None
-        filtered_jobs.append(filtered_job)
-    return filtered_jobs
+    # Column by column instead of row by row, the rows are only built at the end.
+    columns = []
+    for key, expected_type in expected_keys.items():
+        column = jobs_df["id"] if key == "site_id" else jobs_df.get(key)
+        if column is None:
+            columns.append([None] * len(jobs_df))
+        else:
+            columns.append(_format_column(column, get_args(expected_type)[0]))
+    keys = list(expected_keys.keys())
+    return [dict(zip(keys, row)) for row in zip(*columns)]
 
 
 def _try_insert_job(job: JobEntry) -> JobEntry | None:
@@ -81,7 +149,11 @@ def _try_insert_job(job: JobEntry) -> JobEntry | None:
     :return: True if successfully inserted or retrieved existing job id, False if failed.
     """
     existing_job_response = (
-        supabase.table("job").select("*").eq("job_url", job["job_url"]).execute()
+        common.get_supabase_client()
+        .table("job")
+        .select("*")
+        .eq("job_url", job["job_url"])
+        .execute()
     )
     if existing_job_response.data and len(existing_job_response.data) > 0:
         existing_job = existing_job_response.data[0]
@@ -96,7 +168,8 @@ def _try_insert_job(job: JobEntry) -> JobEntry | None:
                 combined_matched_words
             )
             response = (
-                supabase.table("job")
+                common.get_supabase_client()
+                .table("job")
                 .update(existing_job)
                 .eq("id", existing_job["id"])
                 .execute()
@@ -105,7 +178,12 @@ def _try_insert_job(job: JobEntry) -> JobEntry | None:
                 f"Job with URL {job['job_url']} updated matched words {existing_matched_words} -> {combined_matched_words}."
             )
     else:
-        response = supabase.table("job").insert(job, upsert=False).execute()
+        response = (
+            common.get_supabase_client()
+            .table("job")
+            .insert(job, upsert=False)
+            .execute()
+        )
         if not response.data or len(response.data) <= 0:
             logger.error(f"Error storing job: {response.error.message}")
             return None
@@ -115,6 +193,140 @@ def _try_insert_job(job: JobEntry) -> JobEntry | None:
     return job
 
 
+def _merge_matched_words(
+    existing_words: str | None, new_words: str | None
+) -> str | None:
+    """
+    Combines two delimited lists of matched words.
+    :return: The combined delimited string, None if it adds nothing to existing_words.
+    """
+    existing_matched_words = parse_delimited_string(existing_words or "")
+    new_matched_words = parse_delimited_string(new_words or "")
+    combined_matched_words = list(
+        dict.fromkeys(existing_matched_words + new_matched_words)
+    )
+    if len(combined_matched_words) == len(existing_matched_words):
+        return None
+    return list_to_delimited_string([word for word in combined_matched_words if word])
+
+
+def _select_jobs_by_url(job_urls: list[str]) -> dict[str, dict]:
+    """
+    :return: The stored jobs among the job_urls, by job_url.
+    """
+    return {
+        existing_job["job_url"]: existing_job
+        for existing_job in common.select_in(
+            "job", ("id", "job_url", "matched_words"), "job_url", job_urls
+        )
+    }
+
+
+def _merge_existing_jobs(
+    jobs_by_url: dict[str, JobEntry], existing_jobs: dict[str, dict]
+) -> None:
+    """
+    Sets the id of the jobs already stored and merges their matched words into the stored ones, leaving every other
+    column of the stored job untouched.
+    """
+    updated_jobs: list[dict] = []
+    for job_url, existing_job in existing_jobs.items():
+        job = jobs_by_url[job_url]
+        job["id"] = existing_job["id"]
+        merged_words = _merge_matched_words(
+            existing_job["matched_words"], job["matched_words"]
+        )
+        if merged_words is not None:
+            updated_jobs.append(
+                {
+                    "id": existing_job["id"],
+                    "job_url": job_url,
+                    "matched_words": merged_words,
+                }
+            )
+
+    if updated_jobs:
+        common.get_supabase_client().table("job").upsert(
+            updated_jobs, on_conflict="job_url", default_to_null=False
+        ).execute()
+        logger.info(f"Updated matched words of {len(updated_jobs)} existing jobs.")
+
+
+def _try_insert_jobs(jobs: JobEntryList) -> JobEntryList | None:
+    """
+    Batch version of _try_insert_job, looks up every job_url of the batch in one query, stores the new jobs with a single
+    multi-row insert ignoring the job_urls already stored and merges the matched words of the existing ones in another.
+    :param jobs: list of formatted jobs, usually the output of a single scrape_jobs call.
+    :return: The stored jobs with their database id set, None if the batch could not be stored.
+    """
+    # Repeated job_urls in the same batch would conflict with each other in the upsert.
+    jobs_by_url: dict[str, JobEntry] = {}
+    for job in jobs:
+        if not job.get("job_url"):
+            logger.error(f"Job without URL can't be stored: {job.get('title')}")
+            continue
+        if job["job_url"] in jobs_by_url:
+            merged_words = _merge_matched_words(
+                jobs_by_url[job["job_url"]]["matched_words"], job["matched_words"]
+            )
+            if merged_words is not None:
+                jobs_by_url[job["job_url"]]["matched_words"] = merged_words
+            continue
+        jobs_by_url[job["job_url"]] = job
+    if not jobs_by_url:
+        return []
+
+    existing_jobs = _select_jobs_by_url(list(jobs_by_url.keys()))
+    _merge_existing_jobs(jobs_by_url, existing_jobs)
+    new_jobs = [
+        job for job_url, job in jobs_by_url.items() if job_url not in existing_jobs
+    ]
+
+    if new_jobs:
+        # Jobs stored concurrently by another scrape are left as they are and handled like the existing ones below.
+        # Columns missing from the batch, like created_at, must take their default value instead of null.
+        response = (
+            common.get_supabase_client()
+            .table("job")
+            .upsert(
+                new_jobs,
+                on_conflict="job_url",
+                ignore_duplicates=True,
+                default_to_null=False,
+            )
+            .execute()
+        )
+        for stored_job in response.data or []:
+            jobs_by_url[stored_job["job_url"]]["id"] = stored_job["id"]
+        logger.info(f"Stored {len(response.data or [])} new jobs.")
+
+        conflicting_jobs = _select_jobs_by_url(
+            [job["job_url"] for job in new_jobs if job.get("id") is None]
+        )
+        _merge_existing_jobs(jobs_by_url, conflicting_jobs)
+        if all(job.get("id") is None for job in new_jobs):
+            logger.error(f"Error storing {len(new_jobs)} jobs.")
+            return None
+
+        try:
+            near_duplicates.assign_clusters(
+                [
+                    job
+                    for job in new_jobs
+                    if job.get("id") is not None
+                    and job["job_url"] not in conflicting_jobs
+                ]
+            )
+        except Exception as e:
+            # Jobs without a cluster are rated on their own, it only costs an extra rating.
+            logger.error(f"Error assigning jobs to near duplicate clusters: {str(e)}")
+
+    logger.info(
+        f"Batch of {len(jobs_by_url)} jobs: {len(new_jobs)} new, {len(existing_jobs)} already existing."
+    )
+    return [job for job in jobs_by_url.values() if job.get("id") is not None]
+
+
 def _try_insert_search_job(search_job: SearchJobEntry) -> bool:
     """
     Inserts the search job in the database if it doesn't exist.
@@ -122,7 +334,8 @@ def _try_insert_search_job(search_job: SearchJobEntry) -> bool:
     :return: True if successfully inserted or retrieved existing job id, False if failed.
     """
     existing_job = (
-        supabase.table("search_job")
+        common.get_supabase_client()
+        .table("search_job")
         .select("search_id", "job_id")
         .eq("search_id", search_job["search_id"])
         .eq("job_id", search_job["job_id"])
@@ -133,7 +346,12 @@ def _try_insert_search_job(search_job: SearchJobEntry) -> bool:
             f"SearchJob with IDs {search_job['search_id']},{search_job['job_id']} already exists. Skipping insert."
         )
         return True
-    response = supabase.table("search_job").insert(search_job, upsert=False).execute()
+    response = (
+        common.get_supabase_client()
+        .table("search_job")
+        .insert(search_job, upsert=False)
+        .execute()
+    )
     if not response.data or len(response.data) <= 0:
         logger.error(f"Error storing job: {response.error.message}")
         return False
@@ -144,42 +362,202 @@ def _try_insert_search_job(search_job: SearchJobEntry) -> bool:
     return True
 
 
-def scrape_and_store_jobs(
-    search: SearchEntry, is_new_search=False, proxies=None
-) -> None:
+def _try_insert_search_jobs(
+    search_jobs: list[SearchJobEntry],
+) -> tuple[int, int] | None:
+    """
+    Batch version of _try_insert_search_job, links every (search_id, job_id) pair in a single insert that skips the
+    pairs that already exist.
+    :param search_jobs: list of search jobs to link.
+    :return: Tuple with the amount of (new, already existing) links, None if the batch could not be stored.
+    """
+    # Repeated pairs in the same statement would make Postgres reject the whole batch.
+    unique_search_jobs = list(
+        {(sj["search_id"], sj["job_id"]): sj for sj in search_jobs}.values()
+    )
+    if not unique_search_jobs:
+        return 0, 0
+
+    response = (
+        common.get_supabase_client()
+        .table("search_job")
+        .upsert(
+            unique_search_jobs,
+            on_conflict="search_id,job_id",
+            ignore_duplicates=True,
+            default_to_null=False,
+        )
+        .execute()
+    )
+    # Only the rows that were actually inserted are returned, duplicates are skipped silently.
+    new_links = len(response.data or [])
+    existing_links = len(unique_search_jobs) - new_links
+    logger.info(
+        f"Stored {new_links} new search jobs, {existing_links} already existed."
+    )
+    return new_links, existing_links
+
+
+def build_scrape_units(
+    search: SearchEntry, is_new_search=False, proxies=None, proxy_pool=None
+) -> ScrapeUnitList:
+    """
+    Splits a search into its scrape units, one per (job_source, search_term) pair.
+    When a proxy_pool is given, each unit takes its proxies from it instead of the static proxies list.
+    """
     # Job sources and search terms are stored as a comma separated list.
     job_sources = parse_delimited_string(search["job_source"])
     search_terms = parse_delimited_string(search["search_term"])
-    for job_source in job_sources:
-        for search_term in search_terms:
-            try:
-                jobs_df = scrape_jobs(
-                    site_name=job_source,
-                    search_term=search_term,
-                    location=search["location"],
-                    results_wanted=search["results_wanted"],
-                    hours_old=HOURS_OLD_NEW if is_new_search else HOURS_OLD_UPDATE,
-                    country_indeed=search["country"],  # Specific to Indeed
-                    proxies=proxies,
-                    linkedin_fetch_description=job_source
-                    == "linkedin",  # Specific to LinkedIn, unneeded for others.
-                )
-
-                for job in _format_jobs(jobs_df):
-                    try:
-                        job["matched_words"] = search["search_term"]
-                        inserted_job = _try_insert_job(job)
-                        if inserted_job is None:
-                            logger.error(f"Error during job storing: {str(e)}")
-                            continue
-
-                        search_job = {
-                            "search_id": search["id"],
-                            "job_id": inserted_job["id"],
-                        }
-                        _try_insert_search_job(search_job)
-                    except Exception as e:
-                        logger.error(f"Error during job storing: {str(e)}")
+    return [
+        {
+            "search": search,
+            "searches": [search],
+            "job_source": job_source,
+            "search_term": search_term,
+            "results_wanted": search["results_wanted"],
+            "is_new_search": is_new_search,
+            "proxies": proxies,
+            "proxy_pool": proxy_pool,
+        }
+        for job_source in job_sources
+        for search_term in search_terms
+    ]
+
 
+def _scrape_key(unit: ScrapeUnit) -> tuple:
+    search = unit["search"]
+    return (
+        unit["job_source"].strip().lower(),
+        unit["search_term"].strip().lower(),
+        (search["location"] or "").strip().lower(),
+        (search["country"] or "").strip().lower(),
+        unit["is_new_search"],
+    )
+
+
+def coalesce_scrape_units(units: ScrapeUnitList) -> ScrapeUnitList:
+    """
+    Merges the units of different searches that would run the same scrape, same job_source, search_term, location and
+    country, into a single unit that asks for the largest results_wanted among them and links its jobs to all of them.
+    :return: One unit per unique scrape, in the order they first appear.
+    """
+    coalesced: dict[tuple, ScrapeUnit] = {}
+    for unit in units:
+        key = _scrape_key(unit)
+        if key not in coalesced:
+            coalesced[key] = {**unit, "searches": list(unit["searches"])}
+            continue
+        merged = coalesced[key]
+        known_ids = {search["id"] for search in merged["searches"]}
+        merged["searches"] += [
+            search for search in unit["searches"] if search["id"] not in known_ids
+        ]
+        if (unit["results_wanted"] or 0) > (merged["results_wanted"] or 0):
+            merged["results_wanted"] = unit["results_wanted"]
+    if units:
+        logger.info(
+            f"Coalesced {len(units)} scrape units into {len(coalesced)}, "
+            f"{1 - len(coalesced) / len(units):.0%} deduplicated."
+        )
+    return list(coalesced.values())
+
+
+def scrape_and_store_unit(
+    unit: ScrapeUnit, on_jobs_stored: Callable[[list[int]], None] | None = None
+) -> None:
+    """
+    Scrapes a single (job_source, search_term) pair and stores the jobs found, linked to every search of the unit.
+    Errors while scraping are raised, errors while storing single jobs are logged and skipped.
+    :param on_jobs_stored: called with the ids of the stored jobs once they are linked to the searches, e.g. to rate
+    them right away.
+    """
+    search = unit["search"]
+    unit_searches = unit.get("searches") or [search]
+    job_source = unit["job_source"]
+    proxy_pool = unit.get("proxy_pool")
+    proxies = proxy_pool.best() if proxy_pool else unit["proxies"]
+    try:
+        with metrics.SCRAPE_SECONDS.time(site=job_source):
+            jobs_df = scrape_jobs(
+                site_name=job_source,
+                search_term=unit["search_term"],
+                location=search["location"],
+                results_wanted=unit.get("results_wanted", search["results_wanted"]),
+                hours_old=HOURS_OLD_NEW if unit["is_new_search"] else HOURS_OLD_UPDATE,
+                country_indeed=search["country"],  # Specific to Indeed
+                proxies=proxies or None,
+                linkedin_fetch_description=job_source
+                == "linkedin",  # Specific to LinkedIn, unneeded for others.
+            )
+    except Exception as e:
+        metrics.SCRAPE_CALLS.inc(site=job_source, result="error")
+        if proxy_pool and proxies:
+            proxy_pool.report_error(proxies, e)
+        raise
+    metrics.SCRAPE_CALLS.inc(site=job_source, result="ok")
+    metrics.SCRAPED_JOBS.inc(len(jobs_df), site=job_source)
+    if proxy_pool and proxies:
+        proxy_pool.report_success(proxies)
+
+    jobs = _format_jobs(jobs_df)
+    matched_words = unit_searches[0]["search_term"]
+    for unit_search in unit_searches[1:]:
+        matched_words = (
+            _merge_matched_words(matched_words, unit_search["search_term"])
+            or matched_words
+        )
+    for job in jobs:
+        job["matched_words"] = matched_words
+
+    try:
+        inserted_jobs = _try_insert_jobs(jobs)
+    except Exception as e:
+        logger.error(f"Error during batch job storing: {str(e)}")
+        inserted_jobs = None
+    if inserted_jobs is None:
+        # Fall back to storing the jobs one by one.
+        inserted_jobs = jobs
+
+    search_jobs: list[SearchJobEntry] = []
+    for job in inserted_jobs:
+        try:
+            inserted_job = job if job.get("id") is not None else _try_insert_job(job)
+            if inserted_job is None:
+                logger.error(f"Error during job storing: {job['job_url']}")
+                continue
+
+            search_jobs += [
+                {
+                    "search_id": unit_search["id"],
+                    "job_id": inserted_job["id"],
+                }
+                for unit_search in unit_searches
+            ]
+        except Exception as e:
+            logger.error(f"Error during job storing: {str(e)}")
+
+    try:
+        linked = _try_insert_search_jobs(search_jobs)
+    except Exception as e:
+        logger.error(f"Error during batch search job storing: {str(e)}")
+        linked = None
+    if linked is None:
+        # Fall back to linking the jobs one by one.
+        for search_job in search_jobs:
+            try:
+                _try_insert_search_job(search_job)
             except Exception as e:
-                logger.error(f"Error during job scraping: {str(e)}")
+                logger.error(f"Error during search job storing: {str(e)}")
+
+    if on_jobs_stored is not None and search_jobs:
+        on_jobs_stored(list(dict.fromkeys(sj["job_id"] for sj in search_jobs)))
+
+
+def scrape_and_store_jobs(
+    search: SearchEntry, is_new_search=False, proxies=None
+) -> None:
+    for unit in build_scrape_units(search, is_new_search, proxies):
+        try:
+            scrape_and_store_unit(unit)
+        except Exception as e:
+            logger.error(f"Error during job scraping: {str(e)}")
@@ -0,0 +1,77 @@
+import datetime
+
+import common
+import db_queries
+import my_db
+import my_types
+
+logger = common.get_logger()
+
+# Time between two scrapes of a search that has no refresh_interval of its own.
+DEFAULT_REFRESH_INTERVAL = datetime.timedelta(hours=3)
+# Columns returned by db_queries.due_searches, in order.
+DUE_SEARCH_COLUMNS = (
+    "id",
+    "job_source",
+    "search_term",
+    "location",
+    "results_wanted",
+    "country",
+    "last_search",
+    "refresh_interval",
+)
+
+
+def get_due_searches(
+    default_refresh_interval: datetime.timedelta = DEFAULT_REFRESH_INTERVAL,
+    limit: int | None = None,
+    horizon: datetime.timedelta = datetime.timedelta(0),
+) -> my_types.SearchEntryList | None:
+    """
+    Retrieves the searches whose last_search is older than their refresh interval, or that were never scraped, with a
+    single query and only the columns needed to scrape them.
+    :param limit: max amount of searches, None for all of them.
+    :param horizon: also include the searches becoming due within it.
+    :return: The due searches, the ones never scraped first and then the most overdue. None if the query failed.
+    """
+    rows = my_db.run_query(
+        db_queries.due_searches,
+        {
+            "default_refresh_interval": default_refresh_interval.total_seconds(),
+            "horizon": horizon.total_seconds(),
+            "limit": limit,
+        },
+    )
+    if rows is None:
+        logger.error("An error occurred while retrieving due searches.")
+        return None
+    return [dict(zip(DUE_SEARCH_COLUMNS, row)) for row in rows]
+
+
+def mark_searches_updated(search_ids) -> bool:
+    """
+    Sets last_search of every given search to now with a single statement.
+    :return: True if it succeeded.
+    """
+    search_ids = list(search_ids)
+    if not search_ids:
+        return True
+    updated = my_db.execute(
+        db_queries.mark_searches_updated, {"search_ids": search_ids}
+    )
+    if updated is None:
+        logger.error(f"Error storing last_search of {len(search_ids)} searches.")
+        return False
+    logger.info(f"Stored last_search of {updated} searches.")
+    return True
+
+
+def next_due(search: my_types.SearchEntry) -> datetime.datetime | None:
+    """
+    :return: When the search is due to be scraped again, None if it was never scraped.
+    """
+    if search["last_search"] is None:
+        return None
+    return search["last_search"] + (
+        search.get("refresh_interval") or DEFAULT_REFRESH_INTERVAL
+    )
@@ -0,0 +1,89 @@
+import re
+
+import numpy as np
+from scipy import sparse
+
+# Keeps tokens like c++, c# or node.js together.
+TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9+#.]*[a-z0-9+#]|[a-z0-9]")
+
+
+def _tokenize(text: str | None) -> list[str]:
+    return TOKEN_PATTERN.findall((text or "").lower())
+
+
+def tfidf_matrix(documents: list[str]) -> sparse.csr_matrix:
+    """
+    TF-IDF matrix of the documents with sublinear term frequency, every row is L2 normalized so the dot product of two
+    rows is their cosine similarity.
+    """
+    vocabulary: dict[str, int] = {}
+    indptr = [0]
+    indices = []
+    for document in documents:
+        for token in _tokenize(document):
+            indices.append(vocabulary.setdefault(token, len(vocabulary)))
+        indptr.append(len(indices))
+    counts = sparse.csr_matrix(
+        (np.ones(len(indices), dtype=np.float32), np.array(indices), np.array(indptr)),
+        shape=(len(documents), len(vocabulary)),
+    )
+    # Repeated indices are summed into the term counts.
+    counts.sum_duplicates()
+
+    document_frequency = np.bincount(counts.indices, minlength=len(vocabulary))
+    idf = np.log((1 + len(documents)) / (1 + document_frequency)) + 1
+    counts.data = (1 + np.log(counts.data)) * idf[counts.indices]
+
+    norms = np.sqrt(np.asarray(counts.multiply(counts).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.csr_matrix(sparse.diags(1 / norms) @ counts)
+
+
+def pair_similarities(
+    job_texts: dict[int, str],
+    resume_texts: dict[int, str],
+    pairs: list[tuple[int, int]],
+) -> np.ndarray:
+    """
+    Cosine similarity of the TF-IDF vectors of every (job_id, resume_id) pair, computed in one batched operation.
+    """
+    if not pairs:
+        return np.zeros(0, dtype=np.float32)
+    job_ids = list(job_texts.keys())
+    resume_ids = list(resume_texts.keys())
+    matrix = tfidf_matrix(
+        [job_texts[job_id] for job_id in job_ids]
+        + [resume_texts[resume_id] for resume_id in resume_ids]
+    )
+    job_rows = {job_id: i for i, job_id in enumerate(job_ids)}
+    resume_rows = {
+        resume_id: len(job_ids) + i for i, resume_id in enumerate(resume_ids)
+    }
+    jobs = matrix[[job_rows[job_id] for job_id, _ in pairs]]
+    resumes = matrix[[resume_rows[resume_id] for _, resume_id in pairs]]
+    return np.asarray(jobs.multiply(resumes).sum(axis=1)).ravel()
+
+
+def select_pairs(
+    similarities: np.ndarray,
+    resume_ids: np.ndarray,
+    top_k: int,
+    min_similarity: float,
+) -> np.ndarray:
+    """
+    Selects the pairs worth sending to the model: the ones above min_similarity plus, for every resume, its top_k most
+    similar jobs even if they are below it.
+    :return: Boolean mask over the pairs.
+    """
+    if len(similarities) == 0:
+        return np.zeros(0, dtype=bool)
+    # Sort by resume and then by descending similarity to get the rank of each pair inside its resume.
+    order = np.lexsort((-similarities, resume_ids))
+    sorted_resumes = resume_ids[order]
+    group_starts = np.r_[
+        0, np.flatnonzero(sorted_resumes[1:] != sorted_resumes[:-1]) + 1
+    ]
+    group_sizes = np.diff(np.r_[group_starts, len(order)])
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order)) - np.repeat(group_starts, group_sizes)
+    return (similarities >= min_similarity) | (ranks < top_k)
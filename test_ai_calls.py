@@ -0,0 +1,180 @@
+import json
+import types
+import unittest
+from unittest.mock import MagicMock, patch
+
+import httpx
+from openai import APIConnectionError, BadRequestError, InternalServerError
+
+import ai_calls
+from rate_limiter import RateLimiter
+
+JOBS = [("Engineer 1", "Python"), ("Engineer 2", "SQL"), ("Engineer 3", "Go")]
+
+
+def _answer(content) -> types.SimpleNamespace:
+    return types.SimpleNamespace(
+        choices=[
+            types.SimpleNamespace(
+                message=types.SimpleNamespace(content=json.dumps(content))
+            )
+        ]
+    )
+
+
+class TestGenerateGroupRating(unittest.TestCase):
+    def _rate(self, content) -> list | None:
+        with patch.object(
+            ai_calls, "_create_completion", return_value=_answer(content)
+        ) as create:
+            results = ai_calls.generate_group_rating("Resume", JOBS)
+        self.assertEqual(
+            create.call_args.kwargs["messages"][0],
+            ai_calls.RATING_GROUP_SYSTEM_PROMPT[0],
+        )
+        return results
+
+    def test_answers_are_put_back_in_job_order(self):
+        results = self._rate(
+            {
+                "ratings": [
+                    {"job": 3, "rating": 3, "is_remote": True},
+                    {"job": 1, "rating": 1},
+                    {"job": 2, "rating": 2},
+                ]
+            }
+        )
+        self.assertEqual([rating["rating"] for _, rating in results], [1, 2, 3])
+        self.assertEqual(results[2][0]["is_remote"], True)
+        self.assertEqual(
+            results[0][1]["token_limit"], ai_calls.RATING_TOKEN_LIMIT * len(JOBS)
+        )
+
+    def test_answers_without_job_numbers_are_kept_in_order(self):
+        results = self._rate([{"rating": 7}, {"rating": 8}, {"rating": 9}])
+        self.assertEqual([rating["rating"] for _, rating in results], [7, 8, 9])
+
+    def test_malformed_answers_fall_back(self):
+        for content in (
+            {"ratings": {"job": 1, "rating": 1}},
+            {"ratings": [{"job": 1, "rating": 1}, {"job": 2, "rating": 2}]},
+            {"ratings": [{"job": 1, "rating": 1}, {"job": 2, "rating": 2}] * 2},
+            {"unexpected": []},
+        ):
+            with self.subTest(content=content):
+                self.assertIsNone(self._rate(content))
+
+    def test_unexpected_job_numbers_fall_back(self):
+        for numbers in ((1, 2, 2), (0, 1, 2), (1, 2, 4)):
+            with self.subTest(numbers=numbers):
+                self.assertIsNone(
+                    self._rate({"ratings": [{"job": n, "rating": n} for n in numbers]})
+                )
+
+    def test_entries_without_rating_fall_back(self):
+        self.assertIsNone(
+            self._rate(
+                {
+                    "ratings": [
+                        {"job": 1, "rating": 1},
+                        {"job": 2, "justification": "no rating"},
+                        {"job": 3, "rating": 3},
+                    ]
+                }
+            )
+        )
+
+    def test_api_error_falls_back(self):
+        with patch.object(ai_calls, "_create_completion", side_effect=ValueError()):
+            self.assertIsNone(ai_calls.generate_group_rating("Resume", JOBS))
+        with patch.object(
+            ai_calls,
+            "_create_completion",
+            return_value=types.SimpleNamespace(
+                choices=[
+                    types.SimpleNamespace(
+                        message=types.SimpleNamespace(content="not json")
+                    )
+                ]
+            ),
+        ):
+            self.assertIsNone(ai_calls.generate_group_rating("Resume", JOBS))
+
+
+def _status_error(error_class, status_code: int):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    return error_class(
+        "error",
+        response=httpx.Response(status_code, request=request),
+        body=None,
+    )
+
+
+class TestCreateCompletion(unittest.TestCase):
+    def setUp(self):
+        self.create = MagicMock()
+        client = MagicMock()
+        client.with_options.return_value.chat.completions.create = self.create
+        for target in (
+            patch.object(ai_calls.common, "get_openai_client", return_value=client),
+            patch.object(ai_calls, "rate_limiter", RateLimiter(10**6, 10**9)),
+            patch.object(ai_calls, "SERVER_ERROR_BACKOFF_SECONDS", 0),
+        ):
+            target.start()
+            self.addCleanup(target.stop)
+        self.request = httpx.Request(
+            "POST", "https://api.openai.com/v1/chat/completions"
+        )
+
+    def test_server_and_connection_errors_are_retried(self):
+        answer = _answer({"rating": 1})
+        answer.usage = None
+        self.create.side_effect = [
+            _status_error(InternalServerError, 500),
+            APIConnectionError(request=self.request),
+            answer,
+        ]
+        self.assertIs(ai_calls._create_completion(10), answer)
+        self.assertEqual(self.create.call_count, 3)
+
+    def test_server_errors_give_up_after_max_retries(self):
+        self.create.side_effect = APIConnectionError(request=self.request)
+        with self.assertRaises(APIConnectionError):
+            ai_calls._create_completion(10)
+        self.assertEqual(self.create.call_count, ai_calls.MAX_SERVER_ERROR_RETRIES + 1)
+
+    def test_client_errors_are_not_retried(self):
+        self.create.side_effect = _status_error(BadRequestError, 400)
+        with self.assertRaises(BadRequestError):
+            ai_calls._create_completion(10)
+        self.assertEqual(self.create.call_count, 1)
+
+
+class TestPlanRatingGroups(unittest.TestCase):
+    def test_groups_respect_max_size(self):
+        max_size = min(
+            ai_calls.GROUP_MAX_SIZE,
+            ai_calls.GROUP_OUTPUT_TOKEN_BUDGET // ai_calls.RATING_TOKEN_LIMIT,
+        )
+        groups = ai_calls.plan_rating_groups([10] * (2 * max_size + 1), 100)
+        self.assertEqual([len(group) for group in groups], [max_size, max_size, 1])
+        self.assertEqual(sum(groups, []), list(range(2 * max_size + 1)))
+
+    def test_groups_respect_input_budget(self):
+        base = (
+            ai_calls.estimate_tokens(ai_calls.RATING_GROUP_SYSTEM_PROMPT[0]["content"])
+            + 1000
+        )
+        job_tokens = (ai_calls.GROUP_INPUT_TOKEN_BUDGET - base) // 2
+        groups = ai_calls.plan_rating_groups([job_tokens] * 5, 1000)
+        self.assertEqual(groups, [[0, 1], [2, 3], [4]])
+
+    def test_job_over_budget_gets_its_own_group(self):
+        groups = ai_calls.plan_rating_groups(
+            [10, ai_calls.GROUP_INPUT_TOKEN_BUDGET * 2, 10], 100
+        )
+        self.assertEqual(groups, [[0], [1], [2]])
+
+
+if __name__ == "__main__":
+    unittest.main()
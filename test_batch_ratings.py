@@ -0,0 +1,138 @@
+import json
+import os
+import tempfile
+import types
+import unittest
+from unittest.mock import patch
+
+import batch_ratings
+import processor
+from disk_cache import DiskCache
+from rating_cache import RatingCache
+from test_processor import FakeSupabase, _job
+
+
+class FakeCompletion(types.SimpleNamespace):
+    def to_dict(self) -> dict:
+        return {"choices": [{"message": {"content": self.content}}]}
+
+
+class FakeChatClient:
+    """
+    Answers every rating with the number of its job, the jobs in failing raise instead.
+    """
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.requests: list[int] = []
+        self.chat = types.SimpleNamespace(
+            completions=types.SimpleNamespace(create=self.create)
+        )
+
+    def create(self, **body):
+        job_id = int(body["messages"][-1]["content"].split("Engineer ")[1].split()[0])
+        self.requests.append(job_id)
+        if job_id in self.failing:
+            raise ValueError("boom")
+        return FakeCompletion(
+            content=json.dumps({"rating": job_id, "justification": "ok"})
+        )
+
+
+class ServerErrorBatchClient(batch_ratings.LocalBatchClient):
+    """
+    LocalBatchClient whose output answers the requests of the jobs in server_errors with a 500.
+    """
+
+    def __init__(self, client, server_errors=()):
+        super().__init__(client)
+        self.server_errors = {f"{job_id}:1" for job_id in server_errors}
+
+    def _create_batch(self, input_file_id, endpoint, completion_window):
+        batch = super()._create_batch(input_file_id, endpoint, completion_window)
+        lines = []
+        for line in self._files[batch.output_file_id].splitlines():
+            line = json.loads(line)
+            if line["custom_id"] in self.server_errors:
+                line["response"]["status_code"] = 500
+            lines.append(json.dumps(line))
+        self._files[batch.output_file_id] = "\n".join(lines)
+        return batch
+
+
+class TestBatchRatings(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        cache = RatingCache(shared=False)
+        cache._local = DiskCache("rating_cache", 100, directory=directory.name)
+        self.addCleanup(cache._local.close)
+        self.db = FakeSupabase(
+            {
+                "job": [_job(i) for i in range(1, 5)],
+                "resume": [{"id": 1, "content": "Python resume", "user_id": "u"}],
+                "rating": [],
+            }
+        )
+        self.state_path = os.path.join(directory.name, "state.json")
+        for target in (
+            patch.object(processor.common, "get_supabase_client", return_value=self.db),
+            patch.object(processor, "rating_cache", cache),
+            patch.object(processor, "PREFILTER_ENABLED", False),
+            patch.object(processor, "COMPACTION_ENABLED", False),
+            patch.object(batch_ratings, "BATCH_DIRECTORY", directory.name),
+            patch.object(batch_ratings, "BATCH_STATE_PATH", self.state_path),
+        ):
+            target.start()
+            self.addCleanup(target.stop)
+        self.missing_ratings = [{"job_id": i, "resume_id": 1} for i in range(1, 5)]
+
+    def _ratings(self) -> dict[int, int]:
+        return {r["job_id"]: r["rating"] for r in self.db.tables["rating"]}
+
+    def test_partial_failures_are_left_missing(self):
+        client = ServerErrorBatchClient(FakeChatClient(failing={2}), server_errors={3})
+
+        stored = batch_ratings.process_missing_ratings_batch(
+            self.missing_ratings, client, poll_interval=0
+        )
+
+        self.assertEqual(stored, 2)
+        self.assertEqual(self._ratings(), {1: 1, 4: 4})
+        self.assertFalse(os.path.exists(self.state_path))
+
+    def test_resumes_batch_after_crash(self):
+        chat = FakeChatClient()
+        client = batch_ratings.LocalBatchClient(chat)
+        # The run dies right after submitting the batch.
+        state, stored = batch_ratings._submit_batch(self.missing_ratings, client)
+        self.assertEqual(stored, 0)
+        self.assertTrue(os.path.exists(self.state_path))
+
+        stored = batch_ratings.process_missing_ratings_batch(
+            [{"job_id": 99, "resume_id": 1}], client, poll_interval=0
+        )
+
+        # The batch in flight is finished instead of submitting a new one.
+        self.assertEqual(stored, 4)
+        self.assertEqual(len(client._batches), 1)
+        self.assertEqual(self._ratings(), {1: 1, 2: 2, 3: 3, 4: 4})
+        self.assertFalse(os.path.exists(self.state_path))
+
+    def test_finished_batch_seen_again_is_not_stored_twice(self):
+        client = batch_ratings.LocalBatchClient(FakeChatClient())
+        state, _ = batch_ratings._submit_batch(self.missing_ratings, client)
+        batch_ratings.process_missing_ratings_batch([], client, poll_interval=0)
+        # The run died after storing the results but before clearing the state.
+        batch_ratings._save_state(state)
+
+        stored = batch_ratings.process_missing_ratings_batch(
+            [], client, poll_interval=0
+        )
+
+        self.assertEqual(stored, 0)
+        self.assertEqual(len(self.db.tables["rating"]), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+import compaction
+from disk_cache import DiskCache
+
+DESCRIPTION = """**About Us**
+We are a fast growing company with a great culture.
+
+## Responsibilities
+- Build data pipelines in **Python**
+- Review [pull requests](https://example.com/prs)
+
+## Requirements
+- 3+ years of SQL
+
+## Benefits
+- Free lunch
+- Unlimited PTO
+
+Compensation: $100,000 - $120,000 a year.
+We are an equal opportunity employer and value diversity."""
+
+
+class TestCompaction(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        cache = DiskCache("compaction", 10, directory=directory.name)
+        self.addCleanup(cache.close)
+        for target in (
+            patch.object(compaction, "_cache", cache),
+            # Character based estimate, the tests don't depend on the tokenizer being downloaded.
+            patch.object(compaction, "_get_encoding", return_value=None),
+        ):
+            target.start()
+            self.addCleanup(target.stop)
+
+    def test_strips_boilerplate_and_markdown(self):
+        compacted = compaction.compact_description(DESCRIPTION)
+        self.assertIn("- Build data pipelines in Python", compacted)
+        self.assertIn("- Review pull requests", compacted)
+        self.assertIn("3+ years of SQL", compacted)
+        self.assertIn("$100,000 - $120,000", compacted)
+        for removed in (
+            "great culture",
+            "Free lunch",
+            "equal opportunity",
+            "**",
+            "https://",
+        ):
+            self.assertNotIn(removed, compacted)
+
+    def test_keeps_priority_sections_over_budget(self):
+        description = "\n".join(
+            ["Intro:", "word " * 400, "Requirements:", "Python and SQL"]
+        )
+        compacted = compaction.compact_description(description, budget=50)
+        self.assertEqual(compacted, "Requirements:\nPython and SQL")
+
+    def test_truncates_to_budget(self):
+        compacted = compaction.compact_description("word " * 1000, budget=20)
+        self.assertLessEqual(compaction.count_tokens(compacted), 21)
+
+    def test_long_line_without_periods_is_linear(self):
+        # The old single pattern took about 0.26 s on 2.4 KB of such a line, quadratic in its length.
+        description = (
+            "we value diversity and " * 1000 + "are an equal opportunity employer"
+        )
+        start = time.perf_counter()
+        compacted = compaction.compact_description(description, budget=10_000)
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertNotIn("equal opportunity", compacted)
+
+    def test_compacts_each_description_once(self):
+        with patch.object(
+            compaction, "_sections", wraps=compaction._sections
+        ) as sections:
+            first = compaction.compact_description(DESCRIPTION)
+            second = compaction.compact_description(DESCRIPTION)
+        self.assertEqual(first, second)
+        self.assertEqual(sections.call_count, 1)
+
+    def test_compact_jobs_reports_tokens_saved(self):
+        jobs = {1: {"description": DESCRIPTION}, 2: {"description": None}}
+        saved = compaction.compact_jobs(jobs)
+        self.assertEqual(
+            saved,
+            compaction.count_tokens(DESCRIPTION)
+            - compaction.count_tokens(jobs[1]["description"]),
+        )
+        self.assertGreater(saved, 0)
+        self.assertIsNone(jobs[2]["description"])
+
+
+if __name__ == "__main__":
+    unittest.main()
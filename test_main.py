@@ -0,0 +1,45 @@
+import unittest
+from unittest.mock import patch
+
+import main
+
+
+class TestMain(unittest.TestCase):
+    def test_no_command_runs_the_pipelined_cycle(self):
+        with patch.object(main, "run_cycle") as run_cycle:
+            self.assertEqual(main.main([]), 0)
+        run_cycle.assert_called_once_with(grouped=False)
+
+    def test_sequential_cycle_scrapes_then_processes(self):
+        calls = []
+        with patch.object(
+            main, "scrape_it", lambda: calls.append("scrape")
+        ), patch.object(main, "process_it", lambda grouped: calls.append("process")):
+            main.main(["cycle", "--sequential"])
+        self.assertEqual(calls, ["scrape", "process"])
+
+    def test_stage_limits_are_passed(self):
+        with patch.object(main, "scrape_it") as scrape_it, patch.object(
+            main, "process_it"
+        ) as process_it:
+            main.main(["scrape", "--max-searches", "10", "--time-budget", "60"])
+            main.main(["process", "--max-ratings", "500", "--no-enqueue", "--grouped"])
+        scrape_it.assert_called_once_with(max_searches=10, time_budget=60.0)
+        process_it.assert_called_once_with(
+            batch=False,
+            grouped=True,
+            full_rescan=False,
+            enqueue=False,
+            max_ratings=500,
+            time_budget=None,
+        )
+
+    def test_health_exit_code(self):
+        with patch("health.check_health", return_value={"openai": "boom"}):
+            self.assertEqual(main.main(["health"]), 1)
+        with patch("health.check_health", return_value={"openai": None}):
+            self.assertEqual(main.main(["health"]), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import json
+import os
+import tempfile
+import unittest
+import urllib.request
+
+import httpx
+
+import metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_counter_sums_per_labels(self):
+        metrics.LLM_TOKENS.inc(10, kind="prompt")
+        metrics.LLM_TOKENS.inc(5, kind="prompt")
+        metrics.LLM_TOKENS.inc(3, kind="completion")
+        self.assertEqual(metrics.LLM_TOKENS.value(kind="prompt"), 15)
+        self.assertEqual(metrics.LLM_TOKENS.value(kind="completion"), 3)
+
+    def test_histogram_prometheus_buckets_are_cumulative(self):
+        histogram = metrics.Histogram("test_seconds", "Test.", buckets=(0.1, 1))
+        self.addCleanup(metrics._registry.remove, histogram)
+        for value in (0.05, 0.5, 0.5, 5):
+            histogram.observe(value, stage="scrape")
+        text = metrics.to_prometheus()
+        self.assertIn("# TYPE matchmyjob_test_seconds histogram", text)
+        self.assertIn('matchmyjob_test_seconds_bucket{stage="scrape",le="0.1"} 1', text)
+        self.assertIn('matchmyjob_test_seconds_bucket{stage="scrape",le="1"} 3', text)
+        self.assertIn(
+            'matchmyjob_test_seconds_bucket{stage="scrape",le="+Inf"} 4', text
+        )
+        self.assertIn('matchmyjob_test_seconds_sum{stage="scrape"} 6.05', text)
+        self.assertIn('matchmyjob_test_seconds_count{stage="scrape"} 4', text)
+
+    def test_timer_observes_on_error(self):
+        with self.assertRaises(ValueError):
+            with metrics.STAGE_SECONDS.time(stage="process"):
+                raise ValueError()
+        self.assertEqual(metrics.STAGE_SECONDS.count(stage="process"), 1)
+
+    def test_export_json_and_prometheus(self):
+        metrics.RATINGS_STORED.inc(1_234_567, source="bulk")
+        with tempfile.TemporaryDirectory() as directory:
+            metrics.export(os.path.join(directory, "metrics.json"))
+            with open(os.path.join(directory, "metrics.json")) as file:
+                exported = json.load(file)
+            metrics.export(os.path.join(directory, "metrics.prom"))
+            with open(os.path.join(directory, "metrics.prom")) as file:
+                text = file.read()
+        self.assertEqual(
+            exported["matchmyjob_ratings_stored_total"]["values"],
+            [{"labels": {"source": "bulk"}, "value": 1_234_567}],
+        )
+        self.assertIn('matchmyjob_ratings_stored_total{source="bulk"} 1234567', text)
+
+    def test_serve(self):
+        metrics.SCRAPED_JOBS.inc(3, site="indeed")
+        server = metrics.serve(0, host="127.0.0.1")
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            self.assertIn(
+                'matchmyjob_scraped_jobs_total{site="indeed"} 3',
+                response.read().decode(),
+            )
+        with urllib.request.urlopen(f"{url}/metrics.json") as response:
+            self.assertIn("matchmyjob_scraped_jobs_total", json.load(response))
+
+    def test_instrument_postgrest_counts_round_trips(self):
+        session = httpx.Client(
+            base_url="http://localhost/rest/v1",
+            transport=httpx.MockTransport(lambda request: httpx.Response(201, json=[])),
+        )
+        metrics.instrument_postgrest(session)
+        metrics.instrument_postgrest(session)
+        session.post("/rating", json=[{}])
+        session.post(
+            "/job", json=[{}], headers={"Prefer": "resolution=merge-duplicates"}
+        )
+        self.assertEqual(
+            metrics.DB_REQUESTS.value(table="rating", operation="insert", status="201"),
+            1,
+        )
+        self.assertEqual(metrics.DB_SECONDS.count(table="job", operation="upsert"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
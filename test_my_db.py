@@ -0,0 +1,84 @@
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+import my_db
+
+
+class TestMyDb(unittest.TestCase):
+    def setUp(self):
+        self.pool = MagicMock()
+        self.connection = self.pool.getconn.return_value
+        self.connection.closed = 0
+        self.cursor = self.connection.cursor.return_value.__enter__.return_value
+        patcher = patch.object(my_db, "_pool", self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_run_query_returns_connection_to_pool(self):
+        self.cursor.fetchall.return_value = [(1, 2)]
+        self.assertEqual(my_db.run_query("select 1, 2"), [(1, 2)])
+        self.connection.commit.assert_called_once()
+        self.pool.putconn.assert_called_once_with(self.connection, close=False)
+
+    def test_run_query_rolls_back_on_error(self):
+        self.cursor.execute.side_effect = Exception("boom")
+        self.assertIsNone(my_db.run_query("select 1"))
+        self.connection.rollback.assert_called_once()
+        self.pool.putconn.assert_called_once_with(self.connection, close=False)
+
+    def test_execute_returns_rowcount(self):
+        self.cursor.rowcount = 3
+        self.assertEqual(my_db.execute("update search set x = %(x)s", {"x": 1}), 3)
+        self.cursor.execute.assert_called_once_with(
+            "update search set x = %(x)s", {"x": 1}
+        )
+        self.cursor.fetchall.assert_not_called()
+        self.connection.commit.assert_called_once()
+
+    def test_stream_query_uses_named_cursor(self):
+        self.cursor.__iter__.return_value = iter([(1, 2), (3, 4)])
+        rows = my_db.stream_query("select 1, 2", itersize=10)
+        # Nothing is borrowed until the iteration starts.
+        self.pool.getconn.assert_not_called()
+        self.assertEqual(list(rows), [(1, 2), (3, 4)])
+        self.assertIsNotNone(self.connection.cursor.call_args.kwargs["name"])
+        self.assertEqual(self.cursor.itersize, 10)
+        self.pool.putconn.assert_called_once_with(self.connection, close=False)
+
+    def test_stream_query_releases_connection_when_closed_early(self):
+        self.cursor.__iter__.return_value = iter([(1, 2), (3, 4)])
+        rows = my_db.stream_query("select 1, 2")
+        next(rows)
+        rows.close()
+        self.pool.putconn.assert_called_once_with(self.connection, close=False)
+
+    def test_waits_for_a_free_connection(self):
+        slots = threading.BoundedSemaphore(1)
+        patcher = patch.object(my_db, "_connection_slots", slots)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cursor.fetchall.return_value = []
+        release = threading.Event()
+
+        def hold_connection():
+            with my_db._connection():
+                release.wait()
+
+        holder = threading.Thread(target=hold_connection)
+        holder.start()
+        waiter = threading.Thread(target=my_db.run_query, args=("select 1",))
+        waiter.start()
+        waiter.join(0.1)
+        # The second query waits instead of asking the pool for an eleventh connection.
+        self.assertTrue(waiter.is_alive())
+        self.assertEqual(self.pool.getconn.call_count, 1)
+        release.set()
+        holder.join()
+        waiter.join()
+        self.assertEqual(self.pool.getconn.call_count, 2)
+        self.assertEqual(self.pool.putconn.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+from unittest import mock
+
+import my_proxies
+
+
+class TestVerifyProxiesConcurrent(unittest.TestCase):
+    def test_stops_after_max_proxies(self):
+        latencies = {"a": 0.3, "b": None, "c": 0.1, "d": 0.2, "e": 0.5}
+        checked = []
+
+        def check_proxy(proxy, test_url, timeout):
+            checked.append(proxy)
+            return latencies[proxy]
+
+        with mock.patch.object(my_proxies, "_check_proxy", side_effect=check_proxy):
+            result = my_proxies.verify_proxies_concurrent(
+                list(latencies.keys()), max_proxies=2, max_in_flight=1
+            )
+
+        self.assertEqual(result, [("c", 0.1), ("a", 0.3)])
+        self.assertEqual(checked, ["a", "b", "c"])
+
+
+class TestGetVerifiedProxies(unittest.TestCase):
+    def test_sequential_verification_stops_after_max_proxies(self):
+        import requests
+
+        statuses = {"a": 200, "b": 500, "c": 200, "d": 200}
+        checked = []
+
+        def get(url, proxies, timeout):
+            proxy = proxies["http"].removeprefix("http://")
+            checked.append(proxy)
+            return mock.MagicMock(status_code=statuses[proxy])
+
+        with mock.patch.object(
+            my_proxies, "get_proxies", return_value=list(statuses.keys())
+        ), mock.patch.object(requests, "get", side_effect=get):
+            result = my_proxies.get_verified_proxies(max_proxies=2, concurrent=False)
+
+        self.assertEqual(result, ["a", "c"])
+        self.assertEqual(checked, ["a", "b", "c"])
+
+
+if __name__ == "__main__":
+    unittest.main()
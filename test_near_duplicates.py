@@ -0,0 +1,41 @@
+import unittest
+
+from near_duplicates import estimate_similarity, lsh_buckets, minhash_signature
+
+DESCRIPTION = (
+    "We are looking for a software engineer to build data pipelines in Python and SQL. "
+    "You will work with product managers and designers to ship features to millions of users, "
+    "review code, mentor interns and improve the reliability of our distributed systems. "
+    "Requirements: two years of experience with Python, experience with cloud providers, "
+    "strong communication skills and a degree in computer science or related field."
+)
+
+
+class TestMinHash(unittest.TestCase):
+    def test_near_duplicates_share_a_bucket(self):
+        signature = minhash_signature(DESCRIPTION)
+        repost = minhash_signature(
+            DESCRIPTION.replace("millions of users", "millions of customers")
+        )
+        self.assertGreater(estimate_similarity(signature, repost), 0.7)
+        self.assertTrue(set(lsh_buckets(signature)) & set(lsh_buckets(repost)))
+
+    def test_different_descriptions(self):
+        signature = minhash_signature(DESCRIPTION)
+        other = minhash_signature(
+            "Registered nurse wanted for the night shift at our downtown clinic, "
+            "providing patient care, administering medication and keeping records."
+        )
+        self.assertLess(estimate_similarity(signature, other), 0.1)
+        self.assertFalse(set(lsh_buckets(signature)) & set(lsh_buckets(other)))
+
+    def test_signature_is_deterministic(self):
+        self.assertEqual(
+            minhash_signature(DESCRIPTION).tolist(),
+            minhash_signature(DESCRIPTION.upper()).tolist(),
+        )
+        self.assertIsNone(minhash_signature(""))
+
+
+if __name__ == "__main__":
+    unittest.main()
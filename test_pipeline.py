@@ -0,0 +1,133 @@
+import threading
+import unittest
+from unittest.mock import patch
+
+import db_queries
+import pipeline
+
+
+class FakeQueue:
+    """
+    In memory stand-in for rating_queue, leasing the missing ratings of the jobs like the pipeline queries do.
+    Every job misses the rating of resume 1, except the even ones that also miss resume 2.
+    """
+
+    def __init__(self):
+        self.leases: dict[tuple[int, int], str] = {}
+        self.rated: list[tuple[int, int]] = []
+        self.leased_job_ids: list[int] = []
+        self.lock = threading.Lock()
+
+    def run_query(self, query, params=None):
+        assert query == db_queries.lease_missing_ratings_for_jobs
+        with self.lock:
+            self.leased_job_ids += params["job_ids"]
+            pairs = [(job_id, 1) for job_id in params["job_ids"]] + [
+                (job_id, 2) for job_id in params["job_ids"] if job_id % 2 == 0
+            ]
+            leased = [
+                pair
+                for pair in pairs
+                if pair not in self.leases and pair not in self.rated
+            ]
+            for pair in leased:
+                self.leases[pair] = params["owner"]
+            return leased
+
+    def execute(self, query, params=None):
+        assert query == db_queries.release_rating_queue
+        with self.lock:
+            released = [
+                pair for pair, owner in self.leases.items() if owner == params["owner"]
+            ]
+            for pair in released:
+                del self.leases[pair]
+            return len(released)
+
+
+class TestRatingPipeline(unittest.TestCase):
+    def setUp(self):
+        self.queue = FakeQueue()
+        for target in (
+            patch.object(
+                pipeline.rating_queue.my_db, "run_query", self.queue.run_query
+            ),
+            patch.object(pipeline.rating_queue.my_db, "execute", self.queue.execute),
+        ):
+            target.start()
+            self.addCleanup(target.stop)
+        self.batches = []
+
+    def _rate(self, missing_ratings):
+        with self.queue.lock:
+            self.batches.append(missing_ratings)
+            self.queue.rated += [
+                (mr["job_id"], mr["resume_id"]) for mr in missing_ratings
+            ]
+        return len(missing_ratings)
+
+    def test_rates_every_job_put(self):
+        with pipeline.RatingPipeline(self._rate, batch_size=3) as rating_pipeline:
+            rating_pipeline.put([1, 2, 3, 4])
+            rating_pipeline.put([5, 6])
+        self.assertEqual(rating_pipeline.stored, 9)
+        rated = sorted(self.queue.rated)
+        self.assertEqual(rated[:3], [(1, 1), (2, 1), (2, 2)])
+        self.assertEqual(len(set(rated)), 9)
+        # Every lease is released once rated.
+        self.assertEqual(self.queue.leases, {})
+
+    def test_overlapping_units_rate_each_pair_once(self):
+        rating_pipeline = pipeline.RatingPipeline(self._rate, batch_size=1, workers=3)
+        rating_pipeline.start()
+        units = [
+            threading.Thread(target=rating_pipeline.put, args=(job_ids,))
+            for job_ids in ([1, 2, 3, 4], [3, 4, 5, 6], [4, 6, 6])
+        ]
+        for unit in units:
+            unit.start()
+        for unit in units:
+            unit.join()
+
+        self.assertEqual(rating_pipeline.close(), 9)
+        self.assertEqual(len(self.queue.rated), 9)
+        self.assertEqual(len(set(self.queue.rated)), 9)
+        # Jobs put again by another unit are not looked up again.
+        self.assertEqual(sorted(self.queue.leased_job_ids), [1, 2, 3, 4, 5, 6])
+
+    def test_put_blocks_while_the_queue_is_full(self):
+        release = threading.Event()
+
+        def rate(missing_ratings):
+            release.wait()
+            return self._rate(missing_ratings)
+
+        rating_pipeline = pipeline.RatingPipeline(
+            rate, queue_size=2, batch_size=1, workers=1
+        )
+        rating_pipeline.start()
+        producer = threading.Thread(target=rating_pipeline.put, args=(list(range(10)),))
+        producer.start()
+        producer.join(0.1)
+        # One job is being rated and two are queued, the rest wait for room.
+        self.assertTrue(producer.is_alive())
+        release.set()
+        producer.join()
+        self.assertEqual(rating_pipeline.close(), 15)
+
+    def test_failed_batch_does_not_stop_the_workers(self):
+        def rate(missing_ratings):
+            if any(mr["job_id"] == 1 for mr in missing_ratings):
+                raise Exception("boom")
+            return self._rate(missing_ratings)
+
+        with pipeline.RatingPipeline(rate, batch_size=1, workers=1) as rating_pipeline:
+            rating_pipeline.put([1, 3])
+        self.assertEqual(rating_pipeline.stored, 1)
+        # The failed pair goes back to the queue for process_it.
+        self.assertEqual(self.queue.leases, {})
+        self.assertEqual(self.queue.rated, [(3, 1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,338 @@
+import json
+import tempfile
+import threading
+import types
+import unittest
+from unittest.mock import patch
+
+import httpx
+from openai import RateLimitError
+
+import ai_calls
+import processor
+from disk_cache import DiskCache
+from rate_limiter import RateLimiter
+from rating_cache import RatingCache
+
+
+class FakeQuery:
+    def __init__(self, db: "FakeSupabase", table: str):
+        self.db = db
+        self.table = table
+        self.operation = "select"
+        self.columns: tuple[str, ...] = ()
+        self.filters: list[tuple[str, list]] = []
+        self.payload = None
+
+    def select(self, *columns):
+        self.columns = columns
+        return self
+
+    def in_(self, column, values):
+        self.filters.append((column, list(values)))
+        return self
+
+    def eq(self, column, value):
+        self.filters.append((column, [value]))
+        return self
+
+    def insert(self, payload, **kwargs):
+        self.operation, self.payload = "insert", payload
+        return self
+
+    def update(self, payload):
+        self.operation, self.payload = "update", payload
+        return self
+
+    def upsert(self, payload, **kwargs):
+        self.operation, self.payload = "upsert", payload
+        return self
+
+    def _matches(self, row: dict) -> bool:
+        return all(row.get(column) in values for column, values in self.filters)
+
+    def execute(self):
+        with self.db.lock:
+            self.db.requests.append(self)
+            rows = self.db.tables.setdefault(self.table, [])
+            if self.operation == "select":
+                data = [
+                    {column: row.get(column) for column in self.columns}
+                    for row in rows
+                    if self._matches(row)
+                ]
+            elif self.operation == "insert":
+                payload = (
+                    self.payload if isinstance(self.payload, list) else [self.payload]
+                )
+                data = []
+                for row in payload:
+                    data.append({"id": len(rows) + 1, **row})
+                    rows.append(data[-1])
+            elif self.operation == "update":
+                data = [row for row in rows if self._matches(row)]
+                for row in data:
+                    row.update(self.payload)
+            else:
+                data = []
+                for row in self.payload:
+                    existing = [r for r in rows if r["job_url"] == row["job_url"]]
+                    for r in existing:
+                        r.update(row)
+                    data += existing
+            return types.SimpleNamespace(data=data)
+
+
+class FakeSupabase:
+    """
+    In memory stand-in for the supabase client, answering the queries of processor from a dictionary of tables.
+    """
+
+    def __init__(self, tables: dict[str, list[dict]]):
+        self.tables = tables
+        self.requests: list[FakeQuery] = []
+        self.lock = threading.Lock()
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+
+def _job(job_id: int, **fields) -> dict:
+    return {
+        "id": job_id,
+        "job_url": f"https://example.com/{job_id}",
+        "title": f"Engineer {job_id}",
+        "description": f"Job number {job_id} working with Python.",
+        "canonical_job_id": None,
+        **fields,
+    }
+
+
+def _completion(content: dict):
+    return types.SimpleNamespace(
+        choices=[
+            types.SimpleNamespace(
+                message=types.SimpleNamespace(content=json.dumps(content))
+            )
+        ],
+        usage=None,
+    )
+
+
+class FakeOpenAI:
+    """
+    Answers every rating with the number of its job, except for the jobs in failing, and the first request of the jobs
+    in rate_limited, which get a 429.
+    """
+
+    def __init__(self, failing=(), rate_limited=()):
+        self.failing = set(failing)
+        self.rate_limited = set(rate_limited)
+        self.requests: list[int] = []
+        self.lock = threading.Lock()
+        self.chat = types.SimpleNamespace(
+            completions=types.SimpleNamespace(create=self.create)
+        )
+
+    def with_options(self, **kwargs):
+        return self
+
+    def create(self, **kwargs):
+        content = kwargs["messages"][-1]["content"]
+        job_id = int(content.split("Engineer ")[1].split()[0])
+        with self.lock:
+            self.requests.append(job_id)
+            limited = job_id in self.rate_limited
+            self.rate_limited.discard(job_id)
+        if limited:
+            request = httpx.Request(
+                "POST", "https://api.openai.com/v1/chat/completions"
+            )
+            response = httpx.Response(
+                429, headers={"retry-after": "0.01"}, request=request
+            )
+            raise RateLimitError("Rate limited", response=response, body=None)
+        if job_id in self.failing:
+            raise ValueError("boom")
+        return _completion(
+            {"rating": job_id, "justification": "ok", "is_remote": job_id % 2 == 0}
+        )
+
+
+class TestProcessor(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        cache = RatingCache(shared=False)
+        cache._local = DiskCache("rating_cache", 100, directory=directory.name)
+        self.addCleanup(cache._local.close)
+        self.db = FakeSupabase(
+            {
+                "job": [_job(i) for i in range(1, 7)],
+                "resume": [{"id": 1, "content": "Python resume", "user_id": "u"}],
+                "rating": [],
+            }
+        )
+        self.openai = FakeOpenAI()
+        for target in (
+            patch.object(processor.common, "get_supabase_client", return_value=self.db),
+            patch.object(
+                ai_calls.common, "get_openai_client", return_value=self.openai
+            ),
+            patch.object(ai_calls, "rate_limiter", RateLimiter(10**6, 10**9)),
+            patch.object(processor, "rating_cache", cache),
+            patch.object(processor, "PREFILTER_ENABLED", False),
+            patch.object(processor, "COMPACTION_ENABLED", False),
+        ):
+            target.start()
+            self.addCleanup(target.stop)
+
+    def _rated_pairs(self) -> list[tuple[int, int]]:
+        return sorted((r["job_id"], r["resume_id"]) for r in self.db.tables["rating"])
+
+    def test_prefetch_selects_needed_columns_in_chunks(self):
+        self.db.tables["job"] = [_job(i) for i in range(1, 451)]
+        missing_ratings = [{"job_id": i, "resume_id": 1} for i in range(1, 451)]
+        resume_cache = {}
+
+        jobs = processor._prefetch(missing_ratings, resume_cache)
+
+        self.assertEqual(len(jobs), 450)
+        self.assertEqual(set(jobs[1].keys()), set(processor.JOB_COLUMNS))
+        self.assertEqual(list(resume_cache.keys()), [1])
+        job_requests = [q for q in self.db.requests if q.table == "job"]
+        self.assertEqual(
+            [len(q.filters[0][1]) for q in job_requests],
+            [processor.common.IN_CHUNK_SIZE] * 4 + [50],
+        )
+        self.assertTrue(all(q.columns == processor.JOB_COLUMNS for q in job_requests))
+        resume_requests = [q for q in self.db.requests if q.table == "resume"]
+        self.assertEqual(len(resume_requests), 1)
+        self.assertEqual(resume_requests[0].columns, processor.RESUME_COLUMNS)
+
+        # Cached resumes are not fetched again.
+        processor._prefetch(missing_ratings[:1], resume_cache)
+        self.assertEqual(len([q for q in self.db.requests if q.table == "resume"]), 1)
+
+    def test_concurrent_rating_stores_each_pair_once(self):
+        self.openai.failing = {2}
+        self.openai.rate_limited = {3, 5}
+        missing_ratings = [{"job_id": i, "resume_id": 1} for i in range(1, 7)]
+
+        stored = processor.process_missing_ratings(missing_ratings, max_workers=4)
+
+        self.assertEqual(stored, 5)
+        self.assertEqual(self._rated_pairs(), [(1, 1), (3, 1), (4, 1), (5, 1), (6, 1)])
+        # Rate limited ratings are retried once, the failed one is given up on.
+        self.assertEqual(sorted(self.openai.requests), [1, 2, 3, 3, 4, 5, 5, 6])
+        ratings = {r["job_id"]: r["rating"] for r in self.db.tables["rating"]}
+        self.assertEqual(ratings, {1: 1, 3: 3, 4: 4, 5: 5, 6: 6})
+
+    def test_pair_claimed_again_after_its_rating_is_not_rated_twice(self):
+        # The worker stored the rating of (1, 1) and died before the ack, its lease expired and the pair was claimed
+        # again along with (2, 1).
+        processor.process_missing_ratings([{"job_id": 1, "resume_id": 1}])
+        self.openai.requests.clear()
+
+        stored = processor.process_missing_ratings(
+            [{"job_id": 1, "resume_id": 1}, {"job_id": 2, "resume_id": 1}]
+        )
+
+        self.assertEqual(stored, 1)
+        self.assertEqual(self._rated_pairs(), [(1, 1), (2, 1)])
+        self.assertEqual(self.openai.requests, [2])
+
+    def test_cluster_members_only_get_a_copy_of_the_rating(self):
+        self.db.tables["job"] = [
+            _job(1, is_remote=None, min_amount=None),
+            _job(2, canonical_job_id=1, is_remote=False, min_amount=50_000),
+            _job(3, canonical_job_id=1, is_remote=True, min_amount=70_000),
+        ]
+
+        stored = processor.process_missing_ratings(
+            [{"job_id": 1, "resume_id": 1}, {"job_id": 2, "resume_id": 1}]
+        )
+        # A near duplicate found later reuses the stored rating of its canonical job.
+        stored += processor.process_missing_ratings([{"job_id": 3, "resume_id": 1}])
+
+        self.assertEqual(stored, 3)
+        self.assertEqual(self.openai.requests, [1])
+        self.assertEqual(
+            {r["job_id"]: r["rating"] for r in self.db.tables["rating"]},
+            {1: 1, 2: 1, 3: 1},
+        )
+        jobs = {job["id"]: job for job in self.db.tables["job"]}
+        # The job the model read gets the data it found, the members keep their own.
+        self.assertEqual(jobs[1]["is_remote"], False)
+        self.assertEqual((jobs[2]["is_remote"], jobs[2]["min_amount"]), (False, 50_000))
+        self.assertEqual((jobs[3]["is_remote"], jobs[3]["min_amount"]), (True, 70_000))
+
+    def test_deferred_pre_filter_leaves_dissimilar_pairs_missing(self):
+        self.db.tables["job"].append(
+            _job(7, title="Chef", description="Cooking pasta in a busy kitchen.")
+        )
+        missing_ratings = [{"job_id": i, "resume_id": 1} for i in (1, 2, 7)]
+
+        with patch.object(processor, "PREFILTER_ENABLED", True):
+            stored = processor.process_missing_ratings(
+                missing_ratings, defer_dissimilar=True
+            )
+
+        self.assertEqual(stored, 2)
+        # The dissimilar pair gets no skipped rating, the queue picks the top ones among more jobs later.
+        self.assertEqual(self._rated_pairs(), [(1, 1), (2, 1)])
+        self.assertEqual(sorted(self.openai.requests), [1, 2])
+
+    def test_grouped_rating_falls_back_to_single_ratings(self):
+        # The fake answers the grouped request like a single rating, which does not match the jobs.
+        stored = processor.process_missing_ratings(
+            [{"job_id": i, "resume_id": 1} for i in (1, 2, 3)], grouped=True
+        )
+        self.assertEqual(stored, 3)
+        self.assertEqual(self._rated_pairs(), [(1, 1), (2, 1), (3, 1)])
+        self.assertEqual(
+            {r["job_id"]: r["rating"] for r in self.db.tables["rating"]},
+            {1: 1, 2: 2, 3: 3},
+        )
+        self.assertEqual(len(self.openai.requests), 4)
+
+    def test_grouped_ratings_are_not_served_as_single_ratings(self):
+        group_result = [
+            ({"is_remote": None}, {"rating": 10 + i, "justification": "group"})
+            for i in (1, 2)
+        ]
+        with patch.object(
+            processor, "generate_group_rating", return_value=group_result
+        ):
+            processor.process_missing_ratings(
+                [{"job_id": i, "resume_id": 1} for i in (1, 2)], grouped=True
+            )
+        jobs = {job["id"]: job for job in self.db.tables["job"]}
+        resume = self.db.tables["resume"][0]
+        self.assertIsNone(
+            processor.rating_cache.get(processor._rating_cache_key(jobs[1], resume))
+        )
+
+        # The same postings under new URLs are rated again by a single rating run.
+        self.db.tables["job"] += [
+            {**_job(i), "id": i + 10, "job_url": f"https://example.com/{i + 10}"}
+            for i in (1, 2)
+        ]
+        processor.process_missing_ratings(
+            [{"job_id": i, "resume_id": 1} for i in (11, 12)]
+        )
+        self.assertEqual(sorted(self.openai.requests), [1, 2])
+
+        # While a grouped run reuses both.
+        self.db.tables["job"] += [
+            {**_job(i), "id": i + 20, "job_url": f"https://example.com/{i + 20}"}
+            for i in (1, 2)
+        ]
+        processor.process_missing_ratings(
+            [{"job_id": i, "resume_id": 1} for i in (21, 22)], grouped=True
+        )
+        self.assertEqual(sorted(self.openai.requests), [1, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import proxy_pool
+from proxy_pool import ProxyPool
+
+
+class TestProxyPool(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "proxy_pool.json")
+
+    def test_refresh_only_checks_stale_proxies(self):
+        pool = ProxyPool(self.path, ttl=60)
+        pool._proxies = {
+            "fresh:1": {"latency": 0.5, "checked_at": time.time(), "health": 1.0},
+            "stale:1": {"latency": 0.5, "checked_at": 0, "health": 1.0},
+            "stale:2": {"latency": 0.5, "checked_at": 0, "health": 1.0},
+        }
+        with mock.patch.object(
+            proxy_pool.my_proxies,
+            "verify_proxies_concurrent",
+            return_value=[("stale:1", 0.1)],
+        ) as verify, mock.patch.object(proxy_pool.my_proxies, "get_proxies") as get:
+            pool.refresh(min_proxies=2)
+
+        verify.assert_called_once_with(["stale:1", "stale:2"], max_proxies=2)
+        get.assert_not_called()
+        self.assertEqual(pool.best(), ["stale:1", "fresh:1"])
+        self.assertEqual(ProxyPool(self.path).best(), ["stale:1", "fresh:1"])
+
+    def test_refresh_skips_full_and_fresh_pool(self):
+        pool = ProxyPool(self.path, ttl=60)
+        pool._proxies = {
+            f"fresh:{i}": {"latency": 0.5, "checked_at": time.time(), "health": 1.0}
+            for i in range(2)
+        }
+        self.assertFalse(pool.needs_refresh(min_proxies=2))
+        self.assertTrue(pool.needs_refresh(min_proxies=3))
+        with mock.patch.object(
+            proxy_pool.my_proxies, "verify_proxies_concurrent"
+        ) as verify, mock.patch.object(proxy_pool.my_proxies, "get_proxies") as get:
+            pool.refresh(min_proxies=2)
+
+        verify.assert_not_called()
+        get.assert_not_called()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_report_failure_drops_proxy(self):
+        pool = ProxyPool(self.path)
+        pool._proxies = {
+            "a:1": {"latency": 0.1, "checked_at": time.time(), "health": 1.0},
+            "b:1": {"latency": 0.2, "checked_at": time.time(), "health": 1.0},
+        }
+        pool.report_failure(["a:1"])
+        self.assertEqual(pool.best(), ["b:1", "a:1"])
+        for _ in range(5):
+            pool.report_failure(["a:1"])
+        self.assertEqual(pool.best(), ["b:1"])
+
+    def test_best_rotates_over_the_healthiest(self):
+        pool = ProxyPool(self.path)
+        pool._proxies = {
+            f"p:{i}": {"latency": 0.1 * i, "checked_at": time.time(), "health": 1.0}
+            for i in range(proxy_pool.ROTATION_SIZE + 5)
+        }
+        handed_out = [pool.best() for _ in range(6)]
+        self.assertEqual(handed_out[0], [f"p:{i}" for i in range(10)])
+        self.assertEqual(handed_out[1], [f"p:{i}" for i in range(10, 20)])
+        # Only the top ROTATION_SIZE are used, the sixth call wraps around to the first window.
+        self.assertEqual(handed_out[5], handed_out[0])
+        self.assertNotIn("p:50", sum(handed_out, []))
+
+    def test_report_error_ignores_job_board_errors(self):
+        pool = ProxyPool(self.path)
+        pool._proxies = {
+            "a:1": {"latency": 0.1, "checked_at": time.time(), "health": 1.0}
+        }
+        pool.report_error(["a:1"], ValueError("429 Too Many Requests"))
+        self.assertEqual(pool._proxies["a:1"]["health"], 1.0)
+
+        class ProxyError(Exception):
+            pass
+
+        try:
+            try:
+                raise ProxyError("Tunnel connection failed")
+            except ProxyError as e:
+                raise RuntimeError("Indeed: scrape failed") from e
+        except RuntimeError as e:
+            pool.report_error(["a:1"], e)
+        self.assertLess(pool._proxies["a:1"]["health"], 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+import time
+import unittest
+
+from rate_limiter import RateLimiter
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_requests_per_minute(self):
+        limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=10**9)
+        start = time.monotonic()
+        for _ in range(60):
+            limiter.acquire()
+        self.assertLess(time.monotonic() - start, 0.05)
+        limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.08)
+
+    def test_tokens_per_minute(self):
+        limiter = RateLimiter(requests_per_minute=10**6, tokens_per_minute=6000)
+        start = time.monotonic()
+        limiter.acquire(600)
+        limiter.acquire(20)
+        self.assertGreaterEqual(time.monotonic() - start, 0.18)
+
+    def test_rate_limited_pauses_and_slows_down(self):
+        limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=10**9)
+        limiter.on_rate_limited(retry_after=0.1)
+        start = time.monotonic()
+        limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+        self.assertEqual(limiter._rate_factor, 0.5)
+        limiter.on_success()
+        self.assertAlmostEqual(limiter._rate_factor, 0.52)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import tempfile
+import unittest
+
+from disk_cache import DiskCache
+from rating_cache import RatingCache, rating_cache_key
+
+
+class TestRatingCache(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_key_ignores_case_and_whitespace(self):
+        key = rating_cache_key("Engineer", "Python  and\nSQL", "resume", [], "m", 0.5)
+        self.assertEqual(
+            key, rating_cache_key("engineer ", "python and SQL", "resume", [], "m", 0.5)
+        )
+        self.assertNotEqual(
+            key, rating_cache_key("Engineer", "Python and SQL", "resume", [], "m", 0.7)
+        )
+
+    def test_hits_and_misses(self):
+        cache = RatingCache(shared=False)
+        cache._local = DiskCache("rating_cache", 10, directory=self.directory)
+        self.assertIsNone(cache.get("key"))
+        cache.put("key", {"is_remote": True}, {"rating": 7})
+        self.assertEqual(cache.get("key"), ({"is_remote": True}, {"rating": 7}))
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 1})
+
+    def test_disk_cache_evicts_least_recently_used(self):
+        cache = DiskCache("lru", 10, directory=self.directory)
+        for i in range(10):
+            cache.put(str(i), i)
+        cache.get("0")
+        cache.put("10", 10)
+        self.assertEqual(len(cache), 9)
+        self.assertEqual(cache.get("0"), 0)
+        self.assertIsNone(cache.get("1"))
+        self.assertEqual(cache.get("10"), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,314 @@
+import os
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import psycopg2
+
+import db_queries
+import rating_queue
+
+# Throwaway Postgres database the queue queries are run against, e.g. postgresql://postgres@localhost/test. Every test
+# runs in a transaction that is rolled back, the tests are skipped without it.
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+# Only the columns of the Supabase tables that the queue queries use.
+TEST_SCHEMA = """
+CREATE TABLE IF NOT EXISTS public.job (id BIGINT PRIMARY KEY, job_url TEXT);
+CREATE TABLE IF NOT EXISTS public.search (id BIGINT PRIMARY KEY, user_id TEXT, last_processed TIMESTAMPTZ);
+CREATE TABLE IF NOT EXISTS public.search_job (
+    search_id BIGINT, job_id BIGINT, created_at TIMESTAMPTZ DEFAULT now(), PRIMARY KEY (search_id, job_id)
+);
+CREATE TABLE IF NOT EXISTS public.resume (
+    id BIGINT PRIMARY KEY, user_id TEXT, is_active BOOLEAN, date_uploaded TIMESTAMPTZ DEFAULT now()
+);
+CREATE TABLE IF NOT EXISTS public.rating (
+    id BIGSERIAL PRIMARY KEY, job_id BIGINT, resume_id BIGINT, user_id TEXT, rating INTEGER
+);
+"""
+
+
+class FakeQueue:
+    """
+    In memory stand-in for the rating_queue table, answering the queries of rating_queue through my_db.
+    """
+
+    def __init__(self, pairs):
+        self.pending = list(pairs)
+        self.leased: dict[str, list] = {}
+        self.rated = set()
+        self.failed = []
+        self.exhausted = 0
+        self.enqueued = []
+
+    def run_query(self, query, params=None):
+        if query == db_queries.count_exhausted_rating_queue:
+            return [(self.exhausted,)]
+        assert query == db_queries.claim_rating_queue
+        batch = self.pending[: params["batch_size"]]
+        self.pending = self.pending[params["batch_size"] :]
+        if batch:
+            self.leased.setdefault(params["owner"], []).extend(batch)
+        return batch
+
+    def execute(self, query, params=None):
+        if query == db_queries.enqueue_missing_ratings:
+            self.enqueued.append(params)
+            return 0
+        assert query == db_queries.ack_rating_queue
+        leased = self.leased.pop(params["owner"], [])
+        self.failed += [pair for pair in leased if pair not in self.rated]
+        return len(leased)
+
+
+class TestRatingQueue(unittest.TestCase):
+    def setUp(self):
+        self.queue = FakeQueue([(i, 1) for i in range(5)])
+        for target in (
+            patch.object(rating_queue.my_db, "run_query", self.queue.run_query),
+            patch.object(rating_queue.my_db, "execute", self.queue.execute),
+        ):
+            target.start()
+            self.addCleanup(target.stop)
+
+    def _rate(self, missing_ratings):
+        for mr in missing_ratings:
+            if mr["job_id"] != 3:
+                self.queue.rated.add((mr["job_id"], mr["resume_id"]))
+        return sum(mr["job_id"] != 3 for mr in missing_ratings)
+
+    def test_worker_drains_queue_in_batches(self):
+        batches = []
+
+        def process_batch(missing_ratings):
+            batches.append(missing_ratings)
+            return self._rate(missing_ratings)
+
+        stored = rating_queue.run_worker(process_batch, owner="w", batch_size=2)
+        self.assertEqual(stored, 4)
+        self.assertEqual([len(b) for b in batches], [2, 2, 1])
+        self.assertEqual(
+            batches[0], [{"job_id": 0, "resume_id": 1}, {"job_id": 1, "resume_id": 1}]
+        )
+        # The failed pair is released instead of acknowledged and every lease is gone.
+        self.assertEqual(self.queue.failed, [(3, 1)])
+        self.assertEqual(self.queue.leased, {})
+
+    def test_failed_batch_is_released(self):
+        def process_batch(missing_ratings):
+            raise Exception("boom")
+
+        stored = rating_queue.run_worker(process_batch, owner="w", max_batches=1)
+        self.assertEqual(stored, 0)
+        self.assertEqual(len(self.queue.failed), 5)
+
+    def test_worker_stops_at_max_pairs(self):
+        sizes = []
+
+        def process_batch(missing_ratings):
+            sizes.append(len(missing_ratings))
+            return self._rate(missing_ratings)
+
+        rating_queue.run_worker(process_batch, owner="w", batch_size=2, max_pairs=3)
+        self.assertEqual(sizes, [2, 1])
+        self.assertEqual(len(self.queue.pending), 2)
+
+    def test_worker_stops_at_deadline(self):
+        calls = []
+        stored = rating_queue.run_worker(
+            calls.append, owner="w", deadline=time.monotonic()
+        )
+        self.assertEqual(stored, 0)
+        self.assertEqual(calls, [])
+        self.assertEqual(len(self.queue.pending), 5)
+
+    def test_drained_worker_reports_exhausted_pairs(self):
+        self.queue.exhausted = 2
+        with self.assertLogs(rating_queue.logger, "WARNING") as logs:
+            rating_queue.run_worker(self._rate, owner="w")
+        self.assertIn("2 pairs", logs.output[0])
+
+    def test_full_rescan_retries_exhausted_pairs(self):
+        rating_queue.enqueue_missing_ratings()
+        rating_queue.enqueue_missing_ratings(full_rescan=True)
+        self.assertEqual(
+            self.queue.enqueued,
+            [
+                {"full_rescan": False, "max_attempts": rating_queue.MAX_ATTEMPTS},
+                {"full_rescan": True, "max_attempts": rating_queue.MAX_ATTEMPTS},
+            ],
+        )
+        self.assertIn(
+            "WHERE %(full_rescan)s AND rating_queue.attempts >= %(max_attempts)s",
+            db_queries.enqueue_missing_ratings,
+        )
+
+    def test_worker_stops_claiming_when_asked(self):
+        stop = threading.Event()
+        sizes = []
+
+        def process_batch(missing_ratings):
+            sizes.append(len(missing_ratings))
+            stop.set()
+            return self._rate(missing_ratings)
+
+        rating_queue.run_worker(process_batch, owner="w", batch_size=2, stop=stop)
+        # The batch running when stop is set is finished and acknowledged.
+        self.assertEqual(sizes, [2])
+        self.assertEqual(len(self.queue.pending), 3)
+        self.assertEqual(self.queue.leased, {})
+
+    def test_workers_get_different_pairs(self):
+        first = rating_queue.claim("a", batch_size=3)
+        second = rating_queue.claim("b", batch_size=3)
+        self.assertEqual(len(first) + len(second), 5)
+        self.assertFalse(
+            {(mr["job_id"], mr["resume_id"]) for mr in first}
+            & {(mr["job_id"], mr["resume_id"]) for mr in second}
+        )
+
+
+@unittest.skipUnless(TEST_DATABASE_URL, "TEST_DATABASE_URL is not set")
+class TestRatingQueueQueries(unittest.TestCase):
+    """
+    Runs the queue queries on Postgres: user 1 searches jobs 1 to 3 with resume 1.
+    """
+
+    def setUp(self):
+        self.connection = psycopg2.connect(TEST_DATABASE_URL)
+        self.addCleanup(self.connection.close)
+        self.addCleanup(self.connection.rollback)
+        self.cursor = self.connection.cursor()
+        self.cursor.execute(TEST_SCHEMA)
+        self.cursor.execute(db_queries.create_rating_queue)
+        self.cursor.execute(db_queries.create_incremental_missing_ratings)
+        self.cursor.execute(
+            """
+            INSERT INTO public.job (id, job_url) SELECT i, 'https://example.com/' || i FROM generate_series(1, 3) as i;
+            INSERT INTO public.search (id, user_id) VALUES (1, 'u1');
+            INSERT INTO public.search_job (search_id, job_id) SELECT 1, i FROM generate_series(1, 3) as i;
+            INSERT INTO public.resume (id, user_id, is_active) VALUES (1, 'u1', true);
+            """
+        )
+
+    def _run(self, query: str, **params) -> list | int:
+        self.cursor.execute(query, params)
+        if self.cursor.description is None:
+            return self.cursor.rowcount
+        return sorted(self.cursor.fetchall())
+
+    def _enqueue(self, full_rescan: bool = False) -> None:
+        self._run(
+            db_queries.enqueue_missing_ratings,
+            full_rescan=full_rescan,
+            max_attempts=rating_queue.MAX_ATTEMPTS,
+        )
+
+    def _claim(self, owner: str, batch_size: int = 10) -> list:
+        return self._run(
+            db_queries.claim_rating_queue,
+            owner=owner,
+            lease_seconds=60,
+            batch_size=batch_size,
+            max_attempts=rating_queue.MAX_ATTEMPTS,
+        )
+
+    def _rate(self, job_id: int) -> None:
+        self._run(
+            "INSERT INTO public.rating (job_id, resume_id, user_id, rating) VALUES (%(job_id)s, 1, 'u1', 5)",
+            job_id=job_id,
+        )
+
+    def _queue(self) -> list:
+        return self._run(
+            "SELECT job_id, lease_owner, attempts FROM public.rating_queue"
+        )
+
+    def test_enqueue_claim_and_ack(self):
+        self._enqueue()
+        self._enqueue()
+        self.assertEqual(self._queue(), [(1, None, 0), (2, None, 0), (3, None, 0)])
+        self.assertEqual(
+            self._run(
+                "SELECT count(*) FROM public.search WHERE last_processed is Null"
+            ),
+            [(0,)],
+        )
+
+        first = self._claim("a", batch_size=2)
+        second = self._claim("b")
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse(set(first) & set(second))
+
+        self._rate(first[0][0])
+        self._run(db_queries.ack_rating_queue, owner="a", retry_seconds=0)
+        # The rated pair is gone, the other one is released with a failed attempt.
+        self.assertEqual(
+            [row for row in self._queue() if row[1] != "b"],
+            [(first[1][0], None, 1)],
+        )
+
+    def test_expired_lease_of_a_rated_pair_is_not_claimed_again(self):
+        self._enqueue()
+        claimed = self._claim("a")
+        # The worker stored the ratings of jobs 1 and 2 and died before the ack.
+        self._rate(1)
+        self._rate(2)
+        self._run(
+            "UPDATE public.rating_queue SET leased_until = now() - interval '1 minute'"
+        )
+
+        self.assertEqual(len(claimed), 3)
+        self.assertEqual(self._claim("b"), [(3, 1)])
+        self.assertEqual(self._queue(), [(3, "b", 0)])
+        self.assertEqual(
+            self._run("SELECT job_id, count(*) FROM public.rating GROUP BY job_id"),
+            [(1, 1), (2, 1)],
+        )
+
+    def test_full_rescan_retries_exhausted_pairs(self):
+        self._enqueue()
+        self._run(
+            "UPDATE public.rating_queue SET attempts = %(max_attempts)s WHERE job_id = 1",
+            max_attempts=rating_queue.MAX_ATTEMPTS,
+        )
+        self.assertEqual(
+            self._run(
+                db_queries.count_exhausted_rating_queue,
+                max_attempts=rating_queue.MAX_ATTEMPTS,
+            ),
+            [(1,)],
+        )
+        self.assertEqual(self._claim("a"), [(2, 1), (3, 1)])
+
+        self._enqueue()
+        self.assertEqual(self._queue()[0], (1, None, rating_queue.MAX_ATTEMPTS))
+        self._enqueue(full_rescan=True)
+        self.assertEqual(self._queue()[0], (1, None, 0))
+        self.assertEqual(self._claim("b"), [(1, 1)])
+
+    def test_lease_and_release_jobs(self):
+        self._enqueue()
+        self.assertEqual(self._claim("a", batch_size=1), [(1, 1)])
+
+        leased = self._run(
+            db_queries.lease_missing_ratings_for_jobs,
+            job_ids=[1, 2, 3],
+            owner="p",
+            lease_seconds=60,
+            max_attempts=rating_queue.MAX_ATTEMPTS,
+        )
+        # The pair leased by the queue worker is left to it.
+        self.assertEqual(leased, [(2, 1), (3, 1)])
+
+        self._rate(2)
+        self._run(db_queries.release_rating_queue, owner="p")
+        # The unrated pair goes back to the queue without a failed attempt.
+        self.assertEqual(self._queue(), [(1, "a", 0), (3, None, 0)])
+        self.assertEqual(self._claim("b"), [(3, 1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
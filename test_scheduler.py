@@ -0,0 +1,91 @@
+import datetime
+import unittest
+from unittest.mock import patch
+
+import scheduler
+
+NOW = datetime.datetime(2024, 1, 1, 12, tzinfo=datetime.UTC)
+
+
+def _search(search_id, last_search=None, hours=3):
+    return {
+        "id": search_id,
+        "last_search": last_search,
+        "refresh_interval": datetime.timedelta(hours=hours),
+    }
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.due_searches = [
+            _search(1, NOW - datetime.timedelta(hours=2)),
+            _search(2, NOW - datetime.timedelta(hours=5)),
+            _search(3),
+        ]
+        patcher = patch.object(
+            scheduler.searches,
+            "get_due_searches",
+            side_effect=lambda **kwargs: list(self.due_searches),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pops_searches_by_due_time(self):
+        s = scheduler.Scheduler(lambda due: None, max_jitter=0)
+        now = NOW.timestamp()
+        self.assertTrue(s.refresh(now))
+        # Overdue and never scraped searches are due right away, the other one in an hour.
+        self.assertEqual({search["id"] for search in s.pop_due(now)}, {2, 3})
+        self.assertEqual(s.pop_due(now + 3599), [])
+        self.assertEqual(s.next_wakeup(), now + 3600)
+        self.assertEqual([search["id"] for search in s.pop_due(now + 3600)], [1])
+
+    def test_limits_searches_per_tick(self):
+        s = scheduler.Scheduler(lambda due: None, max_jitter=0, max_searches_per_tick=1)
+        now = NOW.timestamp()
+        s.refresh(now)
+        self.assertEqual(len(s.pop_due(now)), 1)
+        self.assertEqual(len(s.pop_due(now)), 1)
+        self.assertEqual(s.pop_due(now), [])
+
+    def test_refresh_drops_deleted_searches(self):
+        s = scheduler.Scheduler(lambda due: None, max_jitter=0)
+        now = NOW.timestamp()
+        s.refresh(now)
+        self.due_searches = [_search(3)]
+        s.refresh(now)
+        self.assertEqual([search["id"] for search in s.pop_due(now + 7200)], [3])
+
+    def test_run_scrapes_due_searches_until_stopped(self):
+        scraped = []
+
+        def scrape(due):
+            scraped.extend(search["id"] for search in due)
+            s.stop()
+
+        now = datetime.datetime.now(datetime.UTC)
+        self.due_searches = [
+            _search(1, now - datetime.timedelta(hours=2)),
+            _search(2, now - datetime.timedelta(hours=5)),
+        ]
+        s = scheduler.Scheduler(scrape, max_jitter=0)
+        s.run()
+        self.assertEqual(scraped, [2])
+
+    def test_run_waits_for_processing_to_see_the_stop(self):
+        events = []
+
+        def process(stop):
+            events.append(stop)
+            # Like a worker claiming batches until it is told to stop.
+            while not stop.wait(0.01):
+                pass
+
+        s = scheduler.Scheduler(lambda due: s.stop(), process=process, max_jitter=0)
+        s.run()
+        self.assertEqual(events, [s._stop])
+        self.assertTrue(events[0].is_set())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import threading
+import time
+import unittest
+
+from scrape_executor import run_scrape_units
+
+
+def _unit(search_id, job_source):
+    return {
+        "search": {"id": search_id},
+        "job_source": job_source,
+        "search_term": "python",
+        "is_new_search": False,
+        "proxies": None,
+    }
+
+
+class TestRunScrapeUnits(unittest.TestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.max_running = {}
+
+    def _scrape_unit(self, unit):
+        board = unit["job_source"]
+        with self.lock:
+            self.running[board] = self.running.get(board, 0) + 1
+            self.max_running[board] = max(
+                self.max_running.get(board, 0), self.running[board]
+            )
+        time.sleep(0.01)
+        with self.lock:
+            self.running[board] -= 1
+        if unit["search"]["id"] == 0:
+            raise ValueError("blocked")
+
+    def test_respects_board_concurrency(self):
+        units = [_unit(i, "linkedin") for i in range(6)] + [
+            _unit(i, "indeed") for i in range(6)
+        ]
+        done = []
+
+        errors = run_scrape_units(
+            units,
+            self._scrape_unit,
+            max_workers=4,
+            board_concurrency={"linkedin": 1, "indeed": 3},
+            on_unit_done=lambda unit, error: done.append(unit),
+        )
+
+        self.assertEqual(self.max_running, {"linkedin": 1, "indeed": 3})
+        self.assertEqual(len(done), len(units))
+        self.assertEqual(
+            sorted((e["unit"]["job_source"], e["error"]) for e in errors),
+            [("indeed", "blocked"), ("linkedin", "blocked")],
+        )
+
+    def test_stops_starting_units_at_deadline(self):
+        units = [_unit(i, "indeed") for i in range(1, 7)]
+        done = []
+
+        def scrape_unit(unit):
+            time.sleep(0.05)
+
+        run_scrape_units(
+            units,
+            scrape_unit,
+            max_workers=2,
+            board_concurrency={"indeed": 2},
+            on_unit_done=lambda unit, error: done.append(unit),
+            deadline=time.monotonic() + 0.02,
+        )
+
+        # The two units started before the deadline finish, the rest are never started.
+        self.assertEqual(len(done), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
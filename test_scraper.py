@@ -1,5 +1,9 @@
 import unittest
-from scraper import _format_jobs
+from datetime import date
+from unittest import mock
+
+import scraper
+from scraper import _format_jobs, _try_insert_jobs, _try_insert_search_jobs
 import pandas as pd
 import numpy as np
 
@@ -71,6 +75,165 @@ class TestFormatJobs(unittest.TestCase):
         result = _format_jobs(self.jobs_df)
         self.assertEqual(result[0], self.expected)
 
+    def test_format_jobs_coerces_columns(self):
+        jobs_df = pd.DataFrame(
+            {
+                "id": ["a", "b", "c"],
+                "title": ["Engineer", np.nan, 3],
+                "date_posted": [pd.Timestamp("2024-05-02 10:00"), pd.NaT, None],
+                "min_amount": [1000.0, np.nan, 2000.0],
+                "is_remote": [True, None, 1],
+                "company": [date(2024, 1, 1), "Company", None],
+            }
+        )
+        result = _format_jobs(jobs_df)
+        self.assertEqual([job["title"] for job in result], ["Engineer", None, None])
+        self.assertEqual(
+            [job["date_posted"] for job in result], ["2024-05-02", None, None]
+        )
+        self.assertEqual([job["min_amount"] for job in result], [None, None, None])
+        self.assertEqual([job["is_remote"] for job in result], [True, None, None])
+        self.assertEqual([job["company"] for job in result], [None, "Company", None])
+        self.assertEqual([job["site_id"] for job in result], ["a", "b", "c"])
+        self.assertIsNone(result[0]["description"])
+        self.assertEqual(_format_jobs(pd.DataFrame()), [])
+
+
+class TestTryInsertJobs(unittest.TestCase):
+    def setUp(self):
+        self.supabase = mock.MagicMock()
+        for patcher in (
+            mock.patch.object(
+                scraper.common, "get_supabase_client", return_value=self.supabase
+            ),
+            mock.patch.object(scraper, "near_duplicates", mock.MagicMock()),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.table = self.supabase.table.return_value
+
+    def test_insert_jobs_batch(self):
+        self.table.select.return_value.in_.return_value.execute.return_value.data = [
+            {"id": 1, "job_url": "https://a", "matched_words": "python"}
+        ]
+        self.table.upsert.return_value.execute.return_value.data = [
+            {"id": 2, "job_url": "https://b"}
+        ]
+        jobs = [
+            {"job_url": "https://a", "matched_words": "python, java"},
+            {"job_url": "https://b", "matched_words": "python"},
+            {"job_url": "https://b", "matched_words": "python"},
+        ]
+
+        result = _try_insert_jobs(jobs)
+
+        self.assertEqual([job["id"] for job in result], [1, 2])
+        self.table.select.assert_called_once()
+        upserts = [call.args[0] for call in self.table.upsert.call_args_list]
+        self.assertEqual(
+            upserts,
+            [
+                [{"id": 1, "job_url": "https://a", "matched_words": "python,java"}],
+                [{"job_url": "https://b", "matched_words": "python", "id": 2}],
+            ],
+        )
+
+    def test_job_stored_concurrently_is_merged_not_overwritten(self):
+        self.table.select.return_value.in_.return_value.execute.side_effect = [
+            mock.MagicMock(data=[]),
+            # Another unit stored the job between the lookup and the insert.
+            mock.MagicMock(
+                data=[{"id": 5, "job_url": "https://b", "matched_words": "java"}]
+            ),
+        ]
+        self.table.upsert.return_value.execute.return_value.data = []
+
+        result = _try_insert_jobs([{"job_url": "https://b", "matched_words": "python"}])
+
+        self.assertEqual([job["id"] for job in result], [5])
+        insert, update = self.table.upsert.call_args_list
+        self.assertTrue(insert.kwargs["ignore_duplicates"])
+        self.assertEqual(
+            update.args[0],
+            [{"id": 5, "job_url": "https://b", "matched_words": "java,python"}],
+        )
+        scraper.near_duplicates.assign_clusters.assert_called_once_with([])
+
+    def test_insert_search_jobs_batch(self):
+        self.table.upsert.return_value.execute.return_value.data = [
+            {"search_id": 1, "job_id": 3}
+        ]
+        search_jobs = [
+            {"search_id": 1, "job_id": 2},
+            {"search_id": 1, "job_id": 3},
+            {"search_id": 1, "job_id": 3},
+        ]
+
+        self.assertEqual(_try_insert_search_jobs(search_jobs), (1, 1))
+        self.table.upsert.assert_called_once_with(
+            search_jobs[:2],
+            on_conflict="search_id,job_id",
+            ignore_duplicates=True,
+            default_to_null=False,
+        )
+
+
+class TestCoalesceScrapeUnits(unittest.TestCase):
+    def _search(self, search_id, search_term, results_wanted, location="Madrid"):
+        return {
+            "id": search_id,
+            "job_source": "indeed,linkedin",
+            "search_term": search_term,
+            "location": location,
+            "results_wanted": results_wanted,
+            "country": "spain",
+        }
+
+    def test_coalesce_scrape_units(self):
+        units = (
+            scraper.build_scrape_units(self._search(1, "python", 10))
+            + scraper.build_scrape_units(self._search(2, "Python, sql", 30))
+            + scraper.build_scrape_units(self._search(3, "python", 20, "Paris"))
+        )
+        coalesced = scraper.coalesce_scrape_units(units)
+        # 8 units, indeed and linkedin python in Madrid are shared by searches 1 and 2.
+        self.assertEqual(len(units), 8)
+        self.assertEqual(len(coalesced), 6)
+        shared = [u for u in coalesced if len(u["searches"]) > 1]
+        self.assertEqual(len(shared), 2)
+        for unit in shared:
+            self.assertEqual([s["id"] for s in unit["searches"]], [1, 2])
+            self.assertEqual(unit["results_wanted"], 30)
+        # The units of the input are left untouched.
+        self.assertEqual(len(units[0]["searches"]), 1)
+        self.assertEqual(units[0]["results_wanted"], 10)
+
+    def test_scrape_links_jobs_to_every_search(self):
+        unit = scraper.coalesce_scrape_units(
+            scraper.build_scrape_units(self._search(1, "python", 10))[:1]
+            + scraper.build_scrape_units(self._search(2, "python, sql", 30))[:1]
+        )[0]
+        jobs = [{"id": 7, "job_url": "https://example.com/7"}]
+        with mock.patch.object(
+            scraper, "scrape_jobs"
+        ) as scrape_jobs, mock.patch.object(
+            scraper, "_format_jobs", return_value=jobs
+        ), mock.patch.object(
+            scraper, "_try_insert_jobs", side_effect=lambda jobs: jobs
+        ), mock.patch.object(
+            scraper, "_try_insert_search_jobs", return_value=(2, 0)
+        ) as insert_search_jobs:
+            stored = []
+            scraper.scrape_and_store_unit(unit, on_jobs_stored=stored.append)
+        self.assertEqual(scrape_jobs.call_count, 1)
+        # The job is handed over once, though it is linked to two searches.
+        self.assertEqual(stored, [[7]])
+        self.assertEqual(scrape_jobs.call_args.kwargs["results_wanted"], 30)
+        self.assertEqual(jobs[0]["matched_words"], "python,sql")
+        insert_search_jobs.assert_called_once_with(
+            [{"search_id": 1, "job_id": 7}, {"search_id": 2, "job_id": 7}]
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,45 @@
+import datetime
+import unittest
+from unittest.mock import patch
+
+import db_queries
+import searches
+
+
+class TestSearches(unittest.TestCase):
+    def test_get_due_searches_maps_columns(self):
+        row = (
+            1,
+            "indeed",
+            "python",
+            "Madrid",
+            10,
+            "spain",
+            None,
+            datetime.timedelta(hours=1),
+        )
+        with patch.object(searches.my_db, "run_query", return_value=[row]) as run_query:
+            due = searches.get_due_searches(datetime.timedelta(hours=2), limit=5)
+        run_query.assert_called_once_with(
+            db_queries.due_searches,
+            {"default_refresh_interval": 7200.0, "horizon": 0.0, "limit": 5},
+        )
+        self.assertEqual(due[0]["id"], 1)
+        self.assertEqual(due[0]["search_term"], "python")
+        self.assertEqual(due[0]["refresh_interval"], datetime.timedelta(hours=1))
+
+    def test_get_due_searches_failure(self):
+        with patch.object(searches.my_db, "run_query", return_value=None):
+            self.assertIsNone(searches.get_due_searches())
+
+    def test_mark_searches_updated_in_one_statement(self):
+        with patch.object(searches.my_db, "execute", return_value=3) as execute:
+            self.assertTrue(searches.mark_searches_updated(iter([1, 2, 3])))
+            self.assertTrue(searches.mark_searches_updated([]))
+        execute.assert_called_once_with(
+            db_queries.mark_searches_updated, {"search_ids": [1, 2, 3]}
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+
+import numpy as np
+
+from similarity import pair_similarities, select_pairs
+
+
+class TestSimilarity(unittest.TestCase):
+    def test_pair_similarities(self):
+        jobs = {
+            1: "Python developer working on Django and PostgreSQL",
+            2: "Registered nurse for the night shift",
+        }
+        resumes = {10: "Backend developer, Python, Django, PostgreSQL, Docker"}
+
+        similarities = pair_similarities(jobs, resumes, [(1, 10), (2, 10)])
+
+        self.assertGreater(similarities[0], 0.3)
+        self.assertEqual(similarities[1], 0)
+
+    def test_select_pairs_keeps_top_k_and_above_threshold(self):
+        similarities = np.array([0.01, 0.5, 0.02, 0.03, 0.04, 0.6])
+        resume_ids = np.array([1, 1, 1, 2, 2, 2])
+
+        keep = select_pairs(similarities, resume_ids, top_k=2, min_similarity=0.4)
+
+        self.assertEqual(keep.tolist(), [False, True, True, False, True, True])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+import unittest
+
+# Max seconds to import the entry points, well above what it takes without the heavy libraries.
+STARTUP_BUDGET_SECONDS = 1.5
+# Libraries only needed once a client is used or jobs are scraped.
+DEFERRED_MODULES = ("openai", "supabase", "jobspy", "pandas", "PyPDF2", "requests")
+
+
+def _import(module: str) -> tuple[float, set[str]]:
+    """
+    Imports the module in a fresh interpreter without any credentials, so building a client or calling an API at
+    import time fails.
+    :return: Tuple of (seconds it took, modules loaded).
+    """
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "print(time.perf_counter() - start)\n"
+        "print(','.join(sys.modules))\n"
+    )
+    env = {
+        key: value
+        for key, value in os.environ.items()
+        if not key.startswith(("SUPABASE_", "OPENAI_"))
+    }
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+    )
+    seconds, modules = result.stdout.strip().splitlines()[-2:]
+    return float(seconds), set(modules.split(","))
+
+
+class TestStartup(unittest.TestCase):
+    def test_entry_points_import_fast_without_side_effects(self):
+        for module in ("main", "processor", "scraper", "health"):
+            with self.subTest(module=module):
+                seconds, modules = _import(module)
+                self.assertFalse(set(DEFERRED_MODULES) & modules)
+                self.assertLess(seconds, STARTUP_BUDGET_SECONDS)
+
+
+if __name__ == "__main__":
+    unittest.main()